@@ -0,0 +1,384 @@
+#!/usr/bin/python
+
+"""
+Benchmark of the SAND header parser (sand.header).
+
+Synthetic headers are generated for each message type known by
+sand.header.header_name_to_checker, with lists of 1 to 100000 entries,
+valid and invalid, and adversarial values meant to trigger worst case
+behaviours of the parser (long quoted strings, long runs of separators...).
+For check_header and check_headers, the benchmark reports headers/s,
+bytes/s and the memory allocated while parsing, and can compare the
+results with a baseline saved by a previous run.
+
+Usage (from the repository root):
+    python benchmarks/header_bench.py [--max-list N] [--json results.json]
+    python benchmarks/header_bench.py --save-baseline baseline.json
+    python benchmarks/header_bench.py --baseline baseline.json [--threshold 0.2]
+
+With --baseline, the exit status is 1 if a case is slower than in the
+baseline by more than the threshold (a fraction of the baseline throughput).
+
+Allocations are measured with tracemalloc when it is available (peak
+bytes allocated per header). Otherwise the growth of the peak resident
+memory of the process during a case is reported, which only shows
+cases allocating more than the memory already used.
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sand.header import check_header, check_headers, configure_parse_cache, \
+    header_name_to_checker
+
+# List lengths of the list messages
+LIST_LENGTHS = (1, 10, 100, 1000, 10000, 100000)
+
+# Size of the adversarial values, in characters
+ADVERSARIAL_SIZE = 10000
+
+# Minimum time spent on a case, in seconds (a case runs at least once)
+DEFAULT_MIN_TIME = 0.2
+
+# Number of times a case is measured, the best throughput is kept
+DEFAULT_REPEAT = 3
+
+# Default regression threshold, as a fraction of the baseline throughput
+DEFAULT_THRESHOLD = 0.2
+
+# Header names, as written in HTTP messages
+header_names = dict((name.lower(), name) for name in (
+    'SAND-AnticipatedRequests', 'SAND-SharedResourceAllocation',
+    'SAND-AcceptedAlternatives', 'SAND-AbsoluteDeadline', 'SAND-MaxRTT',
+    'SAND-NextAlternatives', 'SAND-ClientCapabilities',
+    'SAND-DeliveredAlternative'))
+
+# Other headers of the responses given to check_headers
+companion_headers = [
+    ('Warning', '214 Transformation Applied'),
+    ('ContentLocation', 'http://cdn.example.com/alt/seg-1.m4s'),
+    ('Vary', 'Accept, SAND-AcceptedAlternatives'),
+    ('Content-Type', 'video/mp4'),
+    ('Cache-Control', 'max-age=60'),
+]
+
+def datetime_value(rnd):
+    return '2016%02d%02dT%02d%02d%02d%sZ' % (
+        rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 23),
+        rnd.randint(0, 59), rnd.randint(0, 59),
+        rnd.choice(('', '.5', '.123456')))
+
+def url_value(rnd):
+    return '"http://cdn%d.example.com/content/rep-%d/seg-%d.m4s?token=a%%20b"' % (
+        rnd.randint(1, 9), rnd.randint(1, 8), rnd.randint(1, 100000))
+
+def envelope(rnd):
+    """Returns optional envelope and common attributes."""
+    attributes = []
+    if rnd.random() < 0.5:
+        attributes.append('senderId="client-%d"' % rnd.randint(1, 1000))
+    if rnd.random() < 0.5:
+        attributes.append('generationTime=%s' % datetime_value(rnd))
+    if rnd.random() < 0.3:
+        attributes.append('messageId=%d' % rnd.randint(1, 1000))
+    return attributes
+
+def with_list(attributes, items):
+    return ','.join(attributes + ['[%s]' % ';'.join(items)])
+
+def anticipated_requests(rnd, length):
+    items = []
+    for _ in range(length):
+        item = ['sourceUrl=%s' % url_value(rnd), 'targetTime=%s' % datetime_value(rnd)]
+        if rnd.random() < 0.5:
+            item.append('range=%d-%d' % (rnd.randint(0, 1000), rnd.randint(1000, 9000)))
+        items.append(','.join(item))
+    return with_list(envelope(rnd), items)
+
+def shared_resource_allocation(rnd, length):
+    # optional attributes must be the same for all operation points
+    with_quality = rnd.random() < 0.5
+    items = []
+    for _ in range(length):
+        item = ['bandwidth=%d' % rnd.randint(100000, 8000000)]
+        if with_quality:
+            item.append('quality=%d' % rnd.randint(1, 10))
+        items.append(','.join(item))
+    attributes = envelope(rnd) + [
+        'weight=%d' % rnd.randint(1, 10),
+        'allocationStrategy="urn:mpeg:dash:sand:allocation:weighted:2016"',
+        'mpdUrl="http://cdn.example.com/content/manifest.mpd"']
+    return with_list(attributes, items)
+
+def alternatives(rnd, length):
+    items = []
+    for _ in range(length):
+        item = ['sourceUrl=%s' % url_value(rnd)]
+        if rnd.random() < 0.5:
+            item.append('bandwidth=%d' % rnd.randint(100000, 8000000))
+        if rnd.random() < 0.3:
+            item.append('deliveryScope=%d' % rnd.randint(0, 3))
+        items.append(','.join(item))
+    return with_list(envelope(rnd), items)
+
+def absolute_deadline(rnd, length):
+    return ','.join(envelope(rnd) + ['deadline=%s' % datetime_value(rnd)])
+
+def max_rtt(rnd, length):
+    return ','.join(envelope(rnd) + ['maxRTT=%d' % rnd.randint(1, 5000)])
+
+def client_capabilities(rnd, length):
+    codes = [12] + [rnd.randint(1, 21) for _ in range(length - 1)]
+    return ','.join(envelope(rnd) + [
+        'supportedMessage=[%s]' % ','.join(map(str, codes)),
+        'messageSetUri="urn:mpeg:dash:sand:messageset:all:2016"'])
+
+def delivered_alternative(rnd, length):
+    return ','.join(envelope(rnd) + [
+        'initialUrl=%s' % url_value(rnd),
+        'contentLocation="http://cdn.example.com/alt/seg-1.m4s"'])
+
+# Generator of a valid value for each header, and whether it has a list
+generators = {
+    'sand-anticipatedrequests': (anticipated_requests, True),
+    'sand-sharedresourceallocation': (shared_resource_allocation, True),
+    'sand-acceptedalternatives': (alternatives, True),
+    'sand-absolutedeadline': (absolute_deadline, False),
+    'sand-maxrtt': (max_rtt, False),
+    'sand-nextalternatives': (alternatives, True),
+    'sand-clientcapabilities': (client_capabilities, True),
+    'sand-deliveredalternative': (delivered_alternative, False),
+}
+
+def invalidate(rnd, value):
+    """Returns value with an error: a bad attribute value, an unknown
+    attribute, a missing separator or an unterminated list."""
+    mutation = rnd.randrange(4)
+    if mutation == 0:
+        return value.replace('=', '=x', 1)
+    if mutation == 1:
+        return value + ',unknownAttribute=1'
+    if mutation == 2:
+        return value.replace(',', ' ', 1) if ',' in value else value + ' x'
+    return value.rstrip(']') if value.endswith(']') else '[' + value
+
+def adversarial_values(size):
+    """Yields (name, value) of values meant to make the parser slow."""
+    half = size // 2
+    yield 'escaped-quotes', 'senderId="%s",maxRTT=1' % ('\\"' * half)
+    yield 'unterminated-quote', 'senderId="%s' % ('a\\' * half)
+    yield 'quote-runs', 'senderId=%s' % ('"' * size)
+    yield 'long-uri', 'contentLocation="http://%s"' % ('a%20' * (size // 4))
+    yield 'uri-scheme-like', 'contentLocation="%s' % ('a:' * half)
+    yield 'separators', ',' * size
+    yield 'brackets', '[' * size
+    yield 'empty-items', '[%s]' % (';' * size)
+    yield 'long-int', 'maxRTT=%s' % ('9' * size)
+    yield 'datetime-prefix', 'deadline=%s' % ('20160601T' * (size // 9))
+    yield 'long-name', '%s=1' % ('a' * size)
+    yield 'range-digits', '[sourceUrl="http://a",range=%s-]' % ('1' * size)
+
+def typed_adversarial_values(size):
+    """Yields (name, header name, value) of truncated or crafted values of
+    each SAND value type, in a message with an attribute of this type.
+    They are meant to make a backtracking regexp slow: the time to reject
+    them should grow linearly with size."""
+    half = size // 2
+    third = size // 3
+    item = '[sourceUrl="http://a",targetTime=20160601T120000Z,range=%s]'
+    yield 'string-backslashes', 'SAND-MaxRTT', 'senderId="%s' % ('\\' * size)
+    yield 'string-escaped-quotes', 'SAND-MaxRTT', 'senderId="a%s' % ('\\"' * half)
+    yield 'uri-unterminated', 'SAND-DeliveredAlternative', 'contentLocation="http://%s' % ('a' * size)
+    yield 'uri-encoded', 'SAND-DeliveredAlternative', 'contentLocation="%s%%2' % ('%20' * third)
+    yield 'uri-scheme', 'SAND-DeliveredAlternative', 'contentLocation=""a:%s' % ('a' * size)
+    yield 'urn-unterminated', 'SAND-ClientCapabilities', 'messageSetUri="urn:%s' % ('a%20' * (size // 4))
+    yield 'list-unterminated', 'SAND-ClientCapabilities', 'supportedMessage=[%s' % ('12,' * third)
+    yield 'list-empty-code', 'SAND-ClientCapabilities', 'supportedMessage=[%s,]' % ('1' * size)
+    yield 'byterange-digits', 'SAND-AnticipatedRequests', item % ('1' * size)
+    yield 'datetime-fraction', 'SAND-AbsoluteDeadline', 'deadline=20160601T120000.%s' % ('1' * size)
+
+def make_cases(rnd, lengths, adversarial_size):
+    """Returns the cases, as (case name, function, argument, size in bytes, headers)."""
+    cases = []
+    for key in sorted(header_name_to_checker):
+        generator, has_list = generators[key]
+        name = header_names[key]
+        short_name = name[len('SAND-'):]
+        for length in (lengths if has_list else (1,)):
+            valid = generator(rnd, length)
+            invalid = invalidate(rnd, valid)
+            for kind, value in (('valid', valid), ('invalid', invalid)):
+                suffix = '%s/%s/n=%d' % (short_name, kind, length)
+                cases.append(('check_header/' + suffix, check_header,
+                              (name, value), len(value), 1))
+                header_list = [(name, value)] + companion_headers
+                cases.append(('check_headers/' + suffix, check_headers,
+                              (header_list,),
+                              sum(len(n) + len(v) for n, v in header_list),
+                              len(header_list)))
+    for kind, value in adversarial_values(adversarial_size):
+        for name in ('SAND-MaxRTT', 'SAND-AnticipatedRequests',
+                     'SAND-DeliveredAlternative'):
+            cases.append(('check_header/adversarial/%s/%s' % (kind, name[len('SAND-'):]),
+                          check_header, (name, value), len(value), 1))
+    for kind, name, value in typed_adversarial_values(adversarial_size):
+        cases.append(('check_header/adversarial/%s/%s' % (kind, name[len('SAND-'):]),
+                      check_header, (name, value), len(value), 1))
+    return cases
+
+def allocation_meter():
+    """Returns (start, stop, unit): start() starts measuring,
+    stop() returns the measure."""
+    try:
+        import tracemalloc
+    except ImportError:
+        def start():
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        def stop(started):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - started
+        return start, stop, 'maxrss_growth_kb'
+    def start():
+        tracemalloc.start() # the peak is reset when started
+        return tracemalloc.get_traced_memory()[0]
+    def stop(started):
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak - started
+    return start, stop, 'peak_bytes'
+
+def run_case(function, args, min_time):
+    """Calls function(*args) repeatedly for at least min_time.
+    Returns the number of calls and the elapsed time."""
+    calls = 0
+    start = time.time()
+    while True:
+        function(*args)
+        calls += 1
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            return calls, elapsed
+
+def run_benchmark(cases, min_time, repeat=DEFAULT_REPEAT, verbose=True):
+    """Runs the cases and returns a dictionary of results per case name."""
+    alloc_start, alloc_stop, alloc_unit = allocation_meter()
+    results = {}
+    for name, function, args, size, headers in cases:
+        started = alloc_start()
+        function(*args) # also warms up the checker
+        allocated = alloc_stop(started)
+        calls, elapsed = min((run_case(function, args, min_time)
+                              for _ in range(repeat)),
+                             key=lambda (calls, elapsed): elapsed / calls)
+        result = {
+            'headers_per_s': headers * calls / elapsed,
+            'bytes_per_s': size * calls / elapsed,
+            'seconds_per_call': elapsed / calls,
+            'bytes': size,
+            alloc_unit: allocated,
+        }
+        results[name] = result
+        if verbose:
+            print '%-62s %12.1f headers/s %10.2f MB/s %10d %s' % (
+                name, result['headers_per_s'], result['bytes_per_s'] / 1e6,
+                allocated, alloc_unit)
+            sys.stdout.flush()
+    return results
+
+def compare(results, baseline, threshold):
+    """Returns the list of (case name, baseline, current) headers/s
+    of the cases slower than in the baseline by more than threshold."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if result['headers_per_s'] < reference['headers_per_s'] * (1 - threshold):
+            regressions.append((name, reference['headers_per_s'],
+                                result['headers_per_s']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the SAND header parser')
+    parser.add_argument('--max-list', type=int, default=LIST_LENGTHS[-1],
+                        help='largest list length (default: %(default)s)')
+    parser.add_argument('--adversarial-size', type=int, default=ADVERSARIAL_SIZE,
+                        help='size of adversarial values (default: %(default)s)')
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME,
+                        help='minimum time per case in seconds (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='measures per case, the best is kept (default: %(default)s)')
+    parser.add_argument('--filter', default='',
+                        help='only run the cases whose name contains this text')
+    parser.add_argument('--seed', type=int, default=2016)
+    parser.add_argument('--parse-cache', action='store_true',
+                        help='keep the cache of parsed values enabled, so that '
+                        'repeated values measure cache hits instead of parsing')
+    parser.add_argument('--json', help='write the results to this JSON file')
+    parser.add_argument('--save-baseline', help='write the results as a baseline')
+    parser.add_argument('--baseline', help='compare with this baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slow down, as a fraction (default: %(default)s)')
+    options = parser.parse_args()
+
+    if not options.parse_cache:
+        configure_parse_cache(0)
+    rnd = random.Random(options.seed)
+    lengths = [length for length in LIST_LENGTHS if length <= options.max_list]
+    cases = [case for case in make_cases(rnd, lengths, options.adversarial_size)
+             if options.filter in case[0]]
+    results = run_benchmark(cases, options.min_time, options.repeat)
+
+    report = {'python': sys.version.split()[0], 'min_time': options.min_time,
+              'repeat': options.repeat, 'results': results}
+    for path in (options.json, options.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=1, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, options.threshold)
+        for name, reference, current in regressions:
+            print 'REGRESSION %s: %.1f -> %.1f headers/s' % (name, reference, current)
+        if regressions:
+            return 1
+        print 'No regression above %d%%' % (options.threshold * 100)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
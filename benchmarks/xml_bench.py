@@ -0,0 +1,289 @@
+#!/usr/bin/python
+
+"""
+Benchmark of the validation of SAND XML messages (sand.xml_message).
+
+SANDMessage documents are generated for several message types of
+sand/schemas/sand_messages.xsd, from an envelope holding a single small
+message to envelopes of 100000 list entries or messages. For each document
+the benchmark reports:
+- cold: time to validate the first message in a new interpreter, with
+  schemas not compiled yet, with and without the on-disk cache of the
+  compiled Schematron
+- warm: messages/s of from_string and from_file with compiled schemas
+- the mean time spent parsing and validating against the XSD (done at
+  once by a schema-bound parser), and in the Schematron rules (see sand.timing)
+- the peak resident memory of the process after the case.
+Everything runs offline: the schemas and documents are local files.
+
+Usage (from the repository root):
+    python benchmarks/xml_bench.py [--max-size N] [--json results.json]
+
+The peak resident memory is the maximum reached by the process so far, cases
+run from the smallest to the largest document so that it mostly reflects the
+current case.
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import join
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sand import xml_message
+from sand.timing import SCHEMATRON, XML_PARSE_XSD, timing
+
+# Numbers of list entries (or messages) of the generated envelopes
+SIZES = (1, 10, 100, 1000, 10000, 100000)
+
+# Minimum time spent on a warm measure, in seconds (a message is validated
+# at least once)
+DEFAULT_MIN_TIME = 0.2
+
+# Number of cold measures per case, the best is kept
+DEFAULT_COLD_RUNS = 1
+
+SAND_NS = 'urn:mpeg:dash:schema:sandmessage:2016'
+
+def datetime_value(rnd):
+    return '2016-%02d-%02dT%02d:%02d:%02dZ' % (
+        rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 23),
+        rnd.randint(0, 59), rnd.randint(0, 59))
+
+def url_value(rnd):
+    return 'http://cdn%d.example.com/content/rep-%d/seg-%d.m4s' % (
+        rnd.randint(1, 9), rnd.randint(1, 8), rnd.randint(1, 100000))
+
+def anticipated_requests(rnd, size):
+    requests = ''.join('<Request sourceUrl="%s" range="%d-%d" targetTime="%d"/>'
+                       % (url_value(rnd), rnd.randint(0, 1000),
+                          rnd.randint(1000, 9000), rnd.randint(0, 10 ** 9))
+                       for _ in range(size))
+    return '<AnticipatedRequests messageId="1">%s</AnticipatedRequests>' % requests
+
+def shared_resource_allocation(rnd, size):
+    points = ''.join('<OperationPoint bandwidth="%d" quality="%d"/>'
+                     % (rnd.randint(100000, 8000000), rnd.randint(1, 10))
+                     for _ in range(size))
+    return ('<SharedResourceAllocation messageId="2" weight="%d" '
+            'allocationStrategy="urn:mpeg:dash:sand:allocation:weighted:2016" '
+            'mpdUrl="http://cdn.example.com/content/manifest.mpd">%s'
+            '</SharedResourceAllocation>' % (rnd.randint(1, 10), points))
+
+def dane_resource_status(rnd, size):
+    resources = ''.join('<resource bytes="%d-%d">%s</resource>'
+                        % (rnd.randint(0, 1000), rnd.randint(1000, 9000), url_value(rnd))
+                        for _ in range(size))
+    return ('<DaneResourceStatus messageId="3" status="%s">%s</DaneResourceStatus>'
+            % (rnd.choice(('cached', 'unavailable', 'promised')), resources))
+
+def shared_resource_assignment(rnd, size):
+    prices = ''.join('<ResourcePrice>%d.%02d</ResourcePrice>'
+                     % (rnd.randint(0, 100), rnd.randint(0, 99))
+                     for _ in range(size))
+    return ('<SharedResourceAssignment messageId="4" validityTime="%s" '
+            'clientId="client-%d" bandwidth="%d">%s</SharedResourceAssignment>'
+            % (datetime_value(rnd), rnd.randint(1, 1000),
+               rnd.randint(100000, 8000000), prices))
+
+def throughput_messages(rnd, size):
+    # messages checked by Schematron rules, size messages in the envelope
+    return ''.join('<Throughput messageId="%d" baseUrl="%s" guaranteedThroughput="%d" '
+                   'percentage="%d"/>' % (number, url_value(rnd),
+                                          rnd.randint(100000, 8000000),
+                                          rnd.randint(0, 100))
+                   for number in range(size))
+
+def mixed_messages(rnd, size):
+    # all the above, size entries in all
+    part = max(1, size // 5)
+    return ''.join(generator(rnd, part) for generator in
+                   (anticipated_requests, shared_resource_allocation,
+                    dane_resource_status, shared_resource_assignment,
+                    throughput_messages))
+
+generators = [
+    ('AnticipatedRequests', anticipated_requests),
+    ('SharedResourceAllocation', shared_resource_allocation),
+    ('DaneResourceStatus', dane_resource_status),
+    ('SharedResourceAssignment', shared_resource_assignment),
+    ('Throughput', throughput_messages),
+    ('Mixed', mixed_messages),
+]
+
+def sand_message(rnd, generator, size):
+    """Returns a SANDMessage document holding the messages of generator."""
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<SANDMessage xmlns="%s" senderId="dane-%d" generationTime="%s">%s'
+            '</SANDMessage>' % (SAND_NS, rnd.randint(1, 100), datetime_value(rnd),
+                                generator(rnd, size)))
+
+def peak_rss_kb():
+    """Returns the peak resident memory of the process, in kB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+# Run in a new interpreter by measure_cold, with the path of a message
+cold_measure = '''
+import json, sys, time
+from sand.xml_message import XMLValidator
+start = time.time()
+validator = XMLValidator()
+compiled = time.time()
+valid = validator.from_file(sys.argv[1], [])
+print(json.dumps([compiled - start, time.time() - compiled, valid]))
+'''
+
+def measure_cold(path, cache_dir):
+    """Validates the message in path in a new interpreter, so that the
+    schemas are not compiled yet. The compiled Schematron is read from or
+    written to the on-disk cache in cache_dir.
+    Returns (compile seconds, first validation seconds)."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ, SAND_SCHEMA_CACHE=cache_dir)
+    environment.pop('SAND_PREWARM_SCHEMAS', None)
+    output = subprocess.check_output([sys.executable, '-c', cold_measure, path],
+                                     cwd=root, env=environment)
+    compile_time, validation_time, valid = json.loads(output)
+    if not valid:
+        raise ValueError('generated document is not valid')
+    return compile_time, validation_time
+
+def measure_warm(function, argument, min_time):
+    """Validates argument with function for at least min_time.
+    Returns messages/s."""
+    calls = 0
+    start = time.time()
+    while True:
+        if not function(argument, []):
+            raise ValueError('generated document is not valid')
+        calls += 1
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            return calls / elapsed
+
+def measure_phases(validator, document, min_time):
+    """Returns the mean seconds spent in each phase of from_string."""
+    calls = 0
+    start = time.time()
+    with timing() as timer:
+        while calls == 0 or time.time() - start < min_time:
+            validator.from_string(document, [])
+            calls += 1
+    return dict((name, timer.phases.get(name, 0.0) / calls)
+                for name in (XML_PARSE_XSD, SCHEMATRON))
+
+def run_benchmark(sizes, min_time, cold_runs, seed, verbose=True):
+    """Runs all the cases and returns a dictionary of results per case name."""
+    rnd = random.Random(seed)
+    validator = xml_message.XMLValidator()
+    work_dir = tempfile.mkdtemp(prefix='sand-bench-')
+    results = {}
+    try:
+        for size in sizes:
+            for message_name, generator in generators:
+                name = '%s/n=%d' % (message_name, size)
+                document = sand_message(rnd, generator, size)
+                path = join(work_dir, 'message.xml')
+                with open(path, 'w') as f:
+                    f.write(document)
+                colds, colds_cached = [], []
+                for _ in range(cold_runs):
+                    cache_dir = tempfile.mkdtemp(dir=work_dir)
+                    # the first run fills the cache
+                    colds.append(measure_cold(path, cache_dir))
+                    colds_cached.append(measure_cold(path, cache_dir))
+                cold, cold_cached = min(colds, key=sum), min(colds_cached, key=sum)
+                phases = measure_phases(validator, document, min_time)
+                result = {
+                    'bytes': len(document),
+                    'cold_compile_s': cold[0],
+                    'cold_first_message_s': cold[1],
+                    'cold_cached_compile_s': cold_cached[0],
+                    'cold_cached_first_message_s': cold_cached[1],
+                    'from_string_msgs_per_s': measure_warm(validator.from_string,
+                                                           document, min_time),
+                    'from_file_msgs_per_s': measure_warm(validator.from_file,
+                                                         path, min_time),
+                    'xml_parse_xsd_s': phases[XML_PARSE_XSD],
+                    'schematron_s': phases[SCHEMATRON],
+                    'peak_rss_kb': peak_rss_kb(),
+                }
+                results[name] = result
+                if verbose:
+                    print ('%-34s %10d B cold %7.1fms (cached %6.1fms) '
+                           'string %9.1f/s file %9.1f/s parse+xsd %8.3fms '
+                           'sch %8.3fms rss %7d kB' % (
+                               name, result['bytes'],
+                               (cold[0] + cold[1]) * 1e3,
+                               (cold_cached[0] + cold_cached[1]) * 1e3,
+                               result['from_string_msgs_per_s'],
+                               result['from_file_msgs_per_s'],
+                               result['xml_parse_xsd_s'] * 1e3,
+                               result['schematron_s'] * 1e3, result['peak_rss_kb']))
+                    sys.stdout.flush()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of SAND XML message validation')
+    parser.add_argument('--max-size', type=int, default=10000,
+                        help='largest number of entries of an envelope '
+                        '(default: %(default)s, at most ' + str(SIZES[-1]) + ')')
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME,
+                        help='minimum time per warm measure in seconds '
+                        '(default: %(default)s)')
+    parser.add_argument('--cold-runs', type=int, default=DEFAULT_COLD_RUNS,
+                        help='cold measures per case, the best is kept '
+                        '(default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=2016)
+    parser.add_argument('--json', help='write the results to this JSON file')
+    options = parser.parse_args()
+
+    sizes = [size for size in SIZES if size <= options.max_size]
+    results = run_benchmark(sizes, options.min_time, options.cold_runs, options.seed)
+    if options.json:
+        report = {'python': sys.version.split()[0], 'time': time.time(),
+                  'min_time': options.min_time, 'results': results}
+        with open(options.json, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,381 @@
+#!/usr/bin/python
+
+"""
+Bulk validation of SAND messages as HTTP headers, part of SAND conformance server.
+
+This module is part of implementation of a conformance server
+for ISO/IEC 23009-5 SAND.
+It reads the HTTP headers recorded in capture files (HAR files,
+raw HTTP header dumps, JSON lines access logs or JSON arrays of their
+records) and checks the SAND headers they contain with
+sand.header.check_headers.
+Records are streamed from the files and checked by a pool of processes,
+so that files much larger than memory can be audited.
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import json
+import re
+from collections import deque
+from itertools import islice
+
+# multiprocessing and sand.header are imported by the functions needing
+# them, so that the command line can read the constants below quickly
+
+# Supported capture formats
+FORMAT_HAR = 'har'
+FORMAT_RAW = 'raw'
+FORMAT_JSONL = 'jsonl'
+FORMAT_JSON = 'json'
+
+# Name of the test failing for a record which cannot be read
+INVALID_RECORD = 'record'
+
+# Number of records sent at once to a worker process
+DEFAULT_CHUNK_SIZE = 1000
+
+# Size of the blocks read from HAR files
+READ_SIZE = 1 << 16
+
+# Largest item of a JSON array decoded, in characters
+MAX_ITEM_SIZE = 1 << 26
+
+# First line of a request or a response in a raw header dump
+start_line = re.compile(r'(HTTP/\d)|([A-Z]+ \S+ HTTP/\d)')
+
+# Characters changing the structure of a JSON document, outside and inside strings
+structure_token = re.compile(r'["\[\]{},]')
+string_token = re.compile(r'["\\]')
+
+# End of an item of a JSON array
+item_separator = re.compile(r'\s*([,\]])')
+
+def guess_format(file_name):
+    """Returns the capture format corresponding to the file name extension.
+    A .json file is a JSON array of records if it starts with [, and JSON
+    lines otherwise. Files with an unknown extension are considered as raw
+    header dumps."""
+    lowered = file_name.lower()
+    if lowered.endswith('.har'):
+        return FORMAT_HAR
+    if lowered.endswith(('.jsonl', '.ndjson')):
+        return FORMAT_JSONL
+    if lowered.endswith('.json'):
+        with open(file_name) as f:
+            # first character which is not a space
+            first = ''
+            while not first:
+                data = f.read(READ_SIZE)
+                if not data:
+                    break
+                first = data.lstrip()[:1]
+        return FORMAT_JSON if first == '[' else FORMAT_JSONL
+    return FORMAT_RAW
+
+def iter_json_array(f, key, max_item_size=MAX_ITEM_SIZE):
+    """Yields the items of the first JSON array associated to key in file f,
+    or of the first JSON array if key is None (e.g. a document which is an
+    array), decoding one item at a time instead of the whole document.
+    An item not complete in the buffer is scanned for its end as more data
+    is read, and decoded once complete. Raises ValueError if the array is
+    truncated or not valid JSON, or if an item is larger than max_item_size
+    characters."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    if key is None:
+        marker = re.compile(r'\[')
+        key = ''
+    else:
+        marker = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    # Look for the start of the array
+    while True:
+        match = marker.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        data = f.read(READ_SIZE)
+        if not data:
+            return
+        # keep enough characters to find a marker split between two blocks
+        buffer = buffer[-len(key) - 16:] + data
+    pos = 0 # start of the current item
+    scan = 0 # where the scan of the current item goes on
+    depth = 0 # number of objects and arrays open in the current item
+    in_string = False
+    number = 0
+    while True:
+        if scan == pos:
+            # skip separators
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            scan = pos
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            # most items are complete in the buffer: decode them at once
+            try:
+                item, item_end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                pass
+            else:
+                match = item_separator.match(buffer, item_end)
+                if match:
+                    pos = scan = match.start(1)
+                    number += 1
+                    yield item
+                    continue
+        # look for the comma or bracket ending the item
+        end = None
+        while end is None:
+            if in_string:
+                match = string_token.search(buffer, scan)
+                if not match:
+                    scan = len(buffer)
+                    break
+                if match.group() == '\\':
+                    if match.end() == len(buffer):
+                        # escaped character not read yet
+                        scan = match.start()
+                        break
+                    scan = match.end() + 1
+                    continue
+                in_string = False
+            else:
+                match = structure_token.search(buffer, scan)
+                if not match:
+                    scan = len(buffer)
+                    break
+                token = match.group()
+                if token == '"':
+                    in_string = True
+                elif token in '[{':
+                    depth += 1
+                elif depth:
+                    if token != ',':
+                        depth -= 1
+                else:
+                    end = match.start()
+            scan = match.end()
+        if end is None:
+            if scan - pos > max_item_size:
+                raise ValueError('Item %d of JSON array "%s" larger than %d characters'
+                                 % (number, key, max_item_size))
+            # reads grow with the item, so that it is copied a bounded number of times
+            data = f.read(max(READ_SIZE, len(buffer) - pos))
+            if not data:
+                raise ValueError('Truncated JSON array "%s"' % key)
+            buffer = buffer[pos:] + data
+            scan -= pos
+            pos = 0
+            continue
+        try:
+            item, item_end = decoder.raw_decode(buffer, pos)
+        except ValueError as error:
+            raise ValueError('Invalid item %d of JSON array "%s": %s' % (number, key, error))
+        if buffer[item_end:end].strip():
+            raise ValueError('Invalid item %d of JSON array "%s"' % (number, key))
+        pos = scan = end
+        number += 1
+        yield item
+
+def header_text(value):
+    """Returns a header name or value found in a JSON document as a string:
+    numbers and booleans as written in JSON, null as an empty string."""
+    if isinstance(value, basestring):
+        return value
+    if value is None:
+        return ''
+    return json.dumps(value)
+
+def iter_har_records(f):
+    """Yields (record id, header list) for each request and response in a HAR file."""
+    for number, entry in enumerate(iter_json_array(f, 'entries')):
+        for part in ('request', 'response'):
+            headers = entry.get(part, {}).get('headers', [])
+            yield ('entries[%d].%s' % (number, part), header_pairs(headers))
+
+def iter_raw_records(f):
+    """Yields (record id, header list) for each block of a raw HTTP header dump.
+    Blocks are separated by empty lines and may start with a request or status line.
+    The record id is the line number where the block starts."""
+    headers = []
+    first_line = None
+    for number, line in enumerate(f, 1):
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            if headers:
+                yield ('line %d' % first_line, headers)
+            headers = []
+            first_line = None
+            continue
+        if first_line is None:
+            first_line = number
+            if start_line.match(line):
+                continue
+        if line[0] in ' \t' and headers:
+            # continuation of previous header value (obsolete line folding)
+            name, value = headers[-1]
+            headers[-1] = (name, value + ' ' + line.strip())
+        elif ':' in line:
+            name, value = line.split(':', 1)
+            headers.append((name.strip(), value.strip()))
+    if headers:
+        yield ('line %d' % first_line, headers)
+
+def header_pairs(headers):
+    """Converts headers found in a JSON record into a list of (name, value).
+    They may be given as an object, as a list of [name, value] or as a list
+    of {"name": name, "value": value} (as in HAR files).
+    Names and values which are not strings are converted by header_text."""
+    if isinstance(headers, dict):
+        return [(header_text(name), header_text(value))
+                for name, value in headers.items()]
+    result = []
+    for header in headers:
+        if isinstance(header, dict):
+            name, value = header.get('name', ''), header.get('value', '')
+        else:
+            name, value = header
+        result.append((header_text(name), header_text(value)))
+    return result
+
+class InvalidRecord:
+    """Given by a record reader instead of the header list of a record which
+    cannot be read, so that the record fails without stopping the others."""
+
+    def __init__(self, error):
+        self.error = error
+
+def json_record_headers(record_id, record):
+    """Yields (record id, header list) for the headers of a record of an
+    access log, found in the fields headers, request_headers and
+    response_headers."""
+    if not isinstance(record, dict):
+        yield (record_id, InvalidRecord('Record is not a JSON object'))
+        return
+    for field in ('headers', 'request_headers', 'response_headers'):
+        if field in record:
+            try:
+                headers = header_pairs(record[field])
+            except (TypeError, ValueError):
+                headers = InvalidRecord('Field %s is not a list of headers' % field)
+            yield ('%s %s' % (record_id, field), headers)
+
+def iter_jsonl_records(f):
+    """Yields (record id, header list) for each line of a JSON lines access log
+    (see json_record_headers). A line which is not valid JSON gives an
+    InvalidRecord."""
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield ('line %d' % number, InvalidRecord('Invalid JSON: %s' % error))
+            continue
+        for result in json_record_headers('line %d' % number, record):
+            yield result
+
+def iter_json_records(f):
+    """Yields (record id, header list) for each item of a JSON array of
+    access log records (see json_record_headers)."""
+    for number, record in enumerate(iter_json_array(f, None)):
+        for result in json_record_headers('item %d' % number, record):
+            yield result
+
+record_readers = {
+    FORMAT_HAR: iter_har_records,
+    FORMAT_RAW: iter_raw_records,
+    FORMAT_JSONL: iter_jsonl_records,
+    FORMAT_JSON: iter_json_records,
+}
+
+def check_records(records):
+    """Checks a batch of records in the current process.
+    Returns a list of (record id, report) where report is the result of
+    check_headers, or a failed INVALID_RECORD test for an InvalidRecord."""
+    from sand.header import check_headers
+
+    results = []
+    for record_id, headers in records:
+        if isinstance(headers, InvalidRecord):
+            results.append((record_id, [(INVALID_RECORD, [headers.error])]))
+        else:
+            results.append((record_id, check_headers(headers)))
+    return results
+
+def iter_batches(iterable, size):
+    """Yields lists of at most size items taken from iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def validate_records(records, processes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Checks the headers of records, an iterable of (record id, header list).
+    Yields (record id, report) in the order of records, report being
+    the result of check_headers.
+    Batches of chunk_size records are checked by a pool of processes
+    (one per CPU if processes is None, none if it is 1).
+    At most two batches per process are read ahead, so memory stays bounded."""
+    from multiprocessing import Pool, cpu_count
+
+    if processes == 1:
+        for batch in iter_batches(records, chunk_size):
+            for result in check_records(batch):
+                yield result
+        return
+    pool = Pool(processes)
+    try:
+        max_pending = 2 * (processes or cpu_count())
+        pending = deque()
+        for batch in iter_batches(records, chunk_size):
+            pending.append(pool.apply_async(check_records, (batch,)))
+            if len(pending) >= max_pending:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def validate_file(file_name, format=None, processes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Checks the SAND headers recorded in a capture file.
+    format is one of FORMAT_HAR, FORMAT_RAW, FORMAT_JSONL, FORMAT_JSON,
+    or None to guess it from the file name (see guess_format).
+    Yields (record id, report) as described in validate_records."""
+    if format is None:
+        format = guess_format(file_name)
+    with open(file_name) as f:
+        for result in validate_records(record_readers[format](f), processes, chunk_size):
+            yield result
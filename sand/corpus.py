@@ -0,0 +1,189 @@
+#!/usr/bin/python
+
+"""
+Corpus validation of SAND XML messages, part of SAND conformance server.
+
+This module is part of implementation of a conformance server
+for ISO/IEC 23009-5 SAND.
+It validates a large set of SAND messages stored in files
+(found in directory trees or listed in a manifest) with a pool of processes,
+and summarizes the results per message type.
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import os
+import time
+from fnmatch import fnmatch
+from multiprocessing import Pool
+
+from lxml import etree
+
+from sand.timing import XML_PARSE, PhaseHistograms, phase, timing
+from sand.xml_message import XMLValidator, report_error
+
+# Message type used for files whose content could not be parsed
+UNKNOWN_TYPE = '(unparsable)'
+
+# Number of files sent at once to a worker process
+DEFAULT_CHUNK_SIZE = 50
+
+def iter_corpus_files(paths, pattern='*.xml'):
+    """Yields the files to validate.
+    paths may contain files (always included) and directories,
+    which are walked recursively for files matching pattern."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if fnmatch(name, pattern):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def iter_manifest(manifest_path):
+    """Yields the files listed in a manifest, one per line.
+    Relative paths are relative to the directory of the manifest.
+    Empty lines and lines starting with # are ignored."""
+    base = os.path.dirname(manifest_path)
+    with open(manifest_path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield os.path.join(base, line)
+
+class FileResult:
+    """Result of the validation of one file.
+    Attributes are:
+    - path: the validated file
+    - message_types: the names of the SAND messages found in the file
+    - is_valid: True if the file is valid
+    - errors: a list of error messages
+    - timings: duration of each phase of the validation (see sand.timing)"""
+
+    def __init__(self, path, message_types, is_valid, errors, timings=None):
+        self.path = path
+        self.message_types = message_types
+        self.is_valid = is_valid
+        self.errors = errors
+        self.timings = timings or {}
+
+# Validator of a worker process, created once by init_worker
+worker_validator = None
+
+def init_worker(xsd_path=None, sch_path=None):
+    """Initializes a worker process: schemas are compiled once per worker."""
+    global worker_validator
+    worker_validator = XMLValidator(xsd_path, sch_path)
+
+def validate_corpus_file(path):
+    """Validates one file with the validator of the current process.
+    Returns a FileResult."""
+    if worker_validator is None:
+        init_worker()
+    errors = []
+    with timing() as timer:
+        try:
+            with phase(XML_PARSE):
+                message_doc = etree.parse(path)
+        except (etree.XMLSyntaxError, IOError) as e:
+            if isinstance(e, IOError):
+                errors.append(str(e))
+            else:
+                report_error(e, errors)
+            return FileResult(path, (UNKNOWN_TYPE,), False, errors, timer.phases)
+        # SAND messages are the children of the SANDMessage envelope
+        message_types = tuple(sorted(set(etree.QName(child).localname
+                                         for child in message_doc.getroot()
+                                         if isinstance(child.tag, basestring))))
+        is_valid = worker_validator.validate(message_doc, errors)
+    return FileResult(path, message_types, is_valid, errors, timer.phases)
+
+def validate_corpus(files, processes=None, xsd_path=None, sch_path=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE):
+    """Validates files with a pool of processes (none if processes is 1).
+    Yields a FileResult for each file, in completion order."""
+    if processes == 1:
+        init_worker(xsd_path, sch_path)
+        for path in files:
+            yield validate_corpus_file(path)
+        return
+    pool = Pool(processes, init_worker, (xsd_path, sch_path))
+    try:
+        for result in pool.imap_unordered(validate_corpus_file, files, chunk_size):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+class CorpusSummary:
+    """Pass/fail counts per message type and throughput of a corpus validation.
+    A file containing several message types is counted for each of them."""
+
+    def __init__(self):
+        self.counts = {} # message type -> [passed, failed]
+        self.phases = PhaseHistograms()
+        self.passed = 0
+        self.failed = 0
+        self.start_time = time.time()
+        self.end_time = None
+
+    def add(self, result):
+        """Accounts for a FileResult."""
+        if result.is_valid:
+            self.passed += 1
+        else:
+            self.failed += 1
+        for message_type in result.message_types or ('(empty)',):
+            counts = self.counts.setdefault(message_type, [0, 0])
+            counts[0 if result.is_valid else 1] += 1
+        self.phases.add(result.timings)
+
+    def finish(self):
+        """Marks the end of the validation."""
+        self.end_time = time.time()
+
+    def throughput(self):
+        """Returns the number of files validated per second."""
+        elapsed = (self.end_time or time.time()) - self.start_time
+        if elapsed <= 0:
+            return 0.0
+        return (self.passed + self.failed) / elapsed
+
+    def lines(self):
+        """Returns the summary as a list of text lines."""
+        result = ['%-28s %8s %8s' % ('message type', 'passed', 'failed')]
+        for message_type in sorted(self.counts):
+            passed, failed = self.counts[message_type]
+            result.append('%-28s %8d %8d' % (message_type, passed, failed))
+        result.append('%-28s %8d %8d' % ('total files', self.passed, self.failed))
+        result.append('%.1f files/s' % self.throughput())
+        result.extend(self.phases.lines())
+        return result
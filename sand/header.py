@@ -7,6 +7,8 @@ This module is part of implementation of a conformance server
 for ISO/IEC 23009-5 SAND.
 It parses SAND messages received as HTTP header from a SAND client,
 and checks they follow the syntax and constraints of the specification.
+Parsed messages are compact records with values decoded to Python types
+(see SandObject and SandList), so that many of them can be kept in memory.
 
 Copyright (c) 2016-, TNO, Technicolor
 All rights reserved.
@@ -37,7 +39,12 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 import re
-from UserList import UserList
+import threading
+import time
+from array import array
+from datetime import date
+
+from sand.timing import HEADER_PARSE, current_timer
 
 # Some checks considered as potentially useful are not part of official MPEG conformance.
 # However the code is kept available for those who want to reuse this module
@@ -48,25 +55,175 @@ extended_checks = {
     'operation points have consistent attribute list': False,
 }
 
-# URI regexps taken from
+# URI syntax taken from
 # http://blog.dieweltistgarnichtso.net/constructing-a-regular-expression-that-matches-uris
-# regexp for the protocol part of an URI:
-uri_proto = r'"[A-Za-z][A-Za-z0-9\+\.\-]*'
-# regexp for the accepted characters in the rest of the URI
+# regexp for the accepted characters of an URI
+# (besides URI encoded characters, i.e. % followed by 2 hexadecimal digits)
 uri_allowed = r"[A-Za-z0-9\.\-_~:/\?#\[\]@!\$&'\(\)\*\+,;=]"
-# regexp for URI encoded characters
-uri_encoded = r'%[A-Fa-f0-9]{2}'
-
-# A dictionary of regexps for checking all SAND value types
-regular_expressions = {
-    'QUOTEDSTRING': re.compile(r'"(\\"|[^"])*"'),
-    'QUOTEDURI': re.compile(r'("%s:(%s|%s)+")|("(%s|%s)+")' % (uri_proto, uri_allowed, uri_encoded, uri_allowed, uri_encoded)),
-    'QUOTEDURN': re.compile(r'("urn:(%s|%s)+")' % (uri_allowed, uri_encoded)),
-    'INT': re.compile(r'\d+'),
-    'BYTERANGE': re.compile(r'(\d+-\d*)|(-\d+)'),
-    'DATETIME': re.compile(r'\d\d\d\d\d\d\d\dT\d\d\d\d\d\d(\.\d{,6})?Z'),
-    'LIST': re.compile(r'\[(\d+(,\d+)*)?\]'),
+
+class LazyDict(dict):
+    """A dictionary whose values are built on first access,
+    so that importing this module does not pay for values never used.
+    Each value is built by calling factory on the source given for its key."""
+
+    def __init__(self, sources, factory):
+        """sources maps each key to the source of its value."""
+        dict.__init__(self)
+        self.sources = sources
+        self.factory = factory
+
+    def __missing__(self, key):
+        # setdefault keeps a single value if two threads get here at once
+        return self.setdefault(key, self.factory(self.sources[key]))
+
+    def get(self, key, default=None):
+        if key in self.sources:
+            return self[key]
+        return default
+
+    def __contains__(self, key):
+        return key in self.sources
+
+    def __iter__(self):
+        return iter(self.sources)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def keys(self):
+        return self.sources.keys()
+
+    def values(self):
+        return [self[key] for key in self.sources]
+
+    def items(self):
+        return [(key, self[key]) for key in self.sources]
+
+# Scanners of SAND values.
+# Each one is called with the string being parsed and the position where
+# a value is expected, and returns the position following the value found
+# there, or -1 if there is none. Values are recognized as by the regexp
+# given in the docstring of each scanner, but in a time linear in the length
+# of the input, even for crafted or truncated values, where the nested
+# alternatives of these regexps could make a backtracking engine much slower.
+# Scanners use regexps called runs below: after an optional literal prefix,
+# their repeated parts are single character classes that may be followed by
+# anything, which the regexp engine matches in a simple loop, without
+# backtracking nor saving state for each character.
+# What a run cannot express (escaped quotes, URI encoded characters) is
+# checked with str methods, or searches of a character that only look at
+# the next or previous characters, each going once through the value.
+
+# Runs used by the scanners
+int_run = re.compile(r'[0-9]+').match
+byte_range_run = re.compile(r'[0-9]*(?:-[0-9]*)?').match
+list_run = re.compile(r'\[[0-9,]*').match
+# URI runs also accept '%', which must then be followed by 2 hexadecimal digits
+uri_characters = uri_allowed[:-1] + '%]'
+uri_run = re.compile(uri_characters + '*').match
+quoted_uri_run = re.compile('"' + uri_characters + '*').match
+quoted_urn_run = re.compile('"urn:' + uri_characters + '*').match
+uri_scheme_run = re.compile(r'""[A-Za-z][A-Za-z0-9\+\.\-]*').match
+wrong_encoding_search = re.compile(r'%(?![A-Fa-f0-9]{2})').search
+unescaped_quote_search = re.compile(r'(?<!\\)"').search
+# A DATETIME has at most 23 characters, so its regexp is matched
+# in a bounded time, and is used as is
+datetime_match = re.compile(r'[0-9]{8}T[0-9]{6}(?:\.[0-9]{0,6})?Z').match
+
+def scan_int(input, pos):
+    """Scans an INT: \d+"""
+    match = int_run(input, pos)
+    return match.end() if match else -1
+
+def scan_quoted_string(input, pos):
+    """Scans a QUOTEDSTRING: "(\\"|[^"])*"
+    The string ends at the first quote not escaped by a backslash.
+    Without such a quote, it ends at the last escaped quote, if any."""
+    if not input.startswith('"', pos):
+        return -1
+    quote = unescaped_quote_search(input, pos + 1)
+    if quote:
+        return quote.end()
+    # all the quotes after the first one are escaped
+    escaped = input.rfind('"', pos + 1)
+    return escaped + 1 if escaped >= 0 else -1
+
+def uri_end(input, start, end):
+    """Returns the end of the allowed or encoded URI characters
+    of a URI run from start to end: (allowed|%[A-Fa-f0-9]{2})*"""
+    wrong = wrong_encoding_search(input, start, end)
+    return wrong.start() if wrong else end
+
+def scan_quoted_uri(input, pos):
+    """Scans a QUOTEDURI: (""[A-Za-z][A-Za-z0-9\+\.\-]*:(allowed|encoded)+")|("(allowed|encoded)+")
+    (the protocol part of the first alternative is preceded by 2 quotes)."""
+    match = quoted_uri_run(input, pos)
+    if not match:
+        return -1
+    start = pos + 1
+    end = uri_end(input, start, match.end())
+    if end == start:
+        # Nothing after the quote, unless it is the first alternative
+        match = uri_scheme_run(input, pos)
+        if not match or not input.startswith(':', match.end()):
+            return -1
+        start = match.end() + 1
+        end = uri_end(input, start, uri_run(input, start).end())
+        if end == start:
+            return -1
+    if input.startswith('"', end):
+        return end + 1
+    return -1
+
+def scan_quoted_urn(input, pos):
+    """Scans a QUOTEDURN: "urn:(allowed|encoded)+" """
+    match = quoted_urn_run(input, pos)
+    if not match:
+        return -1
+    start = pos + 5
+    end = uri_end(input, start, match.end())
+    if end > start and input.startswith('"', end):
+        return end + 1
+    return -1
+
+def scan_byte_range(input, pos):
+    """Scans a BYTERANGE: (\d+-\d*)|(-\d+)"""
+    end = byte_range_run(input, pos).end()
+    # the run is digits, optionally followed by '-' and digits
+    if end > pos + 1 and input.find('-', pos, end) >= 0:
+        return end
+    return -1
+
+def scan_datetime(input, pos):
+    """Scans a DATETIME: \d\d\d\d\d\d\d\dT\d\d\d\d\d\d(\.\d{,6})?Z"""
+    match = datetime_match(input, pos)
+    return match.end() if match else -1
+
+def scan_list(input, pos):
+    """Scans a LIST: \[(\d+(,\d+)*)?\]"""
+    match = list_run(input, pos)
+    if not match:
+        return -1
+    start = pos + 1
+    end = match.end()
+    if end > start and (input[start] == ',' or input[end - 1] == ','
+                        or input.find(',,', start, end) >= 0):
+        return -1
+    if input.startswith(']', end):
+        return end + 1
+    return -1
+
+# The scanner of each SAND value type
+value_scanners = {
+    'QUOTEDSTRING': scan_quoted_string,
+    'QUOTEDURI': scan_quoted_uri,
+    'QUOTEDURN': scan_quoted_urn,
+    'INT': scan_int,
+    'BYTERANGE': scan_byte_range,
+    'DATETIME': scan_datetime,
+    'LIST': scan_list,
 }
+
 # A regexp that allows to 'eat' characters that may belong to a DATETIME.
 # This is used in case the DATETIME is wrongly written, e.g. one missing char
 # or the extended format allowed by ISO (but restricted by SAND).
@@ -76,49 +233,377 @@ regular_expressions = {
 # characters will not match another expected attribute.
 datetime_allowed_chars = re.compile(r'[\d\-T:\.Z]+')
 
-class SandObject:
+class SandObject(object):
     """Representation of values in a sand-object element.
     The list attribute contains the sand-list if it exists, or is None.
-    Other attributes are created for representing any found sand-attribute."""
-    
+    The objects of each message (and of the items of its sand-list) are
+    of a subclass made by record_class, with a slot for each sand-attribute
+    they may have: a sand-attribute not found in the header is not set.
+    Values are decoded according to their type (see value_decoders),
+    values that do not match their type are kept as found, as strings."""
+
+    __slots__ = ('list',)
+
     def __init__(self):
         self.list = None
 
-class SandList(UserList):
-    """Representation of a sand-list.
-    It supports regular python list operations (provided by UserList).
-    It provides access to the sand-objects described in the sand-list.
-    If the parsing found no closing bracket, the attribute closed will be False.
-    Note: UserList.data attribute is the list storing actual content."""
-    
-    def __init__(self, data=[]):
-        """Constructor takes an optional data as required by UserList.
-        Initially self.closed is False, and should be set to True
+def record_class(name, attribute_names):
+    """Returns a subclass of SandObject named name, for objects
+    with the given sand-attributes."""
+    return type(name, (SandObject,), {'__slots__': tuple(sorted(attribute_names)),
+                                      '__module__': __name__})
+
+# Value of a sand-attribute not set on an item of a SandList
+ABSENT = None
+
+# Array type codes of the columns of a SandList, per type of their values
+array_typecodes = {int: 'l', float: 'd'}
+
+class SandList(object):
+    """Representation of a sand-list of objects of the class record.
+    Items are stored column-wise: columns maps each sand-attribute to the
+    list of its values (ABSENT for items without it), turned into an array
+    by compact when all the values are numbers of the same type. So a long
+    sand-list takes a few bytes per value, not an object per item.
+    Items are built when accessed (by index, slice or iteration), so
+    modifying them does not modify the list.
+    If the parsing found no closing bracket, the attribute closed will be False."""
+
+    __slots__ = ('record', 'columns', 'length', 'closed')
+
+    def __init__(self, record=SandObject, items=None):
+        """Initially self.closed is False, and should be set to True
         by the parser when finding the closing bracket."""
-        UserList.__init__(self, data)
+        self.record = record
+        self.columns = {}
+        self.length = 0
         self.closed = False
+        if items is not None:
+            self.extend(items)
+
+    def append(self, item):
+        """Adds a sand-object at the end of the list."""
+        columns = self.columns
+        for name in self.record.__slots__:
+            value = getattr(item, name, ABSENT)
+            column = columns.get(name)
+            if column is None:
+                if value is ABSENT:
+                    continue
+                column = columns[name] = [ABSENT] * self.length
+            try:
+                column.append(value)
+            except (TypeError, OverflowError):
+                # not a value of the type of the array
+                column = columns[name] = list(column)
+                column.append(value)
+        self.length += 1
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def compact(self):
+        """Stores the columns whose values are all numbers of the same type
+        in arrays. Called by the parser at the end of the sand-list."""
+        for name, column in self.columns.items():
+            if type(column) is list:
+                kind = type(column[0])
+                if kind in array_typecodes:
+                    for value in column:
+                        if type(value) is not kind:
+                            break
+                    else:
+                        try:
+                            self.columns[name] = array(array_typecodes[kind], column)
+                        except OverflowError:
+                            pass
+
+    def column(self, name):
+        """Returns the values of the sand-attribute name of all the items,
+        ABSENT for items without it, as a list or an array (to be read only)."""
+        column = self.columns.get(name)
+        if column is None:
+            return [ABSENT] * self.length
+        return column
+
+    def item(self, index):
+        """Returns the sand-object at index, which must be in range."""
+        item = self.record()
+        for name, column in self.columns.iteritems():
+            value = column[index]
+            if value is not ABSENT:
+                setattr(item, name, value)
+        return item
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.item(i) for i in xrange(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('sand-list index out of range')
+        return self.item(index)
+
+    def __iter__(self):
+        for index in xrange(self.length):
+            yield self.item(index)
+
+    def __len__(self):
+        return self.length
+
+class SandValue(object):
+    """Representation of a sand-attribute while it is parsed.
+    It stores the value as a string, without modification of the input,
+    and whether it matches its type."""
+
+    __slots__ = ('data', 'valid', 'char_count')
 
-class SandValue:
-    """Representation of a sand-attribute.
-    It just stores the value as a string, without modification of the input."""
-    
     def __init__(self):
         self.data = ''
+        self.valid = False
+
+def decode_byte_range(value):
+    """Returns a BYTERANGE as a tuple (first, last), None for a missing bound."""
+    first, last = value.split('-')
+    return (int(first) if first else None, int(last) if last else None)
+
+# Day number of 1970-01-01, as given by date.toordinal
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def decode_datetime(value):
+    """Returns a DATETIME as seconds since the epoch (a float),
+    or value if it is not a valid date."""
+    year, month_day = divmod(int(value[0:8]), 10000)
+    hour, minute_second = divmod(int(value[9:15]), 10000)
+    minute, second = divmod(minute_second, 100)
+    try:
+        days = date(year, *divmod(month_day, 100)).toordinal() - EPOCH_ORDINAL
+    except ValueError:
+        return value
+    if hour > 23 or minute > 59 or second > 59:
+        return value
+    seconds = float(days * 86400 + hour * 3600 + minute * 60 + second)
+    if len(value) > 17:
+        # fraction of second
+        seconds += float(value[15:-1])
+    return seconds
+
+def decode_list(value):
+    """Returns a LIST as a tuple of the codes it contains, as written
+    (codes are compared as text, e.g. 012 is not the code 12)."""
+    if value == '[]':
+        return ()
+    return tuple(value[1:-1].split(','))
+
+# Functions converting a value matching a SAND type into its Python value:
+# quoted values lose their quotes (and the escaping of " in a QUOTEDSTRING)
+value_decoders = {
+    'QUOTEDSTRING': lambda value: value[1:-1].replace('\\"', '"'),
+    'QUOTEDURI': lambda value: value[1:-1],
+    'QUOTEDURN': lambda value: value[1:-1],
+    'INT': int,
+    'BYTERANGE': decode_byte_range,
+    'DATETIME': decode_datetime,
+    'LIST': decode_list,
+}
+
+class ParseResult:
+    """Outcome of parsing a SAND message found in a header.
+    - sand_object: the SandObject describing the found content,
+      or None if parsing was stopped on a fatal error
+    - errors: a list of error messages (empty if the message is correct)"""
+
+    def __init__(self, sand_object, errors):
+        self.sand_object = sand_object
+        self.errors = errors
+
+class ParsingState:
+    """Mutable state of one parsing run.
+    Keeping it out of the checkers allows the same checker object
+    to be used by several threads at once."""
+
+    def __init__(self):
+        self.errors = []
+        # The following flags are used to check rule in 8.2.3 on attributes ordering
+        self.enveloppe_done = False
+        self.common_done = False
+        # Position following the last non white space character of the input
+        self.content_end = 0
+        # Number of items in the sand-list of the message
+        self.list_items = 0
+
+    def add_error(self, msg):
+        """Adds the msg to the list of errors."""
+        self.errors.append(msg)
 
 class ParsingStopped(Exception):
     """Our own exception to signal a parsing failure."""
     pass
 
+class ListProgress(object):
+    """Progress of the parsing of a sand-list (see check_list_items):
+    the position following what was parsed, the number of items
+    and whether the closing bracket was found."""
+
+    __slots__ = ('pos', 'count', 'closed')
+
+    def __init__(self, pos):
+        self.pos = pos
+        self.count = 0
+        self.closed = False
+
+class PartialObject(object):
+    """A top level sand-object whose parsing was suspended at its sand-list,
+    so that the items of the list are parsed one at a time (see ListStream).
+    check_object stops at the list when list_pos is None, and continues
+    with list (of list_length characters) at list_pos when it is set."""
+
+    __slots__ = ('result', 'char_count', 'seen', 'list_pos', 'list', 'list_length')
+
+    def __init__(self):
+        self.list_pos = None
+        self.list = None
+
 # dict key used to mark mandatory attributes
 # must be different from any possible attribute name
 # using () is a good way
 MANDATORY = ()
 
+# Kinds of sand-attributes, regarding the ordering rule in 8.2.3
+SPECIFIC_ATTRIBUTE = 0
+ENVELOPPE_ATTRIBUTE = 1
+COMMON_ATTRIBUTE = 2
+
+class CompiledSyntax:
+    """A syntax descriptor compiled into tables, so that parsing does not
+    have to interpret the nested dictionaries again for every header.
+    Attributes are:
+    - attributes: a dictionary mapping each allowed sand-attribute name
+      to a tuple (type name, value scanner, bit, kind, value decoder)
+    - record: the class of the parsed objects (see record_class)
+    - mandatory: a tuple of (name, bit) for mandatory entries, in the order
+      of the descriptor ('list' stands for the sand-list and has no bit, i.e. 0)
+    - mandatory_mask: the bits of all mandatory sand-attributes
+    - list: the CompiledSyntax of sand-list items, or None if no sand-list is allowed"""
+
+    def __init__(self, syntax, enveloppe_attributes, common_attributes, name):
+        """Compiles the syntax descriptor.
+        enveloppe_attributes and common_attributes are used to know
+        the kind of each attribute. name is the name of the record class."""
+        self.attributes = {}
+        bits = {}
+        for attr_name, expected_type in syntax.items():
+            if attr_name is MANDATORY or attr_name == 'list':
+                continue
+            bit = 1 << len(bits)
+            bits[attr_name] = bit
+            if attr_name in enveloppe_attributes:
+                kind = ENVELOPPE_ATTRIBUTE
+            elif attr_name in common_attributes:
+                kind = COMMON_ATTRIBUTE
+            else:
+                kind = SPECIFIC_ATTRIBUTE
+            self.attributes[attr_name] = (expected_type, value_scanners[expected_type],
+                                          bit, kind, value_decoders[expected_type])
+        self.mandatory = tuple((attr_name, bits.get(attr_name, 0)) for attr_name in syntax[MANDATORY])
+        self.mandatory_mask = 0
+        for attr_name, bit in self.mandatory:
+            self.mandatory_mask |= bit
+        self.list_mandatory = 'list' in syntax[MANDATORY]
+        self.record = record_class(name, self.attributes)
+        if 'list' in syntax:
+            self.list = CompiledSyntax(syntax['list'], enveloppe_attributes, common_attributes,
+                                       name + 'Item')
+        else:
+            self.list = None
+
+def position_text(item_number):
+    """Returns the suffix of error messages locating an object in a sand-list."""
+    if item_number is not None:
+        return ' for object at position %d' % item_number
+    return ''
+
+class ListStream(object):
+    """Parsing of a message giving the items of its sand-list one at a time,
+    so that a caller can act on the first items before the others are
+    parsed, or stop early, and items are not kept in memory.
+    Iterating over the stream yields (SandObject, errors) for each item of
+    the sand-list, errors being the errors found while parsing it (including
+    the separator following it). Parsing stops on a fatal error.
+    finish returns the ParseResult of the message, whose sand-list keeps
+    no item."""
+
+    def __init__(self, checker, input):
+        self.checker = checker
+        self.input = input
+        self.state = ParsingState()
+        self.state.content_end = len(input.rstrip())
+        self.partial = PartialObject()
+        self.progress = None
+        self.sand_object = None
+        self.result = None
+        self.items = self.iter_items()
+
+    def __iter__(self):
+        return self.items
+
+    def iter_items(self):
+        checker = self.checker
+        state = self.state
+        partial = self.partial
+        syntax = checker.compiled_syntax
+        try:
+            parsed = checker.check_object(state, syntax, self.input, first_level=True,
+                                          partial=partial)
+            if parsed is not None:
+                # no sand-list
+                self.sand_object = parsed[0]
+                return
+            self.progress = progress = ListProgress(partial.list_pos)
+            errors = state.errors
+            count = len(errors)
+            for item in checker.check_list_items(state, syntax.list, self.input, progress):
+                yield item, errors[count:]
+                count = len(errors)
+            partial.list = SandList(syntax.list.record)
+            partial.list.closed = progress.closed
+            partial.list_length = progress.pos - partial.list_pos
+            self.sand_object = checker.check_object(state, syntax, self.input, partial.list_pos,
+                                                    first_level=True, partial=partial)[0]
+        except ParsingStopped:
+            pass
+
+    def finish(self, drain=True):
+        """Completes the parsing and returns the ParseResult of the message.
+        With drain, the items not iterated yet are parsed (without being
+        kept) and the checks of the whole message are performed, so errors
+        are the same as with HeaderSyntaxChecker.parse. Otherwise parsing
+        stops where iterating stopped: the closing bracket, sand-attributes
+        following the sand-list and mandatory sand-attributes are not checked."""
+        if self.result is not None:
+            return self.result
+        if drain:
+            for item in self.items:
+                pass
+        else:
+            self.items.close()
+            if self.sand_object is None and self.partial.list_pos is not None:
+                self.sand_object = self.partial.result
+                self.sand_object.list = SandList(self.checker.compiled_syntax.list.record)
+                self.state.list_items = self.progress.count if self.progress else 0
+        if self.sand_object is not None:
+            self.checker.check_message_constraints(self.state, self.sand_object)
+        self.result = ParseResult(self.sand_object, self.state.errors)
+        return self.result
+
 class HeaderSyntaxChecker:
     """Base class for syntax checking of a SAND HTTP header.
+    Checkers hold no state about a parsing run (see ParsingState),
+    so a single instance can be shared between threads.
     Attributes are:
     - syntax: a dictionary describing expected structure and types
-    - errors: a list of error messages found during parsing"""
+    - errors: the list of error messages found by the last call to check_syntax"""
 
     # Attributes that may appear as part of the enveloppe.
     # Note: it is not currently clearly stated in the spec how these are used with HTTP headers
@@ -134,231 +619,382 @@ class HeaderSyntaxChecker:
                           'messageId' : 'INT',
                           'validityTime': 'DATETIME' }
 
+    # Error reported when the sand-list of the message has no item,
+    # or None if an empty sand-list is allowed
+    empty_list_error = None
+
+    # Lower cased names of the other headers of a request or response
+    # that check_companions depends on (see check_headers)
+    companion_headers = ()
+
     def __init__(self, syntax):
         """Constructor.
-        Store the syntax descriptor.
-        Initialize internal attributes used during parsing."""
+        Store the syntax descriptor and compile it for parsing."""
         self.syntax = syntax
         self.errors = []
-        # The following flags are used to check rule in 8.2.3 on attributes ordering
-        self.enveloppe_done = False
-        self.common_done = False
+        full_syntax = {} # start a new dictionary (do not modify existing ones)
+        # Build a syntax description including all possible attributes
+        # (note: the calls to update will overwrite MANDATORY entry each time)
+        full_syntax.update(self.enveloppe_attributes)
+        full_syntax.update(self.common_attributes)
+        full_syntax.update(syntax)
+        # build MANDATORY key at the end, since updates are overwriting it:
+        mandatory = syntax[MANDATORY] + self.enveloppe_attributes[MANDATORY] + self.common_attributes[MANDATORY]
+        full_syntax[MANDATORY] = mandatory
+        # the parsed objects are named after the message, e.g. MaxRTT
+        name = self.__class__.__name__.replace('Checker', '')
+        self.compiled_syntax = CompiledSyntax(full_syntax, self.enveloppe_attributes,
+                                              self.common_attributes, name)
 
-    def add_error(self, msg):
-        """Adds the msg to the list of errors."""
-        self.errors.append(msg)
+    def parse(self, input):
+        """Checks the input string conforms to the message syntax.
+        This is the entry point for parsing a message in a header.
+        Returns a ParseResult with the found SandObject (if parsing went
+        to the end correctly or with non fatal errors) and the errors.
+        This method is reentrant."""
+        state = ParsingState()
+        o = self.check_message(state, input)
+        if o:
+            self.check_message_constraints(state, o)
+        return ParseResult(o, state.errors)
 
-    def clear_errors(self):
-        """Clears the list of errors (call me before starting to parse)."""
-        self.errors = []
+    def stream(self, input):
+        """Returns a ListStream giving the items of the sand-list of the
+        message in input one at a time, as they are parsed."""
+        return ListStream(self, input)
 
     def check_syntax(self, input):
         """Checks the input string conforms to the message syntax.
-        This is the entry point for parsing a message in a header.
+        Kept for compatibility: the errors are stored in self.errors,
+        so unlike parse() this is not safe when the checker is shared.
         If parsing went to the end correctly or with non fatal errors,
         returns the SandObject describing the found content."""
-        self.clear_errors()
-        self.enveloppe_done = False
-        self.common_done = False
-        syntax = {} # start a new dictionary (do not modify existing ones)
-        # Build a syntax description including all possible attributes
-        # (note: the calls to update will overwrite MANDATORY entry each time)
-        syntax.update(self.enveloppe_attributes)
-        syntax.update(self.common_attributes)
-        syntax.update(self.syntax)
-        # build MANDATORY key at the end, since updates are overwriting it:
-        mandatory = self.syntax[MANDATORY] + self.enveloppe_attributes[MANDATORY] + self.common_attributes[MANDATORY]
-        syntax[MANDATORY] = mandatory
+        result = self.parse(input)
+        self.errors = result.errors
+        return result.sand_object
+
+    def check_message_constraints(self, state, o):
+        """Performs the checks of a message once it has been parsed:
+        the sand-list is not empty if empty_list_error is set,
+        then the checks specific to the message."""
+        if self.empty_list_error and not state.list_items:
+            state.add_error(self.empty_list_error)
+        self.check_constraints(state, o)
+
+    def check_constraints(self, state, o):
+        """Performs the checks specific to a message once it has been parsed.
+        o is the SandObject found by the generic parsing.
+        Errors are added to state. Subclasses override this as needed."""
+        pass
+
+    def check_companions(self, o, headers, errors):
+        """Performs the checks of a message involving the companion_headers
+        of the request or response where it was found.
+        o is the SandObject found by the parsing, or None if parsing was stopped.
+        headers is the HeaderIndex of the request or response.
+        Errors are appended to errors. Subclasses declaring
+        companion_headers override this."""
+        pass
+
+    def check_message(self, state, input):
+        """Performs the generic syntax check of a whole message.
+        Returns the found SandObject, or None if parsing was stopped."""
+        # Values are parsed in place, without copying the remaining input.
+        # Only the position of the end of the content is needed
+        # to detect empty values (followed by nothing else than white space).
+        state.content_end = len(input.rstrip())
         try:
-            result = self.check_object(syntax, input, first_level=True)
+            result = self.check_object(state, self.compiled_syntax, input, first_level=True)[0]
         except ParsingStopped:
             result = None
         return result
     
-    def check_object(self, syntax, input, first_level=False, item_number=None):
+    def check_object(self, state, syntax, input, pos=0, first_level=False, item_number=None,
+                     partial=None):
         """Performs the syntax check when a sand-object is expected.
-        syntax: description of the syntax expected for this object.
-        input: string to parse (starts with the object, but may contain more at the end)
+        state: the ParsingState of the current parsing.
+        syntax: CompiledSyntax expected for this object.
+        input: the whole string being parsed.
+        pos: position in input where the object starts (input may contain more at the end)
         first_level: is True if the object is a top-level one in the message.
         item_number: if provided, it is the position of the object in the enclosing sand-list
-        Returns the corresponding SandObject or raises ParsingStopped.
-        The returned SandObject has its attribute char_count indicating how many
-        characters where used from input."""
-        result = SandObject()
-        result.char_count = 0
-        if item_number is not None:
-            number_text = ' for object at position %d' % item_number
+        partial: if provided, a PartialObject to stop at the sand-list,
+        or to continue from it (pos is then its list_pos)
+        Returns a tuple (SandObject, number of characters used from input,
+        starting at pos), None when stopped at the sand-list,
+        or raises ParsingStopped."""
+        if partial is not None and partial.list is not None:
+            result, char_count, seen = partial.result, partial.char_count, partial.seen
         else:
-            number_text = ''
+            result = syntax.record()
+            char_count = 0
+            seen = 0 # bits of the sand-attributes found so far
+        end = len(input)
+        attributes = syntax.attributes
         # Eat input until end or some closing delimiter
-        while input:
+        while pos < end:
             item_length = 0 # number of chars for one item (sublist or attribute)
-            if input[0] == '[':
-                # Apparently the start of a sublist
-                # First, is it allowed?
-                if result.list is not None:
-                    self.add_error('Only one list is allowed%s.' % number_text)
-                    # we will parse it anyway, it may have the correct syntax
-                elif 'list' not in syntax:
-                    self.add_error("Unexpected sand-list found %s. Stopping parsing." % number_text)
-                    raise ParsingStopped
-                # Second, parse the sublist
-                result.list = self.check_list(syntax['list'], input)
-                item_length += result.list.char_count
+            if input[pos] == '[':
+                if partial is not None and partial.list is not None and pos == partial.list_pos:
+                    # The sublist was parsed one item at a time
+                    result.list = partial.list
+                    item_length += partial.list_length
+                else:
+                    # Apparently the start of a sublist
+                    # First, is it allowed?
+                    if result.list is not None:
+                        state.add_error('Only one list is allowed%s.' % position_text(item_number))
+                        # we will parse it anyway, it may have the correct syntax
+                    elif syntax.list is None:
+                        state.add_error("Unexpected sand-list found %s. Stopping parsing." % position_text(item_number))
+                        raise ParsingStopped
+                    if partial is not None and partial.list_pos is None:
+                        # The sublist is parsed by the caller
+                        partial.result, partial.char_count, partial.seen = result, char_count, seen
+                        partial.list_pos = pos
+                        return None
+                    # Second, parse the sublist
+                    result.list, list_length = self.check_list(state, syntax.list, input, pos)
+                    item_length += list_length
                 if not result.list.closed:
-                    if 'list' in syntax:
-                        self.add_error("Unmatched '[' to close sand-list%s." % number_text)
-                    else:
-                        self.add_error("Unexpected '[' found (and no closing ']')%s." % number_text)
+                    state.add_error("Unmatched '[' to close sand-list%s." % position_text(item_number))
             else:
                 # We have to parse a sand-attribute
-                # First decompose name=something
-                try:
-                    attr_name, right = input.split('=', 1)
-                    item_length += 1 # aknowledge for '='
-                except ValueError:
-                    attr_name = input
-                    right = None
-                    self.add_error("Expecting '=' for sand-attribute%s." % number_text)
-                # Check attribute name is well formed
-                if not attr_name.isalpha():
-                    if attr_name.strip().isalpha():
-                        self.add_error("no space allowed around sand-attribute name%s." % number_text)
-                    else:
-                        self.add_error("sand-attribute name should be alphabetic%s." % number_text)
-                item_length += len(attr_name)
-                # Check we have something to parse for the value
-                if right is not None and not right.strip():
-                    self.add_error("Empty value for sand-attribute after '='%s." % number_text)
-                # Check it is an expected attribute
-                attr_name = attr_name.strip() # Already checked white space
-                if attr_name not in syntax:
-                    self.add_error("Unexpected sand-attribute name '%s'%s. Stopping parsing." % (attr_name, number_text))
-                    raise ParsingStopped
-                # Parse the value
-                if right is not None:
-                    if right.strip():
-                        value = self.check_value(syntax[attr_name], input[item_length:], number_text)
-                        item_length += value.char_count
-                    else:
-                        # empty value already signalled, do not parse
-                        value = SandValue()
-                        item_length += len(right)
+                # Fast path: expected name with a correct value
+                equal_pos = input.find('=', pos)
+                attr_name = input[pos:equal_pos] if equal_pos > pos else None
+                attribute = attributes.get(attr_name)
+                value_end = attribute[1](input, equal_pos + 1) if attribute else -1
+                if value_end >= 0:
+                    expected_type, scanner, bit, kind, decode = attribute
+                    data = input[equal_pos + 1:value_end]
+                    item_length = value_end - pos
+                    if expected_type == 'BYTERANGE':
+                        self.check_byte_range(state, data, item_number)
+                    data = decode(data)
+                else:
+                    attr_name, value, item_length = self.check_attribute(state, syntax, input, pos, item_number)
+                    expected_type, scanner, bit, kind, decode = attributes[attr_name]
+                    data = decode(value.data) if value.valid else value.data
                 # Attributes must be unique
-                if hasattr(result, attr_name):
-                    self.add_error("sand-attribute %s should occur only once%s." % (attr_name, number_text))
+                if seen & bit:
+                    state.add_error("sand-attribute %s should occur only once%s." % (attr_name, position_text(item_number)))
+                seen |= bit
                 # Enveloppe and common attributes must appear before others
                 # (but nothing says in the spec that enveloppe should be before common attributes)
-                if attr_name in self.enveloppe_attributes:
-                    if self.enveloppe_done or not first_level:
-                        self.add_error("Enveloppe attributes (%s) should appear first in the message." % attr_name)
-                elif attr_name in self.common_attributes:
-                    if self.common_done or not first_level:
-                        self.add_error("Common attributes (%s) should appear first in the message." % attr_name)
-                else:
+                if kind == SPECIFIC_ATTRIBUTE:
                     # If we see another attribute, then enveloppe+common is done
-                    self.enveloppe_done = True
-                    self.common_done = True
-                setattr(result, attr_name, value.data)
+                    state.enveloppe_done = True
+                    state.common_done = True
+                elif kind == ENVELOPPE_ATTRIBUTE:
+                    if state.enveloppe_done or not first_level:
+                        state.add_error("Enveloppe attributes (%s) should appear first in the message." % attr_name)
+                else:
+                    if state.common_done or not first_level:
+                        state.add_error("Common attributes (%s) should appear first in the message." % attr_name)
+                setattr(result, attr_name, data)
             # Now that one item has been parsed, prepare for the next
             # move to remaining input:
-            input = input[item_length:]
-            result.char_count += item_length
-            if input:
+            pos += item_length
+            char_count += item_length
+            if pos < end:
                 # Still some chars, check for delimiters
-                if input[0] == ',':
-                    result.char_count += 1
-                    input = input[1:]
+                if input[pos] == ',':
+                    char_count += 1
+                    pos += 1
                 elif first_level:
-                    self.add_error("Expecting ',', found '%s'%s. Stopping parsing." % (input[0], number_text))
+                    state.add_error("Expecting ',', found '%s'%s. Stopping parsing." % (input[pos], position_text(item_number)))
                     raise ParsingStopped
                 else:
                     # 2 cases:
-                    # input[0] in (';', ']') is normal end of current sand-object
+                    # input[pos] in (';', ']') is normal end of current sand-object
                     # otherwise it is a syntax error, but we assume it will be caught by further analysis
                     break
         # Once the object is completely parsed, check we got all mandatory attributes
-        for attr_name in syntax[MANDATORY]:
-            if attr_name == 'list':
-                if result.list is None:
-                    self.add_error("Mandatory sand-list is missing%s." % number_text)
-            else:
-                if not hasattr(result, attr_name):
-                    self.add_error("Mandatory sand-attribute '%s' is missing%s." % (attr_name, number_text))
-        return result
+        if seen & syntax.mandatory_mask != syntax.mandatory_mask or (syntax.list_mandatory and result.list is None):
+            for attr_name, bit in syntax.mandatory:
+                if attr_name == 'list':
+                    if result.list is None:
+                        state.add_error("Mandatory sand-list is missing%s." % position_text(item_number))
+                else:
+                    if not seen & bit:
+                        state.add_error("Mandatory sand-attribute '%s' is missing%s." % (attr_name, position_text(item_number)))
+        return result, char_count
     
-    def check_list(self, syntax, input):
+    def check_attribute(self, state, syntax, input, pos, item_number=None):
+        """Performs the detailed syntax check of a sand-attribute.
+        This is used when the fast path of check_object could not recognize
+        a correct attribute, and reports what is wrong.
+        state: the ParsingState of the current parsing.
+        syntax: CompiledSyntax of the enclosing object.
+        input: the whole string being parsed.
+        pos: position in input where the attribute starts
+        item_number: if provided, it is the position of the enclosing object in a sand-list
+        Returns a tuple (name, SandValue, number of characters used from input)
+        or raises ParsingStopped."""
+        item_length = 0
+        # First decompose name=something
+        # (value_pos is the position following the first '=' in the remaining input)
+        equal_pos = input.find('=', pos)
+        if equal_pos >= 0:
+            attr_name = input[pos:equal_pos]
+            value_pos = equal_pos + 1
+            item_length += 1 # aknowledge for '='
+        else:
+            attr_name = input[pos:]
+            value_pos = None
+            state.add_error("Expecting '=' for sand-attribute%s." % position_text(item_number))
+        # Check attribute name is well formed
+        if not attr_name.isalpha():
+            if attr_name.strip().isalpha():
+                state.add_error("no space allowed around sand-attribute name%s." % position_text(item_number))
+            else:
+                state.add_error("sand-attribute name should be alphabetic%s." % position_text(item_number))
+        item_length += len(attr_name)
+        # Check we have something to parse for the value
+        # (there is nothing but white space after value_pos if it is past content_end)
+        if value_pos is not None and value_pos >= state.content_end:
+            state.add_error("Empty value for sand-attribute after '='%s." % position_text(item_number))
+        # Check it is an expected attribute
+        attr_name = attr_name.strip() # Already checked white space
+        attribute = syntax.attributes.get(attr_name)
+        if attribute is None:
+            state.add_error("Unexpected sand-attribute name '%s'%s. Stopping parsing." % (attr_name, position_text(item_number)))
+            raise ParsingStopped
+        expected_type, scanner = attribute[:2]
+        # Parse the value
+        if value_pos is not None and value_pos < state.content_end:
+            value = self.check_value(state, expected_type, input, pos + item_length, item_number, scanner)
+            item_length += value.char_count
+        else:
+            # empty value already signalled, do not parse
+            value = SandValue()
+            if value_pos is not None:
+                item_length += len(input) - value_pos
+        return attr_name, value, item_length
+
+    def check_list(self, state, syntax, input, pos):
         """Performs the syntax check when a sand-list is expected.
-        syntax: description of the syntax expected for items in this list.
-        input: string to parse (starts with the list, but may contain more at the end)
-        Returns the corresponding SandList or raises ParsingStopped.
-        The returned SandList has its attribute char_count indicating how many
-        characters where used from input."""
+        state: the ParsingState of the current parsing.
+        syntax: CompiledSyntax expected for items in this list.
+        input: the whole string being parsed.
+        pos: position in input where the list starts (input may contain more at the end)
+        Returns a tuple (SandList, number of characters used from input,
+        starting at pos) or raises ParsingStopped."""
+        result = SandList(syntax.record)
+        start = pos
         # Skip the opening bracket
-        assert(input[0] == '[') # ensured by caller
-        result = SandList()
-        result.char_count = 1
-        input = input[1:]
+        assert(input[pos] == '[') # ensured by caller
+        pos += 1
+        end = len(input)
         item_number = 0
         # Eat input until end or closing bracket
-        while input and input[0] != ']':
+        while pos < end and input[pos] != ']':
             item_number += 1
             # items of the list should be sand-object:
-            next = self.check_object(syntax, input, item_number=item_number)
-            result.char_count += next.char_count
+            next, next_length = self.check_object(state, syntax, input, pos, item_number=item_number)
             # store the found item
             result.append(next)
-            # move to remaining input:
-            input = input[next.char_count:]
-            # check we found either the list separator or terminator
-            if input:
-                if input[0] == ';':
-                    # OK, go to next item
-                    result.char_count += 1
-                    input = input[1:]
-                    if input and input[0] == ']':
-                        self.add_error('Empty element at end of sand-list.')
-                elif input[0] != ']':
-                    self.add_error("Expecting ';' or ']', found '%s'. Stopping parsing." % input[0])
-                    raise ParsingStopped
+            # move to remaining input, after the separator if any:
+            pos = self.check_list_separator(state, input, pos + next_length, end)
         # If we leave the loop normally, we aknowledge for the closing bracket:
-        if input:
-            assert(input[0] == ']')
+        if pos < end:
+            assert(input[pos] == ']')
             result.closed = True
-            result.char_count += 1
-        return result
-    
-    def check_value(self, expected_type, input, message_suffix):
+            pos += 1
+        state.list_items = item_number
+        result.compact()
+        return result, pos - start
+
+    def check_list_items(self, state, syntax, input, progress):
+        """Performs the syntax check of a sand-list, one item at a time.
+        This is a generator yielding the SandObject of each item once it is
+        checked, with the following separator.
+        state: the ParsingState of the current parsing.
+        syntax: CompiledSyntax expected for items in this list.
+        input: the whole string being parsed.
+        progress: ListProgress whose pos is the position in input where the
+        list starts; it is updated after each item.
+        Raises ParsingStopped."""
+        # Skip the opening bracket
+        pos = progress.pos
+        assert(input[pos] == '[') # ensured by caller
+        pos += 1
+        end = len(input)
+        item_number = 0
+        # Eat input until end or closing bracket
+        while pos < end and input[pos] != ']':
+            item_number += 1
+            next, next_length = self.check_object(state, syntax, input, pos, item_number=item_number)
+            pos = self.check_list_separator(state, input, pos + next_length, end)
+            progress.pos = pos
+            progress.count = item_number
+            yield next
+        if pos < end:
+            assert(input[pos] == ']')
+            progress.closed = True
+            pos += 1
+        progress.pos = pos
+        state.list_items = item_number
+
+    def check_list_separator(self, state, input, pos, end):
+        """Checks what follows an item of a sand-list: either the list
+        separator or terminator, or the end of input.
+        Returns the position of the next item or of the terminator,
+        or raises ParsingStopped."""
+        if pos < end:
+            if input[pos] == ';':
+                # OK, go to next item
+                pos += 1
+                if pos < end and input[pos] == ']':
+                    state.add_error('Empty element at end of sand-list.')
+            elif input[pos] != ']':
+                state.add_error("Expecting ';' or ']', found '%s'. Stopping parsing." % input[pos])
+                raise ParsingStopped
+        return pos
+
+    def check_value(self, state, expected_type, input, pos, item_number=None, scanner=None):
         """Performs the syntax check when a sand-value is expected.
+        state: the ParsingState of the current parsing.
         expected_type: the name of the type expected for the value.
-        input: string to parse (starts with the value, but may contain more at the end)
+        input: the whole string being parsed.
+        pos: position in input where the value starts (input may contain more at the end)
+        item_number: if provided, it is the position of the enclosing object in a sand-list
+        scanner: the scanner of expected_type (see value_scanners), if already known
         Returns the corresponding SandValue or raises ParsingStopped.
         The returned SandValue has its attribute char_count indicating how many
-        characters where used from input."""
+        characters where used from input, starting at pos."""
         result = SandValue()
-        # Most work is done thanks to the regexp associated to this type:
-        match = regular_expressions[expected_type].match(input)
-        if match:
+        # Most work is done thanks to the scanner associated to this type:
+        if scanner is None:
+            scanner = value_scanners[expected_type]
+        end = scanner(input, pos)
+        if end >= 0:
             # Correct value
-            result.data = match.group(0)
+            result.data = input[pos:end]
+            result.valid = True
             # Additional check:
             if expected_type == 'BYTERANGE':
-                left, right = result.data.split('-')
-                if left and right and int(left) > int(right):
-                    self.add_error("Inconsistent byte range (%s > %s)%s." % (left, right, message_suffix))
+                self.check_byte_range(state, result.data, item_number)
         else:
             # Wrong value
             if expected_type == 'DATETIME':
                 # try to consider allowed DATETIME characters
                 # so that an error in the middle of it does not stop
                 # processing the reminder
-                match = datetime_allowed_chars.match(input)
+                match = datetime_allowed_chars.match(input, pos)
                 if match:
                     result.data = match.group(0)
-            self.add_error("Wrong or missing %s specification%s." % (expected_type, message_suffix))
+            state.add_error("Wrong or missing %s specification%s." % (expected_type, position_text(item_number)))
         result.char_count = len(result.data)
         return result
     
+    def check_byte_range(self, state, value, item_number=None):
+        """Checks the bounds of a syntactically correct BYTERANGE value are consistent."""
+        left, right = value.split('-')
+        if left and right and int(left) > int(right):
+            state.add_error("Inconsistent byte range (%s > %s)%s." % (left, right, position_text(item_number)))
+
     def optional_attributes(self, obj, syntax):
         """Extracts a tuple of the optional attributes included in a SandObject.
         This is a utility method for subclasses.
@@ -373,6 +1009,8 @@ class HeaderSyntaxChecker:
 
 class AnticipatedRequestsChecker(HeaderSyntaxChecker):
     """Class to check a SAND-AnticipatedRequests header message."""
+
+    empty_list_error = "At least one request must be specified."
     
     def __init__(self):
         """Build the syntax description for this message"""
@@ -384,19 +1022,11 @@ class AnticipatedRequestsChecker(HeaderSyntaxChecker):
                         'range': 'BYTERANGE',
                         'targetTime': 'DATETIME' } })
 
-    def check_syntax(self, input):
-        """Checks the input string conforms to SAND-AnticipatedRequests syntax."""
-        # Generic checking:
-        o = HeaderSyntaxChecker.check_syntax(self, input)
-        # Additional checks
-        if o:
-            if not o.list:
-                self.add_error("At least one request must be specified.")
-        return o
-
 class SharedResourceAllocationChecker(HeaderSyntaxChecker):
     """Class to check a SAND-ResourceAllocation header message."""
 
+    empty_list_error = "At least one operation point must be specified."
+
     def __init__(self):
         """Build the syntax description for this message"""
         HeaderSyntaxChecker.__init__(
@@ -410,38 +1040,33 @@ class SharedResourceAllocationChecker(HeaderSyntaxChecker):
               'allocationStrategy': 'QUOTEDURN',
               'mpdUrl': 'QUOTEDURI' })
 
-    def check_syntax(self, input):
-        """Checks the input string conforms to SAND-ResourceAllocation syntax."""
-        # Generic checking:
-        o = HeaderSyntaxChecker.check_syntax(self, input)
-        # Additional checks
-        if o:
-            if not o.list:
-                self.add_error("At least one operation point must be specified.")
-            # checking that values necessary for some strategy are indeed provided
-            if extended_checks['weight present if strategy requires']:
-                try:
-                    strategy = o.allocationStrategy
-                    if strategy in ('"urn:mpeg:dash:sand:allocation:premium-privileged:2016"',
-                                    '"urn:mpeg:dash:sand:allocation:everybody-served:2016"',
-                                    '"urn:mpeg:dash:sand:allocation:weighted:2016"'):
-                        if not hasattr(o, 'weight'):
-                            self.add_error("Attribute weight is mandatory for strategy %s." % strategy)
-                except AttributeError:
-                    # no allocation strategy specified
-                    pass
-            if o.list and extended_checks['operation points have consistent attribute list']:
-                # Check that provided attributes are consistent through the list:
-                syntax = self.syntax['list']
-                attributes = self.optional_attributes(o.list[0], syntax)
-                for obj in o.list[1:]:
-                    if self.optional_attributes(obj, syntax) != attributes:
-                        self.add_error("Optional attributes are not consistent through the list of operationPoints")
-                        break
-        return o
+    def check_constraints(self, state, o):
+        """Additional checks for SAND-ResourceAllocation, beyond the generic syntax."""
+        # checking that values necessary for some strategy are indeed provided
+        if extended_checks['weight present if strategy requires']:
+            try:
+                strategy = o.allocationStrategy
+                if strategy in ('urn:mpeg:dash:sand:allocation:premium-privileged:2016',
+                                'urn:mpeg:dash:sand:allocation:everybody-served:2016',
+                                'urn:mpeg:dash:sand:allocation:weighted:2016'):
+                    if not hasattr(o, 'weight'):
+                        state.add_error('Attribute weight is mandatory for strategy "%s".' % strategy)
+            except AttributeError:
+                # no allocation strategy specified
+                pass
+        if o.list and extended_checks['operation points have consistent attribute list']:
+            # Check that provided attributes are consistent through the list:
+            syntax = self.syntax['list']
+            attributes = self.optional_attributes(o.list[0], syntax)
+            for obj in o.list[1:]:
+                if self.optional_attributes(obj, syntax) != attributes:
+                    state.add_error("Optional attributes are not consistent through the list of operationPoints")
+                    break
 
 class AcceptedAlternativesChecker(HeaderSyntaxChecker):
     """Class to check a SAND-AcceptedAlternatives header message."""
+
+    empty_list_error = "At least one alternative must be specified."
     
     def __init__(self):
         """Build the syntax description for this message"""
@@ -454,16 +1079,6 @@ class AcceptedAlternativesChecker(HeaderSyntaxChecker):
                         'bandwidth': 'INT',
                         'deliveryScope': 'INT' } })
 
-    def check_syntax(self, input):
-        """Checks the input string conforms to SAND-AcceptedAlternatives syntax."""
-        # Generic checking:
-        o = HeaderSyntaxChecker.check_syntax(self, input)
-        # Additional checks
-        if o:
-            if not o.list:
-                self.add_error("At least one alternative must be specified.")
-        return o
-
 class AbsoluteDeadlineChecker(HeaderSyntaxChecker):
     """Class to check a SAND-AbsoluteDeadline header message."""
     
@@ -474,13 +1089,6 @@ class AbsoluteDeadlineChecker(HeaderSyntaxChecker):
             { MANDATORY: ('deadline',),
               'deadline': 'DATETIME' })
 
-    def check_syntax(self, input):
-        """Checks the input string conforms to SAND-AbsoluteDeadline syntax."""
-        # Generic checking:
-        o = HeaderSyntaxChecker.check_syntax(self, input)
-        # No additional checks
-        return o
-
 class MaxRTTChecker(HeaderSyntaxChecker):
     """Class to check a SAND-MaxRTT header message."""
     
@@ -491,15 +1099,10 @@ class MaxRTTChecker(HeaderSyntaxChecker):
             { MANDATORY: ('maxRTT',),
               'maxRTT': 'INT' })
 
-    def check_syntax(self, input):
-        """Checks the input string conforms to SAND-MaxRTT syntax."""
-        # Generic checking:
-        o = HeaderSyntaxChecker.check_syntax(self, input)
-        # No additional checks
-        return o
-
 class NextAlternativesChecker(HeaderSyntaxChecker):
     """Class to check a SAND-NextAlternatives header message."""
+
+    empty_list_error = "At least one alternative must be specified."
     
     def __init__(self):
         """Build the syntax description for this message"""
@@ -512,21 +1115,11 @@ class NextAlternativesChecker(HeaderSyntaxChecker):
                         'bandwidth': 'INT',
                         'deliveryScope': 'INT' } })
 
-    def check_syntax(self, input):
-        """Checks the input string conforms to SAND-NextAlternatives syntax."""
-        # Generic checking:
-        o = HeaderSyntaxChecker.check_syntax(self, input)
-        # Additional checks
-        if o:
-            if not o.list:
-                self.add_error("At least one alternative must be specified.")
-        return o
-
 class ClientCapabilitiesChecker(HeaderSyntaxChecker):
     """Class to check a SAND-ClientCapabilities header message."""
     
-    known_urns = { # QUOTEDXXX parsing leaves the " in the value, so we include them here
-        '"urn:mpeg:dash:sand:messageset:all:2016"': map(str, range(1, 22)),
+    known_urns = { # codes of the messages of each set
+        'urn:mpeg:dash:sand:messageset:all:2016': map(str, range(1, 22)),
     }
 
     def __init__(self):
@@ -541,40 +1134,40 @@ class ClientCapabilitiesChecker(HeaderSyntaxChecker):
               'supportedMessage': 'LIST',
               'messageSetUri': 'QUOTEDURN' })
 
-    def check_syntax(self, input):
-        """Checks the input string conforms to SAND-ClientCapabilities syntax."""
-        # Generic checking:
-        o = HeaderSyntaxChecker.check_syntax(self, input)
-        # Additional checks
-        if o:
-            # Collect all supported codes from both types of parameters
-            supported_codes = set() # collects the identifier codes of supported messages
-            if hasattr(o, 'messageSetUri'):
-                if o.messageSetUri in self.known_urns:
-                    # add known identifiers to the set:
-                    for code in self.known_urns[o.messageSetUri]:
-                        supported_codes.add(code)
-                else:
-                    self.add_error("messageSetUri %s is not a known urn" % o.messageSetUri)
-                    # assuming the urn is defined elsewhere and has a consistent content,
-                    # we add the code '12' here to avoid issuing a new error message below,
-                    # (this additional error would be misleading if the urn is correct)
-                    supported_codes.add('12')
-            if hasattr(o, 'supportedMessage'):
-                for code in o.supportedMessage[1:-1].split(','):
+    def check_constraints(self, state, o):
+        """Additional checks for SAND-ClientCapabilities, beyond the generic syntax."""
+        # Collect all supported codes from both types of parameters
+        supported_codes = set() # collects the identifier codes of supported messages
+        if hasattr(o, 'messageSetUri'):
+            if o.messageSetUri in self.known_urns:
+                # add known identifiers to the set:
+                for code in self.known_urns[o.messageSetUri]:
                     supported_codes.add(code)
-            # Do we have some values?
-            if not hasattr(o, 'supportedMessage') and not hasattr(o, 'messageSetUri'):
-                self.add_error("At least one of supportedMessage or messageSetUri should be specified.")
-            # Check specific codes
-            if '0' in supported_codes:
-                self.add_error("supportedMessage should not include reserved code 0")
-            if '12' not in supported_codes:
-                self.add_error("At least one of the parameters must include code 12 (ClientCapabilities)")
-        return o
+            else:
+                state.add_error('messageSetUri "%s" is not a known urn' % o.messageSetUri)
+                # assuming the urn is defined elsewhere and has a consistent content,
+                # we add the code '12' here to avoid issuing a new error message below,
+                # (this additional error would be misleading if the urn is correct)
+                supported_codes.add('12')
+        if hasattr(o, 'supportedMessage') and isinstance(o.supportedMessage, tuple):
+            supported_codes.update(o.supportedMessage)
+        # Do we have some values?
+        if not hasattr(o, 'supportedMessage') and not hasattr(o, 'messageSetUri'):
+            state.add_error("At least one of supportedMessage or messageSetUri should be specified.")
+        # Check specific codes
+        if '0' in supported_codes:
+            state.add_error("supportedMessage should not include reserved code 0")
+        if '12' not in supported_codes:
+            state.add_error("At least one of the parameters must include code 12 (ClientCapabilities)")
 
 class DeliveredAlternativeChecker(HeaderSyntaxChecker):
     """Class to check a SAND-DeliveredAlternative header message."""
+
+    companion_headers = ('warning', 'contentlocation', 'vary')
+
+    # Values expected in the Warning and Vary headers
+    expected_warning = '214 Transformation Applied'
+    expected_vary = 'sand-acceptedalternatives'
     
     def __init__(self):
         """Build the syntax description for this message"""
@@ -584,104 +1177,289 @@ class DeliveredAlternativeChecker(HeaderSyntaxChecker):
               'initialUrl': 'QUOTEDURI',
               'contentLocation': 'QUOTEDURI' })
 
-    def check_syntax(self, input):
-        """Checks the input string conforms to SAND-DeliveredAlternative syntax."""
-        # Generic checking:
-        o = HeaderSyntaxChecker.check_syntax(self, input)
-        # No additional checks
-        return o
-
+    def check_companions(self, o, headers, errors):
+        """Checks the Warning, ContentLocation and Vary headers
+        of the response with a SAND-DeliveredAlternative."""
+        expected_warning = self.expected_warning
+        expected_vary = self.expected_vary
+        # Note: here we do not assume that the headers list has grouped
+        #       multiple header occurrences from the HTTP request/response.
+        warning = ''
+        for v in headers.get_all('warning'):
+            # We may have other warnings not related to DeliveredAlternative
+            # So if we already found the expected one we do not overwrite it
+            if warning != expected_warning:
+                warning = v
+        locations = headers.get_all('contentlocation')
+        location = locations[-1] if locations else ''
+        vary = ''
+        for v in headers.get_all('vary'):
+            # If the expected value was already found in a Vary header,
+            # ignore others
+            if vary != expected_vary:
+                if v == '*':
+                    vary = expected_vary
+                else:
+                    fields = map(lambda s: s.strip().lower(), v.split(','))
+                    if expected_vary in fields:
+                        vary = expected_vary
+                    else:
+                        vary = 'other'
+        if not warning:
+            errors.append('Mandatory Warning header missing for DeliveredAlternative')
+        elif warning != expected_warning:
+            errors.append('A Warning header with "%s" is expected' % expected_warning)
+        if not location:
+            errors.append('Mandatory ContentLocation header missing for DeliveredAlternative.')
+        elif hasattr(o, 'contentLocation'):
+            if o.contentLocation != location: # TODO we may have part of the URL?
+                errors.append('ContentLocation header and contentLocation@DeliveredAlternative are not consistent.')
+        if not vary:
+            errors.append('Mandatory Vary header missing for DeliveredAlternative.')
+        elif vary != expected_vary:
+            errors.append('The Vary header should mention %s for a DeliveredAlternative.' % expected_vary)
 
 # This dictionary maps header names to an object to use for checking the value.
 # We use lower cased values of header names, since HTTP headers are case-insensitive
 # and so comparison can be made on lowered names.
-header_name_to_checker = {
-  'sand-anticipatedrequests': AnticipatedRequestsChecker(),
-  'sand-sharedresourceallocation': SharedResourceAllocationChecker(),
-  'sand-acceptedalternatives': AcceptedAlternativesChecker(),
-  'sand-absolutedeadline': AbsoluteDeadlineChecker(),
-  'sand-maxrtt': MaxRTTChecker(),
-  'sand-nextalternatives': NextAlternativesChecker(),
-  'sand-clientcapabilities': ClientCapabilitiesChecker(),
-  'sand-deliveredalternative': DeliveredAlternativeChecker(),
-}
+# Each checker is created the first time it is used, since this compiles its syntax.
+header_name_to_checker = LazyDict({
+  'sand-anticipatedrequests': AnticipatedRequestsChecker,
+  'sand-sharedresourceallocation': SharedResourceAllocationChecker,
+  'sand-acceptedalternatives': AcceptedAlternativesChecker,
+  'sand-absolutedeadline': AbsoluteDeadlineChecker,
+  'sand-maxrtt': MaxRTTChecker,
+  'sand-nextalternatives': NextAlternativesChecker,
+  'sand-clientcapabilities': ClientCapabilitiesChecker,
+  'sand-deliveredalternative': DeliveredAlternativeChecker,
+}, lambda checker_class: checker_class())
+
+# Number of header values whose ParseResult is kept by parse_header
+DEFAULT_PARSE_CACHE_SIZE = 1024
+
+# Longer values are not cached: they are rarely repeated,
+# and would make the memory used by the cache depend on the traffic
+MAX_CACHED_VALUE_LENGTH = 4096
+
+class ParseCache:
+    """Bounded cache of ParseResult, keyed by lower cased header name and value,
+    evicting the least recently used entry when full.
+    The same header values are repeated on every request of a client
+    (e.g. ClientCapabilities, MaxRTT), so most of them need not be parsed again.
+    Cached results are shared: their errors list is copied by get,
+    since callers may append to it, but their sand_object must not be modified.
+    Counters of hits, misses and evictions are kept (see stats).
+    A ParseCache can be used from several threads."""
+
+    # Entries are links [previous, next, key, result] of a circular list
+    # ordered from least to most recently used, and found by key in a dict.
+    # This is cheaper than an OrderedDict, which is written in Python
+    # and has to remove and add again an entry to move it to the end.
+
+    def __init__(self, size=DEFAULT_PARSE_CACHE_SIZE):
+        """size is the maximum number of entries, 0 disables the cache."""
+        self.size = size
+        self.links = {} # key -> link
+        self.root = [] # the link before the first one and after the last one
+        self.root[:] = [self.root, self.root, None, None]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns a copy of the ParseResult cached for key, or None."""
+        with self.lock:
+            link = self.links.get(key)
+            if link is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # move the link to the end of the list
+            previous, next, _, result = link
+            previous[1] = next
+            next[0] = previous
+            root = self.root
+            last = root[0]
+            last[1] = root[0] = link
+            link[0] = last
+            link[1] = root
+        return ParseResult(result.sand_object, list(result.errors))
+
+    def put(self, key, result):
+        """Caches a copy of result for key."""
+        if not self.size:
+            return
+        result = ParseResult(result.sand_object, list(result.errors))
+        with self.lock:
+            link = self.links.get(key)
+            if link is not None:
+                # added by another thread meanwhile
+                link[3] = result
+                return
+            root = self.root
+            last = root[0]
+            link = [last, root, key, result]
+            last[1] = root[0] = link
+            self.links[key] = link
+            self.evict(self.size)
+
+    def evict(self, size):
+        """Removes the least recently used entries until there are at most size.
+        The lock must be held."""
+        root = self.root
+        while len(self.links) > size:
+            first = root[1]
+            root[1] = first[1]
+            first[1][0] = root
+            del self.links[first[2]]
+            self.evictions += 1
+
+    def resize(self, size):
+        """Changes the maximum number of entries, evicting entries if needed."""
+        with self.lock:
+            self.size = size
+            self.evict(size)
+
+    def clear(self):
+        """Removes all entries and resets the counters."""
+        with self.lock:
+            self.links.clear()
+            self.root[:] = [self.root, self.root, None, None]
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Returns a dictionary with the size, number of entries,
+        hits, misses and evictions of the cache."""
+        with self.lock:
+            return {'size': self.size, 'entries': len(self.links),
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+# Cache used by parse_header
+parse_cache = ParseCache()
+
+def configure_parse_cache(size):
+    """Sets the maximum number of header values whose parsing result
+    is kept by parse_header, 0 disables the cache."""
+    parse_cache.resize(size)
+
+def parse_header(name, value, keep_items=True):
+    """Parses a single header, whose name and value are provided.
+    Returns a ParseResult with the found SandObject and the list of errors,
+    or None if the header is not a SAND header known by this module.
+    Results of recent values are taken from parse_cache, so the SandObject
+    must not be modified. Without keep_items, the sand-list of values longer
+    than MAX_CACHED_VALUE_LENGTH keeps no item (see ListStream), so that
+    memory does not grow with the length of the value.
+    This function can be called from several threads at once."""
+    lower_name = name.lower()
+    checker = header_name_to_checker.get(lower_name)
+    if not checker:
+        return None
+    return parse_value(checker, lower_name, value, keep_items)
+
+def parse_value(checker, lower_name, value, keep_items):
+    """Parses the value of the header with lower_name, checked by checker.
+    This is parse_header once the checker is known."""
+    timer = current_timer()
+    if timer is not None:
+        start = time.time()
+    value = value.strip()
+    cacheable = parse_cache.size and len(value) <= MAX_CACHED_VALUE_LENGTH
+    result = parse_cache.get((lower_name, value)) if cacheable else None
+    if result is None:
+        if keep_items or len(value) <= MAX_CACHED_VALUE_LENGTH:
+            result = checker.parse(value)
+        else:
+            result = checker.stream(value).finish()
+        if cacheable:
+            parse_cache.put((lower_name, value), result)
+    if timer is not None:
+        timer.add(HEADER_PARSE, time.time() - start)
+    return result
+
+def stream_header(name, value):
+    """Returns a ListStream parsing a single header, whose name and value
+    are provided, or None if the header is not a SAND header known by this
+    module. The items of its sand-list are given one at a time, e.g.
+        stream = stream_header(name, value)
+        for item, errors in stream:
+            if errors:
+                break
+        errors = stream.finish().errors"""
+    checker = header_name_to_checker.get(name.lower())
+    if not checker:
+        return None
+    return checker.stream(value.strip())
 
 def check_header(name, value):
     """Checks a single header, whose name and value are provided.
     Returns a list of error messages.
     The returned list is empty if the message is correct."""
-    checker = header_name_to_checker.get(name.lower())
-    if checker:
-        checker.check_syntax(value.strip())
-        result = checker.errors
+    parsed = parse_header(name, value, keep_items=False)
+    if parsed:
+        result = parsed.errors
     else:
         result = ['Header name not supported by this version of conformance server.']
     return result
 
+class HeaderIndex:
+    """Case-insensitive multimap of the headers of an HTTP request or response,
+    built in a single pass so that checkers can find other headers
+    without scanning the whole list again.
+    Attributes are:
+    - entries: a list of (name, lower cased name, value), in the order of the headers
+    - values: a dictionary mapping each lower cased name to the list of its values,
+      in the order of the headers"""
+
+    def __init__(self, header_list):
+        self.entries = entries = []
+        self.values = values = {}
+        for name, value in header_list:
+            lower_name = name.lower()
+            entries.append((name, lower_name, value))
+            if lower_name in values:
+                values[lower_name].append(value)
+            else:
+                values[lower_name] = [value]
+
+    def get_all(self, name):
+        """Returns the list of the values of the headers named name
+        (in any case), which is empty if there is none."""
+        return self.values.get(name.lower(), [])
+
+    def __contains__(self, name):
+        return name.lower() in self.values
+
+    def __len__(self):
+        return len(self.entries)
+
 def check_headers(header_list):
     """Checks a list of headers found in an HTTP request or response.
     They may include SAND and other headers.
     A report on correctness of known SAND headers is returned, as a list of tuples,
     with header name and [possibly empty] list of errors.
-    Other headers may be considered when they play a role for SAND.
-    For example with DeliveredAlternative message,
+    Other headers may be considered when they play a role for SAND:
+    the companion_headers of the checkers are found in a HeaderIndex of
+    the headers. For example with DeliveredAlternative message,
     we check the Warning, ContentLocation and Vary headers."""
+    headers = HeaderIndex(header_list)
     result = []
-    for name, value in header_list:
+    for name, lower_name, value in headers.entries:
         # generic check
-        # (duplicated code of check_header, because we sometimes need the checker object)
-        checker = header_name_to_checker.get(name.lower())
+        # (not using check_header, because we sometimes need the parsed object)
+        checker = header_name_to_checker.get(lower_name)
         if checker:
-            sand_object = checker.check_syntax(value.strip())
-            errors = checker.errors
-        elif name.lower().startswith('sand-'):
+            parsed = parse_value(checker, lower_name, value, False)
+            errors = parsed.errors
+            if checker.companion_headers:
+                checker.check_companions(parsed.sand_object, headers, errors)
+        elif lower_name.startswith('sand-'):
             errors = ['Header name not supported by this version of conformance server.']
         else:
             # Not a SAND specific header
             continue
-        if name.lower() == 'sand-deliveredalternative':
-            warning = ''
-            location = ''
-            vary = ''
-            # collect headers we expect to find
-            expected_warning = '214 Transformation Applied'
-            expected_vary = 'sand-acceptedalternatives'
-            # Note: here we do not assume that the headers list has grouped
-            #       multiple header occurrences from the HTTP request/response.
-            for n, v in header_list:
-                n = n.lower()
-                if n == 'warning':
-                    # We may have other warnings not related to DeliveredAlternative
-                    # So if we already found the expected one we do not overwrite it
-                    if warning != expected_warning:
-                        warning = v
-                elif n == 'contentlocation':
-                    location = v
-                elif n == 'vary':
-                    # If the expected value was already found in a Vary header,
-                    # ignore others
-                    if vary != expected_vary:
-                        if v == '*':
-                            vary = expected_vary
-                        else:
-                            fields = map(lambda s: s.strip().lower(), v.split(','))
-                            if expected_vary in fields:
-                                vary = expected_vary
-                            else:
-                                vary = 'other'
-            if not warning:
-                errors.append('Mandatory Warning header missing for DeliveredAlternative')
-            elif warning != expected_warning:
-                errors.append('A Warning header with "%s" is expected' % expected_warning)
-            if not location:
-                errors.append('Mandatory ContentLocation header missing for DeliveredAlternative.')
-            elif hasattr(sand_object, 'contentLocation'):
-                if sand_object.contentLocation.strip('"') != location: # TODO we may have part of the URL?
-                    errors.append('ContentLocation header and contentLocation@DeliveredAlternative are not consistent.')
-            if not vary:
-                errors.append('Mandatory Vary header missing for DeliveredAlternative.')
-            elif vary != expected_vary:
-                errors.append('The Vary header should mention %s for a DeliveredAlternative.' % expected_vary)
         result.append((name, errors))
     return result
 
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+"""
+Latency histogram, part of SAND conformance server.
+
+This module is part of implementation of a conformance server
+for ISO/IEC 23009-5 SAND.
+It provides a histogram in the style of HdrHistogram: values are counted
+in buckets whose width grows with the value (log-linear buckets), so that
+the relative error of the reported percentiles is bounded for any range of
+values, with a memory use depending only on the number of distinct buckets.
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import threading
+
+# Percentiles reported by Histogram.lines
+REPORTED_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+class Histogram:
+    """Histogram of durations, in seconds, recorded with a resolution
+    of one microsecond.
+    Values below 2**precision microseconds are counted exactly, larger ones
+    in buckets of 2**(precision-1) to 2**precision values, so the relative
+    error of a reported value is below 2**(1-precision)
+    (below 1% with the default precision of 8).
+    Recording is thread safe."""
+
+    def __init__(self, precision=8):
+        self.precision = precision
+        self.counts = {} # lowest value of bucket (in us) -> count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.lock = threading.Lock()
+
+    def bucket(self, value):
+        """Returns the lowest and highest values (in us) of the bucket
+        of value (in us)."""
+        shift = value.bit_length() - self.precision
+        if shift <= 0:
+            return value, value
+        lowest = (value >> shift) << shift
+        return lowest, lowest + (1 << shift) - 1
+
+    def record(self, seconds, count=1):
+        """Counts a duration."""
+        value = max(0, int(round(seconds * 1e6)))
+        lowest = self.bucket(value)[0]
+        with self.lock:
+            self.counts[lowest] = self.counts.get(lowest, 0) + count
+            self.count += count
+            self.total += value * count
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def merge(self, other):
+        """Adds the values recorded in another histogram."""
+        with other.lock:
+            counts = other.counts.items()
+            count, total = other.count, other.total
+            low, high = other.min, other.max
+        with self.lock:
+            for lowest, bucket_count in counts:
+                lowest = self.bucket(lowest)[0]
+                self.counts[lowest] = self.counts.get(lowest, 0) + bucket_count
+            self.count += count
+            self.total += total
+            if low is not None and (self.min is None or low < self.min):
+                self.min = low
+            if high is not None and (self.max is None or high > self.max):
+                self.max = high
+
+    def percentile(self, percentile):
+        """Returns the value, in seconds, below or equal to which
+        percentile % of the recorded values are.
+        The highest value of the bucket is returned (capped by the maximum),
+        so that the result is never below the exact percentile."""
+        with self.lock:
+            if not self.count:
+                return 0.0
+            wanted = max(1, int(percentile * self.count / 100.0 + 0.5))
+            seen = 0
+            for lowest in sorted(self.counts):
+                seen += self.counts[lowest]
+                if seen >= wanted:
+                    return min(self.bucket(lowest)[1], self.max) / 1e6
+            return self.max / 1e6
+
+    def mean(self):
+        """Returns the mean of the recorded values, in seconds."""
+        if not self.count:
+            return 0.0
+        return self.total / 1e6 / self.count
+
+    def lines(self, name):
+        """Returns a summary of the histogram as a list of text lines."""
+        if not self.count:
+            return ['%s: no value' % name]
+        result = ['%s: count=%d min=%.3fms mean=%.3fms max=%.3fms'
+                  % (name, self.count, self.min / 1e3, self.mean() * 1e3,
+                     self.max / 1e3)]
+        result.append('%s: %s' % (name, ' '.join(
+            'p%g=%.3fms' % (p, self.percentile(p) * 1e3)
+            for p in REPORTED_PERCENTILES)))
+        return result
@@ -0,0 +1,281 @@
+#!/usr/bin/python
+
+"""
+Open-loop load test of a DANE, part of SAND conformance server.
+
+This module is part of implementation of a conformance server
+for ISO/IEC 23009-5 SAND.
+It sends requests to a DANE following a schedule of send times
+(constant rate, ramp or steps), whatever the time the DANE takes to answer:
+the latency of a request is measured from the time it should have been sent,
+so a slow DANE delaying the next requests (coordinated omission) shows up in
+the latency instead of lowering the load. Latencies are recorded in
+histograms and a sample of the responses is checked for conformance.
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import math
+import Queue
+import random
+import threading
+import time
+
+from sand.histogram import Histogram
+
+# Number of threads sending requests
+DEFAULT_WORKERS = 64
+
+# Fraction of the responses checked for conformance
+DEFAULT_SAMPLE_RATE = 0.01
+
+# Number of responses waiting for a conformance check,
+# further samples are dropped
+MAX_PENDING_SAMPLES = 1000
+
+# Prefix of the names of the worker threads
+WORKER_NAME = 'sand-load'
+
+def constant_schedule(rate, duration):
+    """Yields the send times, in seconds from the start,
+    of requests sent at rate requests/s during duration seconds."""
+    if rate <= 0:
+        return
+    number = 0
+    while True:
+        offset = number / float(rate)
+        if offset >= duration:
+            return
+        yield offset
+        number += 1
+
+def ramp_schedule(start_rate, end_rate, duration):
+    """Yields the send times of requests sent at a rate growing linearly
+    from start_rate to end_rate requests/s during duration seconds.
+    Raises ValueError if duration is not positive."""
+    if duration <= 0:
+        raise ValueError('Duration of a ramp must be positive, got %g' % duration)
+    # number of requests sent at time t: n(t) = start_rate.t + slope.t^2 / 2
+    slope = (end_rate - start_rate) / float(duration)
+    number = 0
+    while True:
+        if slope:
+            delta = start_rate * start_rate + 2 * slope * number
+            if delta < 0:
+                return
+            offset = (math.sqrt(delta) - start_rate) / slope
+        elif start_rate > 0:
+            offset = number / float(start_rate)
+        else:
+            return
+        if offset >= duration:
+            return
+        yield offset
+        number += 1
+
+def step_schedule(steps):
+    """Yields the send times of requests sent in steps,
+    a list of (rate, duration) sent one after the other."""
+    start = 0.0
+    for rate, duration in steps:
+        for offset in constant_schedule(rate, duration):
+            yield start + offset
+        start += duration
+
+def parse_steps(text):
+    """Converts steps written as rate:duration,rate:duration,...
+    into a list of (rate, duration)."""
+    steps = []
+    for step in text.split(','):
+        try:
+            rate, duration = step.split(':')
+            steps.append((float(rate), float(duration)))
+        except ValueError:
+            raise ValueError('Invalid step "%s", expected rate:duration' % step)
+    return steps
+
+class LoadReport:
+    """Results of a load test.
+    Attributes are:
+    - latency: histogram of the times from intended send to response
+    - error_latency: histogram of the times from intended send to failure,
+    for the requests without response
+    - service_time: histogram of the times from actual send to response
+    - sent, completed: numbers of requests scheduled and answered
+    - errors: number of requests without response, per exception name
+    - status_codes: number of responses per HTTP status code
+    - samples_checked, samples_failed, samples_dropped: conformance checks
+    of the sampled responses (dropped when the checks are late)"""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.error_latency = Histogram()
+        self.service_time = Histogram()
+        self.sent = 0
+        self.completed = 0
+        self.errors = {}
+        self.status_codes = {}
+        self.samples_checked = 0
+        self.samples_failed = 0
+        self.samples_dropped = 0
+        self.start_time = time.time()
+        self.end_time = None
+        self.lock = threading.Lock()
+
+    def add_response(self, status_code, latency, service_time):
+        """Accounts for a response."""
+        self.latency.record(latency)
+        self.service_time.record(service_time)
+        with self.lock:
+            self.completed += 1
+            self.status_codes[status_code] = \
+                self.status_codes.get(status_code, 0) + 1
+
+    def add_error(self, error, latency):
+        """Accounts for a request without response."""
+        self.error_latency.record(latency)
+        name = type(error).__name__
+        with self.lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def add_sample(self, success):
+        """Accounts for a conformance check."""
+        with self.lock:
+            self.samples_checked += 1
+            if not success:
+                self.samples_failed += 1
+
+    def finish(self):
+        """Marks the end of the load test."""
+        self.end_time = time.time()
+
+    def lines(self):
+        """Returns the report as a list of text lines."""
+        elapsed = (self.end_time or time.time()) - self.start_time
+        result = ['%d requests sent, %d responses, %.1f responses/s'
+                  % (self.sent, self.completed,
+                     self.completed / elapsed if elapsed > 0 else 0.0)]
+        result.extend(self.latency.lines('latency'))
+        result.extend(self.service_time.lines('service time'))
+        result.append('status codes: %s' % (' '.join(
+            '%s=%d' % item for item in sorted(self.status_codes.items()))
+                                          or 'none'))
+        if self.errors:
+            result.append('errors: %s' % ' '.join(
+                '%s=%d' % item for item in sorted(self.errors.items())))
+            result.extend(self.error_latency.lines('latency (errors)'))
+        result.append('conformance samples: %d checked, %d failed, %d dropped'
+                      % (self.samples_checked, self.samples_failed,
+                         self.samples_dropped))
+        return result
+
+def load_worker(fetch, jobs, samples, sample_rate, report):
+    """Sends the requests received in jobs until None is received.
+    A job is the time at which the request should have been sent."""
+    while True:
+        intended = jobs.get()
+        if intended is None:
+            return
+        start = time.time()
+        try:
+            response = fetch()
+        except Exception as e:
+            report.add_error(e, time.time() - intended)
+            continue
+        end = time.time()
+        report.add_response(response.status_code, end - intended, end - start)
+        if sample_rate and random.random() < sample_rate:
+            try:
+                samples.put_nowait(response)
+            except Queue.Full:
+                with report.lock:
+                    report.samples_dropped += 1
+
+def sample_checker(check, samples, report):
+    """Checks the conformance of the responses received in samples
+    until None is received."""
+    while True:
+        response = samples.get()
+        if response is None:
+            return
+        try:
+            success = check(response)
+        except Exception:
+            success = False
+        report.add_sample(success)
+
+def run_load(schedule, fetch, check=None, workers=DEFAULT_WORKERS,
+             sample_rate=DEFAULT_SAMPLE_RATE):
+    """Runs a load test.
+    schedule: iterable of send times, in seconds from the start
+    fetch: function sending a request, returns a requests.Response
+    check: function checking the conformance of a response, returns a boolean
+    workers: number of requests sent at the same time at most; requests
+    scheduled while all workers are busy wait for one, and their latency
+    includes this wait
+    sample_rate: fraction of the responses given to check, in a separate
+    thread so that the checks do not delay the requests.
+    Returns a LoadReport."""
+    report = LoadReport()
+    jobs = Queue.Queue()
+    samples = Queue.Queue(MAX_PENDING_SAMPLES)
+    if check is None:
+        sample_rate = 0
+    threads = []
+    for number in range(workers):
+        thread = threading.Thread(target=load_worker,
+                                  args=(fetch, jobs, samples, sample_rate, report),
+                                  name='%s-%d' % (WORKER_NAME, number))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    checker = threading.Thread(target=sample_checker,
+                               args=(check, samples, report),
+                               name='%s-check' % WORKER_NAME)
+    checker.daemon = True
+    checker.start()
+
+    start = time.time()
+    report.start_time = start
+    try:
+        for offset in schedule:
+            intended = start + offset
+            delay = intended - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            jobs.put(intended)
+            report.sent += 1
+    finally:
+        for _ in threads:
+            jobs.put(None)
+        for thread in threads:
+            thread.join()
+        samples.put(None)
+        checker.join()
+        report.finish()
+    return report
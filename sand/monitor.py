@@ -0,0 +1,318 @@
+#!/usr/bin/python
+
+"""
+Continuous monitoring of DANEs, part of SAND conformance server.
+
+This module is part of implementation of a conformance server
+for ISO/IEC 23009-5 SAND.
+It checks a set of DANE endpoints again and again in a long running process,
+keeping the compiled schemas and the connections to the DANEs. The next
+check of an endpoint is scheduled from the messages it returned: when their
+validityTime (or the validityEndTime of an MPDValidityEndTime message) is
+reached. Durations are taken relative to the generationTime of the message
+when it is given, and applied from its reception, so that the clock of the
+DANE need not be synchronized. A message already expired when received is
+checked again at once, a single time.
+Failed checks are retried with an exponential backoff, randomized so that
+endpoints failing together are not retried together.
+Checks wait in a heap ordered by due time: the memory used only depends on
+the number of endpoints, not on the uptime.
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import calendar
+import heapq
+import itertools
+import Queue
+import random
+import re
+import threading
+import time
+
+from sand.timing import timing
+
+# Delay between two checks of an endpoint whose messages give no validity
+DEFAULT_INTERVAL = 60.0
+
+# Bounds of the delay between two checks, whatever the validity of messages
+DEFAULT_MIN_INTERVAL = 1.0
+DEFAULT_MAX_INTERVAL = 3600.0
+
+# Delay before retrying a failed check, doubled after each failure up to MAX_BACKOFF
+BASE_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 600.0
+
+# Number of checks running at the same time
+DEFAULT_CONCURRENCY = 8
+
+# Longest wait of the scheduler, so that a stop request is seen quickly
+MAX_WAIT = 1.0
+
+# Prefix of the names of the worker threads
+WORKER_NAME = 'sand-monitor'
+
+SAND_NS = '{urn:mpeg:dash:schema:sandmessage:2016}'
+
+# xs:dateTime, e.g. 2016-06-01T12:00:00.5+02:00
+datetime_regexp = re.compile(r'(-?\d{4,})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?'
+                             r'(Z|([+-])(\d\d):(\d\d))?$')
+
+def parse_datetime(text):
+    """Converts an xs:dateTime into seconds since the epoch,
+    or returns None if it is not valid.
+    A date without time zone is taken as UTC."""
+    match = datetime_regexp.match(text.strip())
+    if not match:
+        return None
+    year, month, day, hour, minute, second = [int(match.group(i)) for i in range(1, 7)]
+    try:
+        seconds = calendar.timegm((year, month, day, hour, minute, second))
+    except (ValueError, OverflowError):
+        return None
+    if match.group(7):
+        seconds += float(match.group(7))
+    if match.group(9):
+        offset = int(match.group(10)) * 3600 + int(match.group(11)) * 60
+        seconds -= offset if match.group(9) == '+' else -offset
+    return seconds
+
+class Observation:
+    """Validity of the SAND messages received during a check.
+    Attributes are:
+    - lifetime: seconds the earliest expiring message stays valid after its
+      generation, or after its reception when it has no generationTime;
+      None if no message gives a validity
+    - expires: local time when the earliest expiring message expires,
+      i.e. its reception time plus its lifetime; None if no message gives
+      a validity"""
+
+    def __init__(self):
+        self.lifetime = None
+        self.expires = None
+
+    def add_message(self, body, received=None):
+        """Accounts for a SAND message received at time received (now if None)."""
+        from lxml import etree
+
+        if received is None:
+            received = time.time()
+        try:
+            root = etree.fromstring(body, etree.XMLParser(resolve_entities=False,
+                                                          no_network=True))
+        except (etree.XMLSyntaxError, ValueError):
+            return
+        generation_time = parse_datetime(root.get('generationTime') or '')
+        start = generation_time if generation_time is not None else received
+        for message in root:
+            end = parse_datetime(message.get('validityTime') or '')
+            if end is not None:
+                self.add_lifetime(end - start, received)
+            if message.tag == SAND_NS + 'MPDValidityEndTime':
+                end = parse_datetime(message.get('validityEndTime') or '')
+                if end is not None:
+                    self.add_lifetime(end - start, received)
+
+    def add_lifetime(self, lifetime, received):
+        if self.lifetime is None or lifetime < self.lifetime:
+            self.lifetime = lifetime
+        if self.expires is None or received + lifetime < self.expires:
+            self.expires = received + lifetime
+
+current = threading.local()
+
+def observe_message(body):
+    """Accounts for a SAND message received by the check running in the
+    current thread, if it is run by a monitor."""
+    observation = getattr(current, 'observation', None)
+    if observation is not None:
+        observation.add_message(body)
+
+class MonitorTarget:
+    """An endpoint checked by the monitor.
+    Attributes are:
+    - url, protocol: what is checked
+    - due: time of the next check
+    - failures: number of consecutive failed checks
+    - lifetime: validity of the messages of the last check giving one
+    - expired: True if the last check received messages already expired"""
+
+    def __init__(self, url, protocol):
+        self.url = url
+        self.protocol = protocol
+        self.due = 0.0
+        self.failures = 0
+        self.lifetime = None
+        self.expired = False
+
+class MonitorResult:
+    """Outcome of a check by the monitor.
+    Attributes are:
+    - target: the MonitorTarget, already scheduled for its next check
+    - success: True if the check passed
+    - elapsed: duration of the check in seconds
+    - error: text of the exception raised by the check, or None
+    - timings: duration of each phase of the check (see sand.timing)
+    - delay: seconds until the next check"""
+
+    def __init__(self, target, success, elapsed, error, timings, delay):
+        self.target = target
+        self.success = success
+        self.elapsed = elapsed
+        self.error = error
+        self.timings = timings
+        self.delay = delay
+
+def backoff_delay(failures, max_backoff=DEFAULT_MAX_BACKOFF):
+    """Returns the delay before the next check after failures consecutive
+    failures: it doubles with each failure up to max_backoff, and is
+    randomized between half and all of this value."""
+    delay = min(max_backoff, BASE_BACKOFF * 2 ** min(failures - 1, 30))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def monitor_worker(check, jobs, results):
+    """Runs the checks of the targets received in jobs until None is received.
+    Puts (target, success, elapsed, error, timings, observation) in results."""
+    while True:
+        target = jobs.get()
+        if target is None:
+            return
+        start = time.time()
+        error = None
+        current.observation = observation = Observation()
+        try:
+            with timing() as timer:
+                try:
+                    success = bool(check(target.url, target.protocol))
+                except Exception as e:
+                    success = False
+                    error = '%s: %s' % (type(e).__name__, e)
+        finally:
+            current.observation = None
+        results.put((target, success, time.time() - start, error,
+                     timer.phases, observation))
+
+class Monitor:
+    """Checks endpoints continuously with check(url, protocol).
+    An endpoint is checked again when its messages expire if they give
+    a validity (see Observation), after the previous lifetime if the last
+    check received no message (e.g. 304 Not Modified), or after
+    default_interval, the delay being bounded by min_interval and
+    max_interval. Messages already expired when received are checked again
+    at once, then after default_interval if they are still expired.
+    After a failed check the delay is given by backoff_delay."""
+
+    def __init__(self, targets, check, concurrency=DEFAULT_CONCURRENCY,
+                 default_interval=DEFAULT_INTERVAL,
+                 min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL,
+                 max_backoff=DEFAULT_MAX_BACKOFF):
+        """targets is a list of (URL, protocol)."""
+        self.targets = [MonitorTarget(url, protocol) for url, protocol in targets]
+        self.check = check
+        self.concurrency = concurrency
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_backoff = max_backoff
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        """Makes run return once the running checks are finished.
+        Can be called from another thread or a signal handler."""
+        self.stop_event.set()
+
+    def next_delay(self, target, success, observation, now):
+        """Updates target after a check finished at time now,
+        and returns the delay until the next one."""
+        if not success:
+            target.failures += 1
+            return backoff_delay(target.failures, self.max_backoff)
+        target.failures = 0
+        if observation.expires is not None:
+            target.lifetime = observation.lifetime
+            delay = observation.expires - now
+            if delay <= 0:
+                if not target.expired:
+                    # expired before the check finished: check once more at once
+                    target.expired = True
+                    return 0.0
+                delay = self.default_interval
+            else:
+                target.expired = False
+        elif target.lifetime is not None:
+            delay = target.lifetime
+        else:
+            delay = self.default_interval
+        return min(self.max_interval, max(self.min_interval, delay))
+
+    def run(self):
+        """Checks the targets until stop is called.
+        Yields a MonitorResult after each check."""
+        jobs = Queue.Queue()
+        results = Queue.Queue()
+        workers = []
+        for number in range(self.concurrency):
+            worker = threading.Thread(target=monitor_worker,
+                                      args=(self.check, jobs, results),
+                                      name='%s-%d' % (WORKER_NAME, number))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        # heap of (due time, order, target): the order keeps the heap
+        # from comparing targets due at the same time
+        order = itertools.count()
+        now = time.time()
+        heap = [(now, next(order), target) for target in self.targets]
+        running = 0
+        try:
+            while not self.stop_event.is_set():
+                now = time.time()
+                while heap and heap[0][0] <= now and running < self.concurrency:
+                    jobs.put(heapq.heappop(heap)[2])
+                    running += 1
+                wait = MAX_WAIT
+                if heap and running < self.concurrency:
+                    wait = max(0.0, min(wait, heap[0][0] - now))
+                try:
+                    target, success, elapsed, error, timings, observation = \
+                        results.get(timeout=wait) if wait else results.get_nowait()
+                except Queue.Empty:
+                    continue
+                running -= 1
+                now = time.time()
+                delay = self.next_delay(target, success, observation, now)
+                target.due = now + delay
+                heapq.heappush(heap, (target.due, next(order), target))
+                yield MonitorResult(target, success, elapsed, error, timings, delay)
+        finally:
+            for _ in workers:
+                jobs.put(None)
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,785 @@
+#!/usr/bin/python
+
+"""
+Inline validation of SAND headers, part of SAND conformance server.
+
+This module is part of implementation of a conformance server
+for ISO/IEC 23009-5 SAND.
+A Proxy sits between DASH clients and a DANE or a CDN, as a reverse proxy
+(all connections go to one upstream server) or as a forward proxy (the
+upstream server is taken from the requests, CONNECT is tunnelled). Bytes
+are passed through unmodified, as soon as they are received: the HTTP/1.x
+framing of each direction is followed by a small state machine, which only
+keeps the header blocks, and the headers of the messages carrying SAND
+headers are queued and checked when no data waits to be forwarded, so
+checks delay traffic by about CHECK_SLICE at most. When the checks fall behind,
+messages are dropped from the checks, not from the traffic, and counted.
+
+Budgets, with the default settings:
+- added latency: the time from the readiness of a socket to the sending of
+  the data read from it is recorded for each read; its p99 is expected
+  below LATENCY_BUDGET, and reported at each status
+- memory per connection: two sockets, a sniffer per direction keeping at
+  most MAX_HEAD_SIZE bytes of an incomplete header block, and at most
+  MAX_PENDING bytes not yet accepted by the receiving side per direction
+  (reading stops until they are sent), so a few KB when idle and below
+  2 * (MAX_HEAD_SIZE + MAX_PENDING + READ_SIZE) in the worst case
+- pending checks: at most DEFAULT_QUEUE_SIZE messages wait to be checked
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import errno
+import logging
+import os
+import Queue
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+from sand.histogram import Histogram
+
+# Number of bytes read from a socket at once
+READ_SIZE = 16384
+
+# Largest header block (or chunk size line) followed; the rest of a
+# connection with a larger one is passed through without being checked
+MAX_HEAD_SIZE = 65536
+
+# Bytes waiting to be sent in a direction above which reading stops
+MAX_PENDING = 4 * READ_SIZE
+
+# Number of messages waiting for a validator above which messages are dropped
+DEFAULT_QUEUE_SIZE = 10000
+
+# Longest time spent checking headers before looking for data to forward
+CHECK_SLICE = 0.0005
+
+# Expected p99 of the time to forward data, in seconds
+LATENCY_BUDGET = 0.005
+
+# Number of pending connections accepted by the kernel
+LISTEN_BACKLOG = 1024
+
+# Longest wait of the event loop, so that a stop request is seen quickly
+MAX_WAIT = 1.0
+
+# Seconds during which the address of a host name is reused (forward proxy)
+RESOLVE_TTL = 60.0
+
+# Number of threads resolving host names, so that the event loop never waits
+# for the DNS
+RESOLVER_THREADS = 4
+
+# Prefix of the names of the resolver threads
+RESOLVER_NAME = 'sand-resolver'
+
+# Directions of the messages
+REQUEST = 'request'
+RESPONSE = 'response'
+
+# States of a MessageSniffer
+HEAD = 'head'               # reading a header block
+BODY = 'body'               # reading remaining bytes of a body
+CHUNK_SIZE = 'chunk_size'   # reading the size line of a chunk
+CHUNK_DATA = 'chunk_data'   # reading remaining bytes of a chunk and its CRLF
+TRAILER = 'trailer'         # reading the trailer of a chunked body
+UNTIL_CLOSE = 'until_close' # body delimited by the end of the connection
+TUNNEL = 'tunnel'           # not HTTP anymore (CONNECT, Upgrade)
+LOST = 'lost'               # framing not understood, checks stopped
+
+class MessageSniffer:
+    """Follows the HTTP/1.x messages sent in a direction of a connection,
+    from the bytes given to feed, and calls on_head(direction, suite, headers)
+    for each header block carrying SAND headers. suite describes the message,
+    e.g. "GET /path" or "200 GET /path".
+    Only incomplete header blocks and chunk size lines are kept, bodies
+    are counted. The sniffer of the responses is linked to the one of the
+    requests (peer), from which it takes the request methods, needed to
+    know the framing of the responses."""
+
+    def __init__(self, direction, on_head, peer=None):
+        self.direction = direction
+        self.on_head = on_head
+        self.peer = peer
+        self.state = HEAD
+        self.buffer = ''
+        self.remaining = 0
+        self.requests = deque() # (method, target, Host) of requests without response
+        self.messages = 0
+        if peer is not None:
+            peer.peer = self
+
+    def feed(self, data):
+        """Follows the bytes of data."""
+        while data:
+            state = self.state
+            if state == BODY or state == CHUNK_DATA:
+                if len(data) < self.remaining:
+                    self.remaining -= len(data)
+                    return
+                data = data[self.remaining:]
+                self.remaining = 0
+                self.state = HEAD if state == BODY else CHUNK_SIZE
+            elif state == HEAD or state == CHUNK_SIZE or state == TRAILER:
+                buffer = self.buffer + data if self.buffer else data
+                separator = '\r\n\r\n' if state == HEAD else '\r\n'
+                if state == HEAD:
+                    # empty lines before a message are ignored
+                    buffer = buffer.lstrip('\r\n')
+                elif state == TRAILER and buffer.startswith('\r\n'):
+                    separator = '\r\n'
+                end = buffer.find(separator)
+                if end < 0:
+                    if len(buffer) > MAX_HEAD_SIZE:
+                        self.lose()
+                    else:
+                        self.buffer = buffer
+                    return
+                self.buffer = ''
+                data = buffer[end + len(separator):]
+                if state == HEAD:
+                    self.head(buffer[:end])
+                elif state == CHUNK_SIZE:
+                    self.chunk_size(buffer[:end])
+                else:
+                    self.state = HEAD
+            else:
+                return
+
+    def lose(self):
+        """Stops following the messages, their framing is not understood."""
+        self.state = LOST
+        self.buffer = ''
+
+    def chunk_size(self, line):
+        try:
+            size = int(line.split(';', 1)[0].strip(), 16)
+        except ValueError:
+            self.lose()
+            return
+        if size:
+            self.state = CHUNK_DATA
+            self.remaining = size + 2 # and its CRLF
+        else:
+            self.state = TRAILER
+
+    def head(self, block):
+        lines = block.split('\r\n')
+        headers = []
+        for line in lines[1:]:
+            if line[:1] in (' ', '\t') and headers:
+                # obsolete line folding
+                headers[-1] = (headers[-1][0], headers[-1][1] + ' ' + line.strip())
+                continue
+            name, separator, value = line.partition(':')
+            if not separator:
+                self.lose()
+                return
+            headers.append((name.strip(), value.strip()))
+        start = lines[0].split(' ', 2)
+        if len(start) != 3:
+            self.lose()
+            return
+        self.messages += 1
+        if self.direction == REQUEST:
+            method, target = start[0], start[1]
+            host = None
+            for name, value in headers:
+                if name.lower() == 'host':
+                    host = value
+            self.requests.append((method, target, host))
+            suite = '%s %s' % (method, target)
+            if method == 'CONNECT':
+                self.state = TUNNEL
+            else:
+                self.framing(headers, False)
+        else:
+            try:
+                status = int(start[1])
+            except ValueError:
+                self.lose()
+                return
+            requests = self.peer.requests if self.peer is not None else ()
+            method, target, host = requests[0] if requests else ('GET', '', None)
+            suite = '%d %s %s' % (status, method, target)
+            if status == 101:
+                self.tunnel()
+            elif status < 200:
+                # interim response, the final one follows
+                self.state = HEAD
+            else:
+                if requests:
+                    requests.popleft()
+                if method == 'CONNECT' and status < 300:
+                    self.tunnel()
+                elif method == 'HEAD' or status in (204, 304):
+                    self.state = HEAD
+                else:
+                    self.framing(headers, True)
+        for name, value in headers:
+            if name[:5].lower() == 'sand-':
+                self.on_head(self.direction, suite, headers)
+                break
+
+    def tunnel(self):
+        """Stops following both directions, which are not HTTP anymore."""
+        self.state = TUNNEL
+        if self.peer is not None:
+            self.peer.state = TUNNEL
+
+    def framing(self, headers, until_close):
+        """Sets the state for the body of a message with headers.
+        until_close is True if a body without length ends with the connection."""
+        encoding = None
+        length = None
+        for name, value in headers:
+            lower_name = name.lower()
+            if lower_name == 'transfer-encoding':
+                encoding = value.lower()
+            elif lower_name == 'content-length':
+                length = value
+        if encoding is not None:
+            if encoding.split(',')[-1].strip() == 'chunked':
+                self.state = CHUNK_SIZE
+            elif until_close:
+                self.state = UNTIL_CLOSE
+            else:
+                self.lose()
+        elif length is not None:
+            try:
+                self.remaining = int(length)
+            except ValueError:
+                self.lose()
+                return
+            self.state = BODY if self.remaining > 0 else HEAD
+        else:
+            self.state = UNTIL_CLOSE if until_close else HEAD
+
+class ProxyStats:
+    """Counters of a Proxy.
+    Attributes are:
+    - accepted: connections accepted
+    - open: connections open
+    - failed: connections to upstream servers that failed
+    - requests, responses: messages followed
+    - lost: directions of connections whose framing was not understood
+    - forwarding: Histogram of the time from the readiness of a socket
+      to the sending of the data read from it, since the previous status"""
+
+    def __init__(self):
+        self.accepted = 0
+        self.open = 0
+        self.failed = 0
+        self.requests = 0
+        self.responses = 0
+        self.lost = 0
+        self.forwarding = Histogram()
+
+class Validator:
+    """Checks the headers of messages, between the forwarding of data.
+    Checks run in the thread of the event loop, while it has nothing to
+    forward or for at most CHECK_SLICE per turn: threads would not run
+    them in parallel (only one thread runs Python code at a time), and
+    handing the GIL over to them delays the event loop.
+    report(direction, suite, report) is called for each message, report
+    being the result of check_headers."""
+
+    def __init__(self, report, queue_size=DEFAULT_QUEUE_SIZE):
+        self.report = report
+        self.queue_size = queue_size
+        self.jobs = deque()
+        self.submitted = 0
+        self.dropped = 0
+
+    def submit(self, direction, suite, headers):
+        """Queues the headers of a message, or drops them if the queue is full."""
+        if len(self.jobs) >= self.queue_size:
+            self.dropped += 1
+            return
+        self.jobs.append((direction, suite, headers))
+        self.submitted += 1
+
+    def run(self, duration=None):
+        """Checks queued messages for about duration seconds,
+        or until none is left if duration is None."""
+        from sand.header import check_headers
+
+        jobs = self.jobs
+        end = time.time() + duration if duration is not None else None
+        while jobs:
+            direction, suite, headers = jobs.popleft()
+            try:
+                self.report(direction, suite, check_headers(headers))
+            except Exception:
+                logging.exception('Checking the headers of %s failed', suite)
+            if end is not None and time.time() >= end:
+                return
+
+class Poller:
+    """Readiness of sockets, with epoll or select."""
+
+    def __init__(self):
+        self.epoll = select.epoll() if hasattr(select, 'epoll') else None
+        self.events = {} # file descriptor -> (read, write)
+
+    def set(self, fd, read, write):
+        """Sets the readiness waited for on fd."""
+        previous = self.events.get(fd)
+        if previous == (read, write):
+            return
+        self.events[fd] = (read, write)
+        if self.epoll:
+            mask = (select.EPOLLIN if read else 0) | (select.EPOLLOUT if write else 0)
+            if previous is None:
+                self.epoll.register(fd, mask)
+            else:
+                self.epoll.modify(fd, mask)
+
+    def remove(self, fd):
+        if self.events.pop(fd, None) is not None and self.epoll:
+            self.epoll.unregister(fd)
+
+    def poll(self, timeout):
+        """Returns the lists of file descriptors ready for reading and writing."""
+        if self.epoll:
+            readable, writable = [], []
+            for fd, events in self.epoll.poll(timeout):
+                if events & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR):
+                    readable.append(fd)
+                if events & (select.EPOLLOUT | select.EPOLLERR):
+                    writable.append(fd)
+            return readable, writable
+        readers = [fd for fd, (read, write) in self.events.items() if read]
+        writers = [fd for fd, (read, write) in self.events.items() if write]
+        readable, writable, _ = select.select(readers, writers, [], timeout)
+        return readable, writable
+
+class Resolver:
+    """Resolves host names in threads, so that the event loop does not wait.
+    resolve((host, port)) is called from the event loop; the results are
+    taken with results() when fileno() is readable."""
+
+    def __init__(self, threads=RESOLVER_THREADS):
+        self.lookups = Queue.Queue()
+        self.done = deque() # (address, socket address or None, error)
+        self.wake_read, self.wake_write = os.pipe()
+        self.threads = []
+        for number in range(threads):
+            thread = threading.Thread(target=self.work,
+                                      name='%s-%d' % (RESOLVER_NAME, number))
+            thread.daemon = True # a lookup never answered does not block the exit
+            thread.start()
+            self.threads.append(thread)
+
+    def fileno(self):
+        return self.wake_read
+
+    def resolve(self, address):
+        self.lookups.put(address)
+
+    def work(self):
+        while True:
+            address = self.lookups.get()
+            if address is None:
+                return
+            try:
+                infos = socket.getaddrinfo(address[0], address[1], socket.AF_INET,
+                                           socket.SOCK_STREAM)
+                self.done.append((address, infos[0][4], None))
+            except socket.error as error:
+                self.done.append((address, None, error))
+            try:
+                os.write(self.wake_write, 'x')
+            except OSError:
+                return # closed
+
+    def results(self):
+        """Returns the lookups finished since the last call."""
+        try:
+            os.read(self.wake_read, 4096)
+        except OSError:
+            pass
+        results = []
+        while self.done:
+            results.append(self.done.popleft())
+        return results
+
+    def close(self):
+        for _ in self.threads:
+            self.lookups.put(None)
+        for thread in self.threads:
+            thread.join(MAX_WAIT)
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+
+class Side:
+    """A socket of a proxied connection, with the bytes waiting to be sent to it."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.pending = ''
+        self.connected = True
+        self.eof = False      # nothing more will be received
+        self.shut = False     # nothing more will be sent
+
+class ProxyConnection:
+    """A client connection and its upstream connection."""
+
+    def __init__(self, client_sock, sniff):
+        self.client = Side(client_sock)
+        self.upstream = None
+        self.address = None # (host, port) of the upstream server
+        self.buffered = '' # bytes received before the upstream server is connected
+        self.closed = False
+        self.requests = MessageSniffer(REQUEST, sniff)
+        self.responses = MessageSniffer(RESPONSE, sniff, self.requests)
+
+    def other(self, side):
+        return self.upstream if side is self.client else self.client
+
+def split_host(authority, default_port=80):
+    """Returns (host, port) of a host[:port] string."""
+    if authority.startswith('['):
+        host, _, port = authority[1:].partition(']')
+        port = port[1:]
+    else:
+        host, _, port = authority.partition(':')
+    try:
+        return host.lower(), int(port) if port else default_port
+    except ValueError:
+        return None
+
+def request_address(method, target, host):
+    """Returns the (host, port) a request is for, from its target
+    (absolute-form or authority-form) or its Host header, or None."""
+    if method == 'CONNECT':
+        return split_host(target, 443)
+    if target.lower().startswith('http://'):
+        return split_host(target[7:].split('/', 1)[0])
+    if host:
+        return split_host(host)
+    return None
+
+class Proxy:
+    """Passes the traffic between clients connecting to listen_address
+    and upstream servers through, and gives the messages carrying SAND
+    headers to validator. upstream is the (host, port) of the server,
+    or None for a forward proxy.
+    run() is called from one thread, stop() from any thread."""
+
+    def __init__(self, listen_address, upstream, validator):
+        self.upstream = upstream
+        self.validator = validator
+        self.stats = ProxyStats()
+        self.stopped = False
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(listen_address)
+        self.listener.listen(LISTEN_BACKLOG)
+        self.listener.setblocking(0)
+        self.poller = Poller()
+        self.sides = {} # file descriptor -> (ProxyConnection, Side)
+        self.addresses = {} # (host, port) -> (socket address, time of resolution)
+        self.resolver = Resolver()
+        self.resolving = {} # (host, port) -> connections waiting for its address
+
+    def address(self):
+        """Returns the (host, port) the proxy listens on."""
+        return self.listener.getsockname()
+
+    def stop(self):
+        """Makes run() return within MAX_WAIT."""
+        self.stopped = True
+
+    def run(self, status_interval):
+        """Passes the traffic through until stop() is called. This is a
+        generator yielding the stats every status_interval seconds, and once
+        more at the end."""
+        listener_fd = self.listener.fileno()
+        self.poller.set(listener_fd, True, False)
+        resolver_fd = self.resolver.fileno()
+        self.poller.set(resolver_fd, True, False)
+        next_status = time.time() + status_interval
+        while not self.stopped:
+            timeout = max(0.0, min(MAX_WAIT, next_status - time.time()))
+            try:
+                readable, writable = self.poller.poll(
+                    0.0 if self.validator.jobs else timeout)
+            except (IOError, select.error) as error:
+                if error.args[0] == errno.EINTR:
+                    continue
+                raise
+            ready = time.time()
+            for fd in readable:
+                if fd == listener_fd:
+                    self.accept()
+                elif fd == resolver_fd:
+                    self.resolved()
+                elif fd in self.sides:
+                    self.receive(fd, ready)
+            for fd in writable:
+                if fd in self.sides:
+                    connection, side = self.sides[fd]
+                    if not side.connected:
+                        self.connected(connection, side)
+                    self.send(connection, side, ready)
+            self.validator.run(CHECK_SLICE)
+            if ready >= next_status:
+                yield self.stats
+                self.stats.forwarding = Histogram()
+                next_status = time.time() + status_interval
+        for connection, side in self.sides.values():
+            self.close(connection)
+        self.listener.close()
+        self.poller.remove(resolver_fd)
+        self.resolver.close()
+        self.validator.run()
+        yield self.stats
+
+    def sniff(self, direction, suite, headers):
+        self.validator.submit(direction, suite, headers)
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except socket.error:
+                return
+            sock.setblocking(0)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = ProxyConnection(sock, self.sniff)
+            self.sides[sock.fileno()] = (connection, connection.client)
+            self.poller.set(sock.fileno(), True, False)
+            self.stats.accepted += 1
+            self.stats.open += 1
+            if self.upstream is not None:
+                self.connect(connection, self.upstream)
+
+    def connect(self, connection, address):
+        """Starts the connection to the upstream server at address, once its
+        address is known. Addresses are resolved by the resolver threads,
+        at most every RESOLVE_TTL seconds."""
+        connection.address = address
+        cached = self.addresses.get(address)
+        if cached is not None and time.time() - cached[1] <= RESOLVE_TTL:
+            self.open_upstream(connection, cached[0])
+            return
+        waiting = self.resolving.get(address)
+        if waiting is None:
+            waiting = self.resolving[address] = []
+            self.resolver.resolve(address)
+        waiting.append(connection)
+
+    def resolved(self):
+        """Connects the connections waiting for the addresses just resolved."""
+        now = time.time()
+        for address, sock_address, error in self.resolver.results():
+            if sock_address is not None:
+                if len(self.addresses) > 1000:
+                    self.addresses.clear()
+                self.addresses[address] = (sock_address, now)
+            for connection in self.resolving.pop(address, ()):
+                if connection.closed:
+                    continue
+                if error is not None:
+                    logging.warning('Cannot connect to %s:%d: %s',
+                                    address[0], address[1], error)
+                    self.stats.failed += 1
+                    self.close(connection)
+                    continue
+                self.open_upstream(connection, sock_address)
+
+    def open_upstream(self, connection, sock_address):
+        """Starts the connection to the upstream server at sock_address,
+        and forwards the bytes buffered until then."""
+        address = connection.address
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        except socket.error as error:
+            logging.warning('Cannot connect to %s:%d: %s', address[0], address[1], error)
+            self.stats.failed += 1
+            self.close(connection)
+            return
+        sock.setblocking(0)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        upstream = connection.upstream = Side(sock)
+        upstream.connected = False
+        upstream.pending = connection.buffered
+        connection.buffered = ''
+        self.sides[sock.fileno()] = (connection, upstream)
+        code = sock.connect_ex(sock_address)
+        if code not in (0, errno.EINPROGRESS):
+            logging.warning('Cannot connect to %s:%d: %s', address[0], address[1],
+                            errno.errorcode.get(code, code))
+            self.stats.failed += 1
+            self.close(connection)
+            return
+        self.poller.set(sock.fileno(), False, True)
+
+    def connected(self, connection, side):
+        code = side.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if code:
+            logging.warning('Cannot connect to %s:%d: %s', connection.address[0],
+                            connection.address[1], errno.errorcode.get(code, code))
+            self.stats.failed += 1
+            self.close(connection)
+            return
+        side.connected = True
+        self.update(connection)
+
+    def receive(self, fd, ready):
+        connection, side = self.sides[fd]
+        if not side.connected:
+            # the connection to the upstream server failed
+            self.connected(connection, side)
+            return
+        other = connection.other(side)
+        try:
+            data = side.sock.recv(READ_SIZE)
+        except socket.error as error:
+            if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self.close(connection)
+            return
+        if not data:
+            side.eof = True
+            self.update(connection)
+            return
+        if side is connection.client:
+            # requests are followed before being forwarded, so that a forward
+            # proxy can choose the upstream server
+            if not self.follow(connection, connection.requests, data):
+                return
+            if connection.upstream is None:
+                connection.buffered += data
+                if connection.address is None:
+                    self.route(connection)
+                return
+            other.pending += data
+            self.send(connection, other, ready)
+        else:
+            other.pending += data
+            self.send(connection, other, ready)
+            self.follow(connection, connection.responses, data)
+
+    def follow(self, connection, sniffer, data):
+        """Gives data to sniffer. Returns False if the connection was closed."""
+        messages = sniffer.messages
+        state = sniffer.state
+        if state == TUNNEL or state == LOST or state == UNTIL_CLOSE:
+            return True
+        sniffer.feed(data)
+        count = sniffer.messages - messages
+        if sniffer.direction == REQUEST:
+            self.stats.requests += count
+            if self.upstream is None and connection.address is not None and count:
+                # a connection of a forward proxy goes to a single server
+                for request in list(sniffer.requests)[-count:]:
+                    if request_address(*request) != connection.address:
+                        self.close(connection)
+                        return False
+        else:
+            self.stats.responses += count
+        if sniffer.state == LOST:
+            self.stats.lost += 1
+        return True
+
+    def route(self, connection):
+        """Connects a forward proxy connection to the server of its first request."""
+        requests = connection.requests
+        if not requests.requests:
+            if requests.state == LOST:
+                self.close(connection)
+            return
+        address = request_address(*requests.requests[0])
+        if address is None or any(request_address(*request) != address
+                                  for request in requests.requests):
+            self.close(connection)
+            return
+        if requests.requests[0][0] == 'CONNECT':
+            # the request is answered by the proxy, the rest is tunnelled
+            connection.buffered = connection.buffered.partition('\r\n\r\n')[2]
+            requests.requests.clear()
+            connection.responses.state = TUNNEL
+            connection.client.pending = 'HTTP/1.1 200 Connection Established\r\n\r\n'
+        self.connect(connection, address)
+
+    def send(self, connection, side, ready):
+        if side.pending and side.connected:
+            try:
+                sent = side.sock.send(side.pending)
+            except socket.error as error:
+                if error.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    self.close(connection)
+                    return
+                sent = 0
+            side.pending = side.pending[sent:]
+            if sent:
+                self.stats.forwarding.record(time.time() - ready)
+        self.update(connection)
+
+    def update(self, connection):
+        """Sets the readiness waited for on the sockets of a connection,
+        shuts down and closes them when done."""
+        if connection.closed:
+            return
+        client, upstream = connection.client, connection.upstream
+        if upstream is None:
+            if client.eof and connection.address is None:
+                self.close(connection)
+            return
+        for side in (client, upstream):
+            other = connection.other(side)
+            if other.eof and not side.pending and not side.shut and side.connected:
+                try:
+                    side.sock.shutdown(socket.SHUT_WR)
+                except socket.error:
+                    pass
+                side.shut = True
+        if client.shut and upstream.shut:
+            self.close(connection)
+            return
+        for side in (client, upstream):
+            if side.connected:
+                other = connection.other(side)
+                read = not side.eof and len(other.pending) < MAX_PENDING
+                self.poller.set(side.sock.fileno(), read, bool(side.pending))
+
+    def close(self, connection):
+        connection.closed = True
+        for side in (connection.client, connection.upstream):
+            if side is not None and side.sock.fileno() in self.sides:
+                fd = side.sock.fileno()
+                del self.sides[fd]
+                self.poller.remove(fd)
+                side.sock.close()
+                if side is connection.client:
+                    self.stats.open -= 1
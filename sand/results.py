@@ -0,0 +1,307 @@
+#!/usr/bin/python
+
+"""
+Reporting of test results, part of SAND conformance server.
+
+This module is part of implementation of a conformance server
+for ISO/IEC 23009-5 SAND.
+The outcome of each test is a TestResult record, given to the sinks of a
+Reporter: JSON lines, JUnit XML, a summary of the counts per test, or log
+lines. Sinks buffer their output and write it in batches, and a Reporter
+without sinks drops records without formatting them.
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import json
+import logging
+import sys
+import threading
+from contextlib import contextmanager
+
+# Output formats of the sinks
+FORMAT_JSONL = 'jsonl'
+FORMAT_JUNIT = 'junit'
+FORMAT_SUMMARY = 'summary'
+
+# Number of records buffered by a sink before writing them
+DEFAULT_BUFFER_SIZE = 1000
+
+def as_text(value):
+    """Returns value with its byte strings decoded from UTF-8, in dictionaries,
+    lists and tuples too. Bytes which are not UTF-8 (e.g. from a raw capture)
+    are replaced, so that writing a result never fails because of its content."""
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, dict):
+        return dict((as_text(key), as_text(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [as_text(item) for item in value]
+    return value
+
+class TestResult:
+    """Outcome of a test.
+    Attributes are:
+    - suite: what was tested (a URL, a file, a record...), or None
+    - name: the name of the test
+    - passed: True if the test passed
+    - message: an explanation, or None
+    - details: a dictionary of other values (expected and actual values,
+    timings...), which must be serializable in JSON"""
+
+    def __init__(self, suite, name, passed, message=None, details=None):
+        self.suite = suite
+        self.name = name
+        self.passed = passed
+        self.message = message
+        self.details = details or {}
+
+    def status(self):
+        """Returns OK or KO."""
+        return 'OK' if self.passed else 'KO'
+
+class ResultSink:
+    """Destination of test results.
+    add is called with the lock of the reporter held, so sinks need not
+    be thread safe. close writes what is buffered and closes the output
+    if it was opened by the sink."""
+
+    def __init__(self, output=None, close_output=False):
+        self.output = output if output is not None else sys.stdout
+        self.close_output = close_output
+
+    def add(self, result):
+        pass
+
+    def flush(self):
+        """Writes what can be written before close."""
+        self.output.flush()
+
+    def close(self):
+        self.output.flush()
+        if self.close_output:
+            self.output.close()
+
+class JsonLinesSink(ResultSink):
+    """Writes a JSON object per result, in batches of buffer_size lines."""
+
+    def __init__(self, output=None, close_output=False,
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        ResultSink.__init__(self, output, close_output)
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    def add(self, result):
+        record = dict(result.details)
+        record.update(suite=result.suite, test=result.name,
+                      status=result.status(), message=result.message)
+        self.buffer.append(json.dumps(as_text(record), sort_keys=True))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered lines."""
+        if self.buffer:
+            self.buffer.append('')
+            self.output.write('\n'.join(self.buffer))
+            self.buffer = []
+        self.output.flush()
+
+    def close(self):
+        self.flush()
+        ResultSink.close(self)
+
+class JUnitSink(ResultSink):
+    """Writes the results as a JUnit XML report, with a test suite
+    per suite of the results. The report is written when closed,
+    since the counts of the suites are then known."""
+
+    def __init__(self, output=None, close_output=False):
+        ResultSink.__init__(self, output, close_output)
+        self.suites = {} # suite -> list of (name, message or None if passed, time)
+
+    def add(self, result):
+        self.suites.setdefault(as_text(result.suite or ''), []).append(
+            (as_text(result.name),
+             None if result.passed else as_text(result.message or ''),
+             result.details.get('elapsed')))
+
+    def close(self):
+        from xml.sax.saxutils import escape, quoteattr
+
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<testsuites>']
+        for suite in sorted(self.suites):
+            cases = self.suites[suite]
+            failures = sum(1 for case in cases if case[1] is not None)
+            lines.append('  <testsuite name=%s tests="%d" failures="%d">'
+                         % (quoteattr(suite), len(cases), failures))
+            for name, failure, elapsed in cases:
+                attributes = 'classname=%s name=%s' % (quoteattr(suite),
+                                                       quoteattr(name))
+                if elapsed is not None:
+                    attributes += ' time="%.6f"' % elapsed
+                if failure is None:
+                    lines.append('    <testcase %s/>' % attributes)
+                else:
+                    lines.append('    <testcase %s>' % attributes)
+                    lines.append('      <failure message=%s>%s</failure>'
+                                 % (quoteattr(failure), escape(failure)))
+                    lines.append('    </testcase>')
+            lines.append('  </testsuite>')
+        lines.append('</testsuites>')
+        lines.append('')
+        text = '\n'.join(lines)
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.output.write(text)
+        ResultSink.close(self)
+
+class SummarySink(ResultSink):
+    """Writes the numbers of passed and failed results per test name when closed."""
+
+    def __init__(self, output=None, close_output=False):
+        ResultSink.__init__(self, output, close_output)
+        self.counts = {} # test name -> [passed, failed]
+
+    def add(self, result):
+        name = as_text(result.name)
+        counts = self.counts.get(name)
+        if counts is None:
+            counts = self.counts[name] = [0, 0]
+        counts[0 if result.passed else 1] += 1
+
+    def close(self):
+        if self.counts:
+            lines = ['%-32s %8s %8s' % ('test', 'passed', 'failed')]
+            passed = failed = 0
+            for name in sorted(self.counts):
+                counts = self.counts[name]
+                lines.append('%-32s %8d %8d' % (name, counts[0], counts[1]))
+                passed += counts[0]
+                failed += counts[1]
+            lines.append('%-32s %8d %8d' % ('total', passed, failed))
+            lines.append('')
+            self.output.write('\n'.join(lines).encode('utf-8'))
+        ResultSink.close(self)
+
+class LogSink(ResultSink):
+    """Logs a [TEST] line per result, for verbose output."""
+
+    def __init__(self, logger=None):
+        ResultSink.__init__(self)
+        self.logger = logger or logging.getLogger()
+
+    def add(self, result):
+        fields = [result.suite, result.name, result.status(), result.message]
+        self.logger.info('[TEST] %s', '|'.join(unicode(as_text(field)) for field in fields
+                                               if field is not None))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+sink_classes = {
+    FORMAT_JSONL: JsonLinesSink,
+    FORMAT_JUNIT: JUnitSink,
+    FORMAT_SUMMARY: SummarySink,
+}
+
+def open_sink(spec):
+    """Creates a sink from a specification format[:path],
+    e.g. jsonl:results.jsonl or summary. Without path, or with path -,
+    the sink writes to the standard output."""
+    format, _, path = spec.partition(':')
+    if format not in sink_classes:
+        raise ValueError('Unknown result format "%s", expected one of %s'
+                         % (format, ', '.join(sorted(sink_classes))))
+    if not path or path == '-':
+        return sink_classes[format]()
+    return sink_classes[format](open(path, 'w'), close_output=True)
+
+class Reporter:
+    """Gives test results to sinks.
+    The suite of the results is set for the current thread with suite(),
+    so that the functions running tests need not know what is tested.
+    A Reporter can be used from several threads."""
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def add_sink(self, sink):
+        """Adds a destination for the results."""
+        with self.lock:
+            self.sinks.append(sink)
+
+    def current_suite(self):
+        """Returns the suite of the current thread, or None."""
+        return getattr(self.local, 'suite', None)
+
+    @contextmanager
+    def suite(self, name):
+        """Sets the suite of the results of the current thread
+        while the context is active."""
+        previous = self.current_suite()
+        self.local.suite = name
+        try:
+            yield
+        finally:
+            self.local.suite = previous
+
+    def record(self, name, passed, message=None, suite=None, **details):
+        """Reports the outcome of a test. suite defaults to the suite
+        of the current thread. details are kept in the result."""
+        if not self.sinks:
+            return
+        if suite is None:
+            suite = self.current_suite()
+        result = TestResult(suite, name, passed, message, details)
+        with self.lock:
+            for sink in self.sinks:
+                sink.add(result)
+
+    def flush(self):
+        """Writes the results buffered by the sinks that can write them
+        before being closed, e.g. periodically in a long running process."""
+        with self.lock:
+            for sink in self.sinks:
+                sink.flush()
+
+    def close(self):
+        """Writes the results buffered by the sinks, and removes them."""
+        with self.lock:
+            sinks = self.sinks
+            self.sinks = []
+        for sink in sinks:
+            sink.close()
+
+# Reporter used by the command line client
+reporter = Reporter()
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+
+"""
+Cache of validated DANE responses, part of SAND conformance server.
+
+This module is part of implementation of a conformance server
+for ISO/IEC 23009-5 SAND.
+When the same DANE URLs are checked repeatedly, the validators (ETag,
+Last-Modified) of the previous response to each URL are sent back in
+conditional requests: a 304 Not Modified response reuses the result of the
+previous validation. The result of the validation of each message body is
+also kept, keyed by a hash of the body and of the schemas, so that a body
+already validated is not validated again against the XSD and the Schematron.
+The cache is kept in memory, and optionally in a directory so that it
+survives between runs.
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from os.path import join
+
+# Number of URLs and of message bodies whose result is kept in memory,
+# the oldest ones are forgotten first
+MAX_MEMORY_ENTRIES = 10000
+
+class CacheEntry:
+    """Result of the validation of the last response to a URL.
+    Attributes are:
+    - url: the requested URL
+    - etag, last_modified: the validators of the response, or None
+    - is_valid: True if the response passed all the checks"""
+
+    def __init__(self, url, etag=None, last_modified=None, is_valid=False):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.is_valid = is_valid
+
+    def conditional_headers(self):
+        """Returns the headers of a request for the same URL
+        asking for the response only if it changed."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+_schemas_digests = {}
+
+def schemas_digest():
+    """Returns a hash of the content of the default XSD and Schematron,
+    so that results obtained with other schemas are not reused."""
+    from sand import xml_message
+
+    key = (xml_message.default_xsd_path, xml_message.default_sch_path)
+    digest = _schemas_digests.get(key)
+    if digest is None:
+        content_hash = hashlib.sha1()
+        for path in key:
+            with open(path, 'rb') as f:
+                content_hash.update(f.read())
+        digest = _schemas_digests[key] = content_hash.hexdigest()
+    return digest
+
+class ResponseCache:
+    """Validation results of previous responses per URL, and of message bodies.
+    If store_dir is given, entries are also written in this directory
+    (as small JSON files) and read from it when missing in memory.
+    Errors of the on-disk store are ignored, since it is only an optimization.
+    A ResponseCache can be used from several threads."""
+
+    def __init__(self, store_dir=None, max_memory_entries=MAX_MEMORY_ENTRIES):
+        self.store_dir = store_dir
+        self.max_memory_entries = max_memory_entries
+        self.entries = OrderedDict() # URL -> CacheEntry
+        self.messages = OrderedDict() # body hash -> (is_valid, errors)
+        self.lock = threading.Lock()
+
+    def remember(self, table, key, value):
+        """Keeps value in a memory table, forgetting the oldest values if full."""
+        with self.lock:
+            table.pop(key, None)
+            table[key] = value
+            while len(table) > self.max_memory_entries:
+                table.popitem(last=False)
+
+    def store_path(self, kind, key):
+        """Returns the file storing the value of key."""
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return join(self.store_dir, '%s-%s.json' % (kind, hashlib.sha1(key).hexdigest()))
+
+    def read(self, kind, key):
+        """Returns the JSON value stored for key, or None."""
+        if not self.store_dir:
+            return None
+        try:
+            with open(self.store_path(kind, key)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            # missing or damaged entry
+            return None
+
+    def write(self, kind, key, value):
+        """Stores a JSON value for key."""
+        if not self.store_dir:
+            return
+        try:
+            if not os.path.isdir(self.store_dir):
+                os.makedirs(self.store_dir)
+            # write to a temporary file first, so that readers never see a partial file
+            handle, temp_path = tempfile.mkstemp(dir=self.store_dir, suffix='.tmp')
+            with os.fdopen(handle, 'w') as f:
+                json.dump(value, f)
+            os.rename(temp_path, self.store_path(kind, key))
+        except (IOError, OSError):
+            pass
+
+    def get(self, url):
+        """Returns the CacheEntry of the last response validated for url, or None."""
+        entry = self.entries.get(url)
+        if entry is None:
+            value = self.read('url', url)
+            if value is None:
+                return None
+            entry = CacheEntry(url, value.get('etag'), value.get('last_modified'),
+                               value.get('is_valid', False))
+            self.remember(self.entries, url, entry)
+        return entry
+
+    def conditional_headers(self, url):
+        """Returns the headers of a conditional request for url,
+        or None if no response to url was validated."""
+        entry = self.get(url)
+        if entry is None:
+            return None
+        return entry.conditional_headers() or None
+
+    def update(self, url, response, is_valid):
+        """Keeps the result of the validation of a response to url.
+        Responses without validators are not kept, since they cannot
+        be requested conditionally."""
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        self.remember(self.entries, url, CacheEntry(url, etag, last_modified, is_valid))
+        self.write('url', url, {'url': url, 'etag': etag,
+                                'last_modified': last_modified,
+                                'is_valid': is_valid})
+
+    def message_key(self, body):
+        """Returns the key of the result of the validation of body."""
+        return hashlib.sha1(schemas_digest() + body).hexdigest()
+
+    def message_result(self, body):
+        """Returns (is_valid, errors) of a previous validation
+        of the message body, or None."""
+        key = self.message_key(body)
+        result = self.messages.get(key)
+        if result is None:
+            value = self.read('message', key)
+            if value is None:
+                return None
+            result = (value['is_valid'], value['errors'])
+            self.remember(self.messages, key, result)
+        return result[0], list(result[1])
+
+    def add_message_result(self, body, is_valid, errors):
+        """Keeps the result of the validation of the message body."""
+        key = self.message_key(body)
+        self.remember(self.messages, key, (is_valid, list(errors)))
+        self.write('message', key, {'is_valid': is_valid, 'errors': errors})
+
+# Cache used by the client, None if disabled
+response_cache = None
+
+def enable_response_cache(store_dir=None):
+    """Makes the client cache the validation results of responses,
+    in memory and in store_dir if given."""
+    global response_cache
+    response_cache = ResponseCache(store_dir)
+
+def disable_response_cache():
+    """Makes the client validate every response."""
+    global response_cache
+    response_cache = None
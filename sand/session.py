@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+"""
+Shared HTTP session, part of SAND conformance server.
+
+This module is part of implementation of a conformance server
+for ISO/IEC 23009-5 SAND.
+It provides the HTTP session used for every request made by the client,
+so that connections to a DANE are kept alive and reused between requests
+instead of being opened (with a new TCP/TLS handshake) for each of them.
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ReadTimeoutError
+
+from sand.timing import CONNECT, DOWNLOAD, TTFB, phase
+
+# Number of hosts for which a pool of connections is kept
+DEFAULT_POOL_CONNECTIONS = 10
+
+# Number of connections kept alive per host
+DEFAULT_POOL_MAXSIZE = 10
+
+# Seconds to wait for a connection to be established, and between two
+# bytes received, so that a DANE which never answers does not block a check
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 30.0
+
+# (connect, read) timeout of the requests sent by fetch
+request_timeout = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+
+# Settings used when the session is created
+pool_settings = {
+    'pool_connections': DEFAULT_POOL_CONNECTIONS,
+    'pool_maxsize': DEFAULT_POOL_MAXSIZE,
+    'pool_block': False,
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+class TimedHTTPConnection(HTTPConnection):
+    """HTTP connection timing its establishment in the current timer."""
+
+    def connect(self):
+        with phase(CONNECT):
+            HTTPConnection.connect(self)
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """HTTPS connection timing its establishment (TLS handshake included)
+    in the current timer."""
+
+    def connect(self):
+        with phase(CONNECT):
+            HTTPSConnection.connect(self)
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """Transport adapter whose connections are timed."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+def configure_session(pool_connections=DEFAULT_POOL_CONNECTIONS,
+                      pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False):
+    """Sets the size of the connection pools.
+    pool_connections: number of hosts for which connections are kept.
+    pool_maxsize: number of connections kept alive per host.
+    pool_block: if True, pool_maxsize is also a hard limit of concurrent
+    connections per host (requests wait for a free connection).
+    The current session, if any, is closed and a new one will be created."""
+    global _session
+    with _session_lock:
+        pool_settings.update(pool_connections=pool_connections,
+                             pool_maxsize=pool_maxsize,
+                             pool_block=pool_block)
+        if _session is not None:
+            _session.close()
+            _session = None
+
+def configure_timeout(connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                      read_timeout=DEFAULT_READ_TIMEOUT):
+    """Sets the timeouts, in seconds, of the requests sent by fetch:
+    to establish a connection, and between two bytes of the response."""
+    global request_timeout
+    request_timeout = (connect_timeout, read_timeout)
+
+def get_session():
+    """Returns the requests.Session shared by all requests of the client."""
+    global _session
+    session = _session
+    if session is None:
+        with _session_lock:
+            session = _session
+            if session is None:
+                session = requests.Session()
+                adapter = TimedHTTPAdapter(**pool_settings)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return session
+
+def fetch(url, **kwargs):
+    """Sends a GET request with the shared session and reads the response.
+    The time to the response headers and the time to download the body
+    are added to the current timer, if any. Other arguments are passed
+    to requests.Session.get; timeout defaults to the timeouts set with
+    configure_timeout."""
+    session = get_session()
+    kwargs.setdefault('timeout', request_timeout)
+    with phase(TTFB):
+        response = session.get(url, stream=True, **kwargs)
+    with phase(DOWNLOAD):
+        try:
+            response.content
+        except requests.exceptions.ConnectionError as error:
+            # requests reports a timeout while reading the body as a
+            # connection error
+            if error.args and isinstance(error.args[0], ReadTimeoutError):
+                raise requests.exceptions.ReadTimeout(error, response=response)
+            raise
+    return response
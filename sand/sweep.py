@@ -0,0 +1,188 @@
+#!/usr/bin/python
+
+"""
+Concurrent conformance sweep of many DANEs, part of SAND conformance server.
+
+This module is part of implementation of a conformance server
+for ISO/IEC 23009-5 SAND.
+It runs a conformance check for each (URL, protocol) pair of a manifest
+with a bounded number of worker threads. Checks are dispatched round robin
+between hosts, with a limit of checks running at the same time per host,
+so that a host listed many times does not delay or overload the others.
+Results are yielded as soon as each check finishes.
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import Queue
+import threading
+import time
+from collections import OrderedDict, deque
+from urlparse import urlsplit
+
+from sand.timing import timing
+
+# Number of checks running at the same time
+DEFAULT_CONCURRENCY = 32
+
+# Number of checks running at the same time for one host
+DEFAULT_PER_HOST = 4
+
+# Number of manifest entries read ahead, per worker thread
+READ_AHEAD_PER_WORKER = 32
+
+# Longest wait for a result, so that KeyboardInterrupt is seen quickly
+# (a wait without timeout cannot be interrupted in Python 2)
+MAX_WAIT = 1.0
+
+# Prefix of the names of the worker threads
+WORKER_NAME = 'sand-sweep'
+
+def iter_sweep_manifest(manifest_path):
+    """Yields (URL, protocol) for each line of a sweep manifest.
+    Each line holds a URL and a protocol, separated by spaces, tabs or a comma.
+    Empty lines and lines starting with # are ignored."""
+    with open(manifest_path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.replace(',', ' ').split()
+            if len(fields) != 2:
+                raise ValueError('%s line %d: expected a URL and a protocol'
+                                 % (manifest_path, number))
+            yield fields[0], fields[1]
+
+def host_of(url):
+    """Returns the host (and port) a URL points to."""
+    return urlsplit(url).netloc.lower()
+
+class SweepResult:
+    """Result of the check of one (URL, protocol) pair.
+    Attributes are:
+    - url, protocol: the checked pair
+    - success: True if the check passed
+    - elapsed: duration of the check in seconds
+    - error: text of the exception raised by the check, or None
+    - timings: duration of each phase of the check (see sand.timing)"""
+
+    def __init__(self, url, protocol, success, elapsed, error=None, timings=None):
+        self.url = url
+        self.protocol = protocol
+        self.success = success
+        self.elapsed = elapsed
+        self.error = error
+        self.timings = timings or {}
+
+def sweep_worker(check, jobs, results):
+    """Runs the checks received in jobs until None is received."""
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        url, protocol = job
+        start = time.time()
+        error = None
+        with timing() as timer:
+            try:
+                success = bool(check(url, protocol))
+            except Exception as e:
+                success = False
+                error = '%s: %s' % (type(e).__name__, e)
+        results.put(SweepResult(url, protocol, success,
+                                time.time() - start, error, timer.phases))
+
+def sweep(targets, check, concurrency=DEFAULT_CONCURRENCY,
+          per_host=DEFAULT_PER_HOST):
+    """Runs check(url, protocol) for each (URL, protocol) of targets.
+    At most concurrency checks run at the same time, and at most per_host
+    for the same host. Hosts waiting for a worker are served round robin.
+    Yields a SweepResult for each target, in completion order.
+    targets is consumed lazily, so it may be a very long iterator."""
+    jobs = Queue.Queue()
+    results = Queue.Queue()
+    for number in range(concurrency):
+        worker = threading.Thread(target=sweep_worker,
+                                  args=(check, jobs, results),
+                                  name='%s-%d' % (WORKER_NAME, number))
+        worker.daemon = True
+        worker.start()
+
+    targets = iter(targets)
+    read_ahead = READ_AHEAD_PER_WORKER * concurrency
+    waiting = OrderedDict() # host -> deque of targets, in round robin order
+    buffered = 0
+    running = {} # host -> number of running checks
+    total_running = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and buffered < read_ahead:
+                try:
+                    url, protocol = next(targets)
+                except StopIteration:
+                    exhausted = True
+                    break
+                waiting.setdefault(host_of(url), deque()).append((url, protocol))
+                buffered += 1
+
+            # Each pass starts at most one check per host
+            dispatched = True
+            while dispatched and total_running < concurrency:
+                dispatched = False
+                for host in list(waiting):
+                    if total_running >= concurrency:
+                        break
+                    if running.get(host, 0) >= per_host:
+                        continue
+                    queue = waiting.pop(host)
+                    jobs.put(queue.popleft())
+                    if queue:
+                        waiting[host] = queue # back to the end of the round
+                    buffered -= 1
+                    running[host] = running.get(host, 0) + 1
+                    total_running += 1
+                    dispatched = True
+
+            if not total_running:
+                if exhausted and not waiting:
+                    return
+                continue
+            try:
+                result = results.get(timeout=MAX_WAIT)
+            except Queue.Empty:
+                continue
+            host = host_of(result.url)
+            running[host] -= 1
+            if not running[host]:
+                del running[host]
+            total_running -= 1
+            yield result
+    finally:
+        for _ in range(concurrency):
+            jobs.put(None)
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+
+"""
+Timing of the phases of conformance checks, part of SAND conformance server.
+
+This module is part of implementation of a conformance server
+for ISO/IEC 23009-5 SAND.
+A Timer is made current for a thread while a check runs: the code of each
+phase (network, XML parsing and validation, header parsing) adds its
+duration to the current timer, if any, so timings are collected without
+passing a timer through all the functions involved.
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from sand.histogram import Histogram
+
+# Phases, in the order they are reported
+CONNECT = 'connect'           # TCP (and TLS) connection, when not reused
+TTFB = 'ttfb'                 # request sent to response headers received,
+                              # including the connection
+DOWNLOAD = 'download'         # response body received
+XML_PARSE = 'xml_parse'       # XML message parsed
+XSD = 'xsd'                   # XML message validated against the XSD
+XML_PARSE_XSD = 'xml_parse+xsd' # XML message parsed and validated against
+                              # the XSD at once, by a schema-bound parser
+SCHEMATRON = 'schematron'     # XML message checked with the Schematron rules
+HEADER_PARSE = 'header_parse' # SAND header parsed and checked
+PHASES = (CONNECT, TTFB, DOWNLOAD, XML_PARSE, XSD, XML_PARSE_XSD, SCHEMATRON,
+          HEADER_PARSE)
+
+current = threading.local()
+
+class Timer:
+    """Durations of the phases of a check, in seconds.
+    phases maps a phase name to the total time spent in it:
+    a phase run several times (e.g. two downloads) is accounted once."""
+
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, phase, seconds):
+        """Adds a duration to a phase."""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def text(self):
+        """Returns the durations as name=milliseconds separated by spaces."""
+        return phases_text(self.phases)
+
+def phases_text(phases):
+    """Returns the durations of phases, a dictionary such as Timer.phases,
+    as name=milliseconds separated by spaces."""
+    return ' '.join('%s=%.3fms' % (name, phases[name] * 1e3)
+                    for name in ordered_phases(phases))
+
+def ordered_phases(names):
+    """Returns names sorted in the order of PHASES, unknown names last."""
+    return sorted(names, key=lambda name: (PHASES.index(name)
+                                           if name in PHASES else len(PHASES),
+                                           name))
+
+def current_timer():
+    """Returns the timer of the current thread, or None."""
+    return getattr(current, 'timer', None)
+
+@contextmanager
+def timing(timer=None):
+    """Makes timer (a new Timer if None) current for the thread
+    while the context is active. The context value is the timer."""
+    previous = current_timer()
+    current.timer = timer if timer is not None else Timer()
+    try:
+        yield current.timer
+    finally:
+        current.timer = previous
+
+@contextmanager
+def phase(name):
+    """Adds the time spent in the context to the phase name
+    of the current timer, if any."""
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        timer.add(name, time.time() - start)
+
+class PhaseHistograms:
+    """Histograms of the durations of each phase over many checks."""
+
+    def __init__(self):
+        self.histograms = {}
+
+    def add(self, phases):
+        """Accounts for the phases of a check, a dictionary such as Timer.phases."""
+        for name, seconds in phases.items():
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms.setdefault(name, Histogram())
+            histogram.record(seconds)
+
+    def lines(self):
+        """Returns the histograms as a list of text lines."""
+        result = []
+        for name in ordered_phases(self.histograms):
+            result.extend(self.histograms[name].lines(name))
+        return result
@@ -35,51 +35,292 @@ ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
-from StringIO import StringIO
-from os.path import dirname, join
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from os.path import abspath, basename, dirname, expanduser, join
 from lxml import etree
-from lxml import isoschematron
 
-class XMLValidator:
+from sand.timing import SCHEMATRON, XML_PARSE_XSD, XSD, phase
+# lxml.isoschematron is only imported when a Schematron has to be compiled,
+# since importing it parses the ISO skeleton stylesheets.
+
+# Schemas used when no explicit XSD/SCH pair is requested.
+# They can be replaced at run time with set_default_schemas().
+default_xsd_path = join(dirname(__file__), "schemas", "sand_messages.xsd")
+default_sch_path = join(dirname(__file__), "schemas", "sand_messages.sch")
+
+# XML declaration at the start of a document
+xml_declaration = re.compile(r'^<\?xml\s[^>]*\?>')
+
+# Directory of the on-disk cache of XSLT compiled from Schematron files.
+# SAND_SCHEMA_CACHE can select another directory, or disable the cache if empty.
+default_cache_dir = join(expanduser("~"), ".cache", "sand-conformance")
+
+logger = logging.getLogger(__name__)
+
+# Namespace of Schematron validation reports
+SVRL_NS = "http://purl.oclc.org/dsdl/svrl"
 
-    sand_message_xsd = "./schemas/sand_messages.xsd"
-    sand_message_sch = "./schemas/sand_messages.sch"
+def schema_cache_dir():
+    """Returns the directory of the on-disk schema cache, or None if it is disabled."""
+    return os.environ.get("SAND_SCHEMA_CACHE", default_cache_dir) or None
+
+def schematron_cache_path(cache_dir, xsd_path, sch_path):
+    """Returns the cache file for the XSLT compiled from sch_path.
+    The name includes a hash of both schema files and of the lxml version,
+    so any change in them selects a new file."""
+    content_hash = hashlib.sha1()
+    for path in (xsd_path, sch_path):
+        with open(path, "rb") as f:
+            content_hash.update(f.read())
+    content_hash.update(etree.__version__)
+    return join(cache_dir, "%s-%s.xsl" % (schematron_cache_prefix(sch_path),
+                                          content_hash.hexdigest()))
+
+def schematron_cache_prefix(sch_path):
+    """Returns the start of the names of cache files compiled from sch_path."""
+    return "%s-%s" % (basename(sch_path), hashlib.sha1(sch_path).hexdigest()[:8])
+
+def store_schematron_xslt(cache_path, validator_xslt):
+    """Writes a compiled XSLT in the cache and removes stale entries for the same file.
+    The cache is only an optimization: failures are ignored."""
+    cache_dir = dirname(cache_path)
+    prefix = basename(cache_path).rsplit("-", 1)[0] + "-"
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # write to a temporary file first, so that readers never see a partial file
+        handle, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(handle, "wb") as f:
+            validator_xslt.write(f)
+        os.rename(temp_path, cache_path)
+        for name in os.listdir(cache_dir):
+            if name.startswith(prefix) and join(cache_dir, name) != cache_path:
+                os.remove(join(cache_dir, name))
+    except (IOError, OSError):
+        pass
+
+def load_schematron_xslt(xsd_path, sch_path):
+    """Returns the validation XSLT generated from the Schematron in sch_path,
+    as a compiled etree.XSLT.
+    It is read from the on-disk cache when a valid entry exists,
+    otherwise it is generated and stored in the cache. A damaged entry
+    (not XML, or not a valid XSLT) is removed and generated again."""
+    cache_dir = schema_cache_dir()
+    cache_path = None
+    if cache_dir:
+        cache_path = schematron_cache_path(cache_dir, xsd_path, sch_path)
+        try:
+            return etree.XSLT(etree.parse(cache_path))
+        except IOError:
+            # missing entry
+            pass
+        except (etree.XMLSyntaxError, etree.XSLTParseError):
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+    from lxml import isoschematron
+    with open(sch_path) as f:
+        sand_schematron_doc = etree.parse(f)
+        validator_xslt = isoschematron.Schematron(sand_schematron_doc,
+                                                  store_xslt=True).validator_xslt
+    if cache_path:
+        store_schematron_xslt(cache_path, validator_xslt)
+    return etree.XSLT(validator_xslt)
 
-    def __init__(self):
-        xsd_path = join(dirname(__file__), self.sand_message_xsd)
+class SchematronValidator:
+    """Validates documents with the XSLT generated from a Schematron,
+    given compiled as an etree.XSLT, providing validate and assertValid
+    as lxml validators do.
+    Unlike lxml.isoschematron.Schematron it can be built from an XSLT
+    read from the cache, without compiling the Schematron again."""
+
+    def __init__(self, transform):
+        self.transform = transform
+        self.failed_asserts = etree.XPath("//svrl:failed-assert/svrl:text/text()",
+                                          namespaces={"svrl": SVRL_NS})
+
+    def failures(self, doc):
+        """Returns the text of the failed assertions for doc."""
+        report = self.transform(doc)
+        return [" ".join(text.split()) for text in self.failed_asserts(report)]
+
+    def validate(self, doc):
+        """Returns True if doc follows the Schematron rules."""
+        return not self.failures(doc)
+
+    def assertValid(self, doc):
+        """Raises etree.DocumentInvalid if doc does not follow the Schematron rules."""
+        failures = self.failures(doc)
+        if failures:
+            raise etree.DocumentInvalid("; ".join(failures))
+
+class CompiledSchemas:
+    """The compiled form of one XSD/SCH pair.
+    Building it parses both files and compiles the Schematron into XSLT,
+    which is much more expensive than validating a message, so instances
+    are shared through the registry below (see get_compiled_schemas),
+    and the XSLT is also cached on disk (see load_schematron_xslt).
+    lxml validators keep their error log on the instance, so validation
+    with a shared instance must be done while holding its lock.
+    Parsers validating against the XSD while parsing are created per thread
+    (see parser), and do not need the lock."""
+
+    def __init__(self, xsd_path, sch_path):
+        self.xsd_path = xsd_path
+        self.sch_path = sch_path
+        self.lock = threading.Lock()
+        self.local = threading.local()
         with open(xsd_path) as f:
             sand_schema_doc = etree.parse(f)
-            self.sand_xml_schema = etree.XMLSchema(sand_schema_doc)
-        
-        sch_path = join(dirname(__file__), self.sand_message_sch)
-        with open(sch_path) as f:
-            sand_schematron_doc = etree.parse(f)
-            self.sand_schematron = isoschematron.Schematron(sand_schematron_doc)
-
-    def from_file(self, file_path):
-        is_valid = False
+            self.xml_schema = etree.XMLSchema(sand_schema_doc)
+        self.schematron = SchematronValidator(load_schematron_xslt(xsd_path, sch_path))
+
+    def parser(self):
+        """Returns the parser of the current thread validating against the XSD."""
+        parser = getattr(self.local, 'parser', None)
+        if parser is None:
+            parser = etree.XMLParser(schema=self.xml_schema)
+            self.local.parser = parser
+        return parser
+
+# Process-wide registry of compiled schemas, keyed by (xsd_path, sch_path).
+_compiled_schemas = {}
+_registry_lock = threading.Lock()
+
+def get_compiled_schemas(xsd_path=None, sch_path=None):
+    """Returns the CompiledSchemas for the given pair of schema files,
+    compiling them on first use only.
+    Missing paths default to the current default schemas."""
+    key = (abspath(xsd_path or default_xsd_path),
+           abspath(sch_path or default_sch_path))
+    compiled = _compiled_schemas.get(key)
+    if compiled is None:
+        with _registry_lock:
+            # another thread may have compiled it while we were waiting
+            compiled = _compiled_schemas.get(key)
+            if compiled is None:
+                compiled = CompiledSchemas(*key)
+                _compiled_schemas[key] = compiled
+    return compiled
+
+def set_default_schemas(xsd_path, sch_path):
+    """Selects another XSD/SCH pair for validators created without explicit schemas.
+    Already compiled schemas stay in the registry and are reused if selected again."""
+    global default_xsd_path, default_sch_path
+    default_xsd_path = xsd_path
+    default_sch_path = sch_path
+
+def prewarm():
+    """Compiles the default schemas now instead of on first validation."""
+    get_compiled_schemas()
+
+_default_validators = {}
+
+def get_validator():
+    """Returns a shared XMLValidator for the current default schemas."""
+    key = (default_xsd_path, default_sch_path)
+    validator = _default_validators.get(key)
+    if validator is None:
+        validator = XMLValidator()
+        _default_validators[key] = validator
+    return validator
+
+class XMLValidator:
+    """Validates SAND XML messages against the XSD and the Schematron rules.
+    Validators built for the same schema files share their compiled form,
+    so creating one is cheap. An instance can be used from several threads."""
+
+    def __init__(self, xsd_path=None, sch_path=None):
+        self.schemas = get_compiled_schemas(xsd_path, sch_path)
+        self.sand_xml_schema = self.schemas.xml_schema
+        self.sand_schematron = self.schemas.schematron
+
+    def from_file(self, file_path, errors=None):
+        """Validates the message stored in file_path.
+        Returns True if it is valid.
+        If errors is a list, the error message is appended to it
+        instead of being logged."""
         try:
-            message_doc = etree.parse(file_path)
-            self.sand_xml_schema.validate(message_doc)
-            self.sand_schematron.validate(message_doc)
-            is_valid = True
+            with phase(XML_PARSE_XSD):
+                message_doc = etree.parse(file_path, self.schemas.parser())
         except etree.XMLSyntaxError as e:
-            print e.message
-        except etree.DocumentInvalid as e:
-            print e.message
+            report_error(syntax_error(e, etree.parse, file_path), errors)
+            return False
+        return self.check_rules(message_doc, errors)
 
-        return is_valid
+    def from_string(self, message_string, errors=None):
+        """Validates the message given as a string.
+        The message is validated against the XSD while being parsed
+        (timed as a single phase), and the Schematron rules are only
+        checked on valid messages.
+        bytearray and memoryview are accepted as well as strings.
+        Returns True if it is valid.
+        If errors is a list, the error message is appended to it
+        instead of being logged."""
+        if isinstance(message_string, unicode):
+            # lxml refuses to parse unicode strings with an encoding
+            # declaration, which does not apply to decoded text anyway
+            message_string = xml_declaration.sub(u'', message_string, 1)
+        elif isinstance(message_string, (bytearray, memoryview)):
+            # lxml only parses strings
+            message_string = memoryview(message_string).tobytes()
+        try:
+            with phase(XML_PARSE_XSD):
+                message_doc = etree.fromstring(message_string, self.schemas.parser())
+        except etree.XMLSyntaxError as e:
+            report_error(syntax_error(e, etree.fromstring, message_string), errors)
+            return False
+        return self.check_rules(message_doc, errors)
+
+    def validate(self, message_doc, errors=None):
+        """Validates a parsed message against the XSD and the Schematron rules.
+        Returns True if it is valid."""
+        try:
+            with phase(XSD), self.schemas.lock:
+                self.sand_xml_schema.assertValid(message_doc)
+        except etree.DocumentInvalid as e:
+            report_error(e, errors)
+            return False
+        return self.check_rules(message_doc, errors)
 
-    def from_string(self, message_string):
+    def check_rules(self, message_doc, errors=None):
+        """Checks a message already valid against the XSD follows the Schematron rules.
+        Returns True if it is valid."""
         is_valid = False
         try:
-            message_doc = etree.parse(StringIO(message_string))
-            self.sand_xml_schema.assertValid(message_doc)
-            self.sand_schematron.validate(message_doc)
+            with phase(SCHEMATRON), self.schemas.lock:
+                self.sand_schematron.assertValid(message_doc)
             is_valid = True
-        except etree.XMLSyntaxError as e:
-            print e.message
         except etree.DocumentInvalid as e:
-            print e.message
+            report_error(e, errors)
 
         return is_valid
+
+def syntax_error(error, parse, source):
+    """Returns the error to report for error, raised by a parser validating
+    against the XSD. Such a parser may report a schema error on a document
+    which is not well-formed (e.g. truncated), so the document is parsed
+    again without the XSD: its syntax error, if any, is returned instead."""
+    try:
+        parse(source)
+    except etree.XMLSyntaxError as plain_error:
+        return plain_error
+    return error
+
+def report_error(error, errors=None):
+    """Logs the message of a validation error, or adds it to errors if it is a list."""
+    if errors is None:
+        logger.warning(error.message)
+    else:
+        errors.append(error.message)
+
+# Setting SAND_PREWARM_SCHEMAS in the environment compiles the default
+# schemas at import, e.g. before forking worker processes.
+if os.environ.get("SAND_PREWARM_SCHEMAS"):
+    prewarm()
@@ -35,16 +35,17 @@ ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+import itertools
 import logging
 import re
-import urllib
-import requests
+import time
 import click
 
-from sand.xml_message import XMLValidator
-
-
-logging.getLogger().setLevel(logging.DEBUG)
+# Other modules (requests, lxml through sand.xml_message, ...) are imported
+# by the functions needing them, so that the command line starts quickly,
+# e.g. for --help or for commands not validating XML.
+from sand.bulk import DEFAULT_CHUNK_SIZE, FORMAT_HAR, FORMAT_RAW, FORMAT_JSONL, FORMAT_JSON
+from sand.results import FORMAT_SUMMARY, LogSink, open_sink, reporter
 
 # HTTP headers are case insensitive, we use lower case
 SAND_HEADER = "mpeg-dash-sand"
@@ -56,56 +57,162 @@ SAND_CONTENT_TYPE = "application/sand+xml"
 SAND_PER_PROTOCOL_ERROR = "error"
 SAND_PER_PROTOCOL_ENFORCEMENT = "enforcement"
 SAND_PER_PROTOCOL_ASSISTANCE = "assistance"
+SAND_PER_PROTOCOLS = (SAND_PER_PROTOCOL_ASSISTANCE,
+                      SAND_PER_PROTOCOL_ENFORCEMENT,
+                      SAND_PER_PROTOCOL_ERROR)
 
-def validate_response(url, regex_status_code):
+# Status codes (as regular expressions) of the responses carrying PER messages
+EXPECTED_STATUS_CODES = {
+    SAND_PER_PROTOCOL_ENFORCEMENT: "300",
+    SAND_PER_PROTOCOL_ERROR: "4[0-9]{2}",
+}
+
+def check_response(resp, regex_status_code):
     """
-    Validate that the body of the HTTP response complies
-    with the rules specified in ISO/IEX 23009-5.
+    Validate that an HTTP response complies with the rules specified
+    in ISO/IEX 23009-5: content type, status code and message in the body.
     """
+    from sand import revalidation
+    from sand.monitor import observe_message
+    from sand.xml_message import get_validator
+
     is_valid = True
+
+    # Test 1 - Verify that the SAND mime type is used.
+    content_type = resp.headers.get("Content-Type")
+    if content_type != SAND_CONTENT_TYPE:
+        reporter.record("content-type header", False, "Wrong content type",
+                        expected=SAND_CONTENT_TYPE, used=content_type)
+        is_valid = False
+    else:
+        reporter.record("content-type header", True, "Valid content type",
+                        used=content_type)
+
+    # Test 2 - Verify that the HTTP response code is as expected.
+    expected = re.compile(regex_status_code)
+    if expected.match(str(resp.status_code)):
+        reporter.record("HTTP response code", True, value=resp.status_code)
+    else:
+        reporter.record("HTTP response code", False,
+                        "Unexpected HTTP response code",
+                        value=resp.status_code, regex=regex_status_code)
+        is_valid = False
+
+    # Test 3 - Validate the SAND message in response.
+    # A message already validated is not validated again.
+    observe_message(resp.content)
+    cache = revalidation.response_cache
+    errors = []
     try:
-        resp = requests.get(url)
-
-        # Test 1 - Verify that the SAND mime type is used.
-        if resp.headers["Content-Type"] != SAND_CONTENT_TYPE:
-            logging.info(("[TEST] content_type header|KO|Wrong content type|"
-                          "expected=%s|used=%s"),
-                         SAND_CONTENT_TYPE,
-                         resp.headers["Content-Type"])
-            is_valid = False
+        previous = cache.message_result(resp.content) if cache else None
+        if previous is not None:
+            message_valid, errors = previous
         else:
-            logging.info("[TEST] content-type header|OK|Valid content type|%s",
-                         SAND_CONTENT_TYPE)
-
-        # Test 2 - Verify that the HTTP response code is as expected.
-        expected = re.compile(regex_status_code)
-        if expected.match(str(resp.status_code)):
-            logging.info("[TEST] HTTP response code|OK|value=%s",
-                         resp.status_code)
+            message_valid = get_validator().from_string(resp.content, errors)
+            if cache:
+                cache.add_message_result(resp.content, message_valid, errors)
+        if message_valid:
+            reporter.record("message", True, "XML message format valid",
+                            reused=previous is not None)
         else:
-            logging.info("[TEST] HTTP response code|KO|value=%s|regex=%s",
-                         resp.status_code, regex_status_code)
+            reporter.record("message", False, "XML message format invalid",
+                            errors=errors, reused=previous is not None)
             is_valid = False
+    except Exception as error:
+        reporter.record("message", False, "XML message format invalid",
+                        errors=[str(error)])
+        is_valid = False
 
-        # Test 3 - Validate the SAND message in response.
-        validator = XMLValidator()
-        try:
-            if validator.from_string(resp.content):
-                logging.info("[TEST] message|OK|XML message format valid")
-            else:
-                logging.info("[TEST] message|KO|XML message format invalid")
-                is_valid = False
-        except:
-            logging.error("XML message format invalid")
+    return is_valid
+
+def fetch_message(url):
+    """
+    Retrieve a SAND message. If a response to the same URL was validated
+    before, the request is conditional (see sand.revalidation).
+    """
+    from sand import revalidation
+    from sand.session import fetch
+
+    cache = revalidation.response_cache
+    return fetch(url, headers=cache.conditional_headers(url) if cache else None)
+
+def check_message_response(url, resp, regex_status_code):
+    """
+    Validate the response of fetch_message(url) with check_response.
+    A 304 Not Modified response reuses the result of the previous validation.
+    """
+    from sand import revalidation
+
+    cache = revalidation.response_cache
+    if cache is None:
+        return check_response(resp, regex_status_code)
+    if resp.status_code == 304:
+        previous = cache.get(url)
+        if previous is not None:
+            reporter.record("revalidation", True,
+                            "Message not modified, previous result reused",
+                            url=url, previous=previous.is_valid, reused=True)
+            return previous.is_valid
+    is_valid = check_response(resp, regex_status_code)
+    cache.update(url, resp, is_valid)
+    return is_valid
+
+def validate_response(url, regex_status_code):
+    """
+    Validate that the body of the HTTP response complies
+    with the rules specified in ISO/IEX 23009-5.
+    """
+    import requests
 
+    is_valid = False
+    try:
+        resp = fetch_message(url)
+        is_valid = check_message_response(url, resp, regex_status_code)
+
+    except requests.exceptions.Timeout as error:
+        reporter.record("retrieve", False, "Timeout when retrieving the message",
+                        url=url, errors=[str(error)])
     except requests.exceptions.RequestException as error:
-        logging.error("Could not retrieve the message|%s",
-                      url)
-        logging.error(error)
+        reporter.record("retrieve", False, "Could not retrieve the message",
+                        url=url, errors=[str(error)])
     except IOError as error:
-        logging.error("Error when retrieving the message|%s",
-                      url)
-        logging.error(error)
+        reporter.record("retrieve", False, "Error when retrieving the message",
+                        url=url, errors=[str(error)])
+
+    return is_valid
+
+def check_header_response(response):
+    """
+    Validate that an HTTP response carries the MPEG DASH SAND header
+    and that the message it points to complies with ISO/IEC 23009-5.
+    """
+    import requests
+
+    is_valid = False
+
+    # Test 1 : Presence of MPEG DASH SAND header in response
+    if SAND_HEADER in response.headers:
+        reporter.record("header", True,
+                        "%s header found in the response" % SAND_HEADER)
+        sand_url = response.headers[SAND_HEADER]
+
+        # Test 2 : Check the content of the header is a valid URL.
+        # The message is fetched once, its response is reused below.
+        try:
+            sand_response = fetch_message(sand_url)
+        except (requests.exceptions.RequestException, IOError):
+            reporter.record("URL", False, "The provided URL is not valid",
+                            url=sand_url)
+        else:
+            reporter.record("URL", True, "The provided URL is valid",
+                            url=sand_url)
+
+            # Test 3 : Validating the provided message
+            is_valid = check_message_response(sand_url, sand_response, "200")
+
+    else:
+        reporter.record("header", False,
+                        "No %s header found in the response." % SAND_HEADER)
 
     return is_valid
 
@@ -114,39 +221,74 @@ def validate_header(url):
     Validate that the HTTP reoponse header complies with the conformance
     rules specified in ISO/IEC 23009-5.
     """
+    import requests
+    from sand.session import fetch
+
     is_valid = False
     try:
-        response = requests.get(url)
-
-        # Test 1 : Presence of MPEG DASH SAND header in response
-        if SAND_HEADER in response.headers:
-            logging.info("[TEST] header OK|%s header found in the response",
-                         SAND_HEADER)
-            sand_url = response.headers[SAND_HEADER]
-
-            # Test 2 : Check the content of the header is a valid URL
-            try:
-                urllib.urlopen(sand_url)
-                logging.info("[TEST] URL OK|The provided URL is valid|%s",
-                             sand_url)
-
-                # Test 3 : Validating the provided message
-                is_valid = validate_response(sand_url, "200")
-            except IOError:
-                logging.info("[TEST] URL KO|The provided URL is not valid|%s",
-                             sand_url)
-
-        else:
-            logging.info("[TEST] header KO|No %s header found in the response.",
-                         SAND_HEADER)
+        response = fetch(url)
+        is_valid = check_header_response(response)
+    except requests.exceptions.Timeout as error:
+        reporter.record("retrieve", False, "Timeout when retrieving the message",
+                        url=url, errors=[str(error)])
     except requests.exceptions.RequestException as error:
-        logging.error("Could not retrieve the message|%s",
-                      url)
-        logging.error(error)
+        reporter.record("retrieve", False, "Could not retrieve the message",
+                        url=url, errors=[str(error)])
 
     return is_valid
 
-@click.command()
+def validate_protocol(url, protocol):
+    """
+    Validate the responses of a DANE for one of the protocols carrying
+    PER messages. Test results are reported with the URL as suite.
+    Raises ValueError for an unknown protocol.
+    """
+    with reporter.suite(url):
+        if protocol == SAND_PER_PROTOCOL_ASSISTANCE:
+            return validate_header(url)
+
+        elif protocol in EXPECTED_STATUS_CODES:
+            return validate_response(url, EXPECTED_STATUS_CODES[protocol])
+
+    raise ValueError('Unknown SAND PER protocol "%s"' % protocol)
+
+def protocol_checker(protocol, suite=None):
+    """
+    Returns a function validating a response already received
+    for one of the protocols carrying PER messages.
+    Test results are reported with the given suite.
+    """
+    if protocol == SAND_PER_PROTOCOL_ASSISTANCE:
+        check = check_header_response
+
+    elif protocol in EXPECTED_STATUS_CODES:
+        regex_status_code = EXPECTED_STATUS_CODES[protocol]
+        check = lambda response: check_response(response, regex_status_code)
+
+    else:
+        raise ValueError('Unknown SAND PER protocol "%s"' % protocol)
+
+    def checker(response):
+        with reporter.suite(suite):
+            return check(response)
+    return checker
+
+def echo_result(line):
+    """Writes a line of the result of a command on the standard output."""
+    click.echo("[RESULT] %s" % line)
+
+def exit_command(success):
+    """Ends the current command with the exit status 0 if success, 1 otherwise
+    (click ignores the value returned by a command)."""
+    click.get_current_context().exit(0 if success else 1)
+
+def check_positive(context, param, value):
+    """Click callback rejecting a number which is not positive."""
+    if value is not None and value <= 0:
+        raise click.BadParameter("must be positive, got %g" % value)
+    return value
+
+@click.group(invoke_without_command=True)
 @click.option("-u", "--url_to_request", help=("DANE URL to request,"
                                               " e.g. http://mydane.com"))
 @click.option("-p", "--protocol",
@@ -155,30 +297,421 @@ def validate_header(url):
                                  SAND_PER_PROTOCOL_ERROR]),
               help=("Protocols to carry PER messages"
                     " specified in ISO/IEC 23009-5"))
-def run(protocol, url_to_request):
+@click.option("--pool-connections", type=int, default=None,
+              help=("Number of hosts for which connections are kept alive"
+                    " (default: 10)"))
+@click.option("--pool-maxsize", type=int, default=None,
+              help="Number of connections kept alive per host (default: 10)")
+@click.option("--connect-timeout", type=float, default=None,
+              callback=check_positive,
+              help=("Seconds to wait for a connection to a DANE"
+                    " (default: 5)"))
+@click.option("--read-timeout", type=float, default=None,
+              callback=check_positive,
+              help=("Seconds to wait for data from a DANE before the check"
+                    " fails (default: 30)"))
+@click.option("--revalidate/--no-revalidate", default=False,
+              help=("Request messages validated before conditionally, and"
+                    " do not validate again a message already validated"
+                    " (default: disabled)"))
+@click.option("--cache-dir", type=click.Path(file_okay=False),
+              help=("Directory keeping the validation results between runs"
+                    " with --revalidate (default: kept in memory only)"))
+@click.option("-o", "--output", "outputs", multiple=True,
+              help=("Test results as FORMAT[:PATH], FORMAT being jsonl,"
+                    " junit or summary, to the standard output without PATH"
+                    " (default: summary). May be repeated."))
+@click.option("-v", "--verbose", is_flag=True,
+              help="Log each test result and debug messages")
+@click.pass_context
+def run(ctx, protocol, url_to_request, pool_connections, pool_maxsize,
+        connect_timeout, read_timeout, revalidate, cache_dir, outputs, verbose):
     """
     Execute the request and the validation of the received HTTP response.
-    """
-    success = False
-    if protocol == SAND_PER_PROTOCOL_ASSISTANCE:
-        success = validate_header(url_to_request)
 
-    elif protocol == SAND_PER_PROTOCOL_ENFORCEMENT:
-        success = validate_response(url_to_request, "300")
-
-    elif protocol == SAND_PER_PROTOCOL_ERROR:
-        success = validate_response(url_to_request, "4[0-9]{2}")
+    Other validation modes are available as commands.
+    """
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.WARNING)
+    for output in outputs or (FORMAT_SUMMARY,):
+        try:
+            reporter.add_sink(open_sink(output))
+        except (ValueError, IOError) as error:
+            raise click.BadParameter(str(error), param_hint="--output")
+    if verbose:
+        reporter.add_sink(LogSink())
+    ctx.call_on_close(reporter.close)
+    if revalidate:
+        from sand.revalidation import enable_response_cache
+        enable_response_cache(cache_dir)
+    if connect_timeout or read_timeout:
+        from sand import session
+        session.configure_timeout(
+            connect_timeout or session.DEFAULT_CONNECT_TIMEOUT,
+            read_timeout or session.DEFAULT_READ_TIMEOUT)
+
+    if ctx.invoked_subcommand is not None:
+        return
+    from sand import session
+    session.configure_session(
+        pool_connections or session.DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize or session.DEFAULT_POOL_MAXSIZE)
 
-    else:
+    if protocol not in SAND_PER_PROTOCOLS:
         logging.error('Unknown SAND PER protocol "%s"', protocol)
-        return
+        exit_command(False)
 
+    from sand.timing import timing
+    with timing() as timer:
+        success = validate_protocol(url_to_request, protocol)
+    click.echo("[TIMING] %s" % timer.text())
     if success:
-        logging.info("[RESULT] Success")
+        echo_result("Success")
     else:
-        logging.info("[RESULT] Failure")
+        echo_result("Failure")
+
+    exit_command(success)
+
+@run.command()
+@click.argument("capture_files", nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False))
+@click.option("-f", "--format", "capture_format",
+              type=click.Choice([FORMAT_HAR, FORMAT_RAW, FORMAT_JSONL, FORMAT_JSON]),
+              help="Format of the capture files (default: from extension)")
+@click.option("-j", "--processes", type=int, default=None,
+              help="Number of worker processes (default: one per CPU)")
+@click.option("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+              help="Number of records sent at once to a worker process")
+@click.option("--cache-size", type=int, default=None,
+              help=("Number of header values whose validation result is"
+                    " kept, per process, 0 to disable (default: 1024)"))
+def headers(capture_files, capture_format, processes, chunk_size, cache_size):
+    """
+    Validate the SAND headers recorded in capture files.
+
+    Capture files are HAR files, raw HTTP header dumps or JSON lines
+    access logs. They are streamed, so they may be larger than memory.
+    """
+    from sand.bulk import validate_file
+    from sand.header import configure_parse_cache
+
+    if cache_size is not None:
+        configure_parse_cache(cache_size)
+
+    checked = 0
+    failed = 0
+    for file_name in capture_files:
+        for record_id, report in validate_file(file_name, capture_format,
+                                               processes, chunk_size):
+            suite = "%s|%s" % (file_name, record_id)
+            for name, errors in report:
+                checked += 1
+                if errors:
+                    failed += 1
+                reporter.record(name, not errors, "; ".join(errors) or None,
+                                suite=suite, errors=errors)
+
+    echo_result("%d SAND headers checked, %d invalid" % (checked, failed))
+    exit_command(failed == 0)
+
+@run.command()
+@click.argument("paths", nargs=-1, type=click.Path(exists=True))
+@click.option("-m", "--manifest", type=click.Path(exists=True, dir_okay=False),
+              help="File listing the messages to validate, one per line")
+@click.option("--pattern", default="*.xml",
+              help="Pattern of file names to validate in directories")
+@click.option("-j", "--processes", type=int, default=None,
+              help="Number of worker processes (default: one per CPU)")
+@click.option("--xsd", type=click.Path(exists=True, dir_okay=False),
+              help="XSD to use instead of the SAND messages schema")
+@click.option("--sch", type=click.Path(exists=True, dir_okay=False),
+              help="Schematron to use instead of the SAND messages rules")
+def corpus(paths, manifest, pattern, processes, xsd, sch):
+    """
+    Validate a corpus of SAND XML messages.
+
+    Messages are files found in PATHS (directories are walked)
+    and in the manifest.
+    """
+    from sand.corpus import iter_corpus_files, iter_manifest, \
+        validate_corpus, CorpusSummary
+
+    files = iter_corpus_files(paths, pattern)
+    if manifest:
+        files = itertools.chain(files, iter_manifest(manifest))
+    summary = CorpusSummary()
+    for result in validate_corpus(files, processes, xsd, sch):
+        summary.add(result)
+        reporter.record("message", result.is_valid,
+                        "; ".join(result.errors) or None, suite=result.path,
+                        message_types=result.message_types,
+                        timings=result.timings)
+    summary.finish()
+    for line in summary.lines():
+        echo_result(line)
+    exit_command(summary.failed == 0)
+
+@run.command("sweep")
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+@click.option("-c", "--concurrency", type=int, default=None,
+              help="Number of checks running at the same time (default: 32)")
+@click.option("--per-host", type=int, default=None,
+              help=("Number of checks running at the same time for one host"
+                    " (default: 4)"))
+def sweep_command(manifest, concurrency, per_host):
+    """
+    Validate many DANEs concurrently.
+
+    MANIFEST lists a URL and a protocol (assistance, enforcement or error)
+    per line. A result is reported as soon as each check finishes.
+    """
+    from sand import session, sweep
+    from sand.timing import PhaseHistograms
+
+    concurrency = concurrency or sweep.DEFAULT_CONCURRENCY
+    per_host = per_host or sweep.DEFAULT_PER_HOST
+    # one pool per host being checked, as many connections as checks per host
+    session.configure_session(max(concurrency, session.DEFAULT_POOL_CONNECTIONS),
+                              per_host)
+
+    passed = 0
+    failed = 0
+    phases = PhaseHistograms()
+    start = time.time()
+    for result in sweep.sweep(sweep.iter_sweep_manifest(manifest),
+                              validate_protocol, concurrency, per_host):
+        phases.add(result.timings)
+        if result.success:
+            passed += 1
+        else:
+            failed += 1
+        reporter.record(result.protocol, result.success, result.error,
+                        suite=result.url, elapsed=result.elapsed,
+                        timings=result.timings)
+
+    elapsed = time.time() - start
+    echo_result("%d checks, %d passed, %d failed, %.1f checks/s"
+                % (passed + failed, passed, failed,
+                   (passed + failed) / elapsed if elapsed > 0 else 0.0))
+    for line in phases.lines():
+        click.echo("[TIMING] %s" % line)
+    exit_command(failed == 0)
+
+@run.command("monitor")
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+@click.option("-c", "--concurrency", type=int, default=None,
+              help="Number of checks running at the same time (default: 8)")
+@click.option("--interval", type=float, default=None,
+              help=("Seconds between two checks of a DANE whose messages"
+                    " give no validity (default: 60)"))
+@click.option("--min-interval", type=float, default=None,
+              help="Shortest time between two checks of a DANE (default: 1)")
+@click.option("--max-interval", type=float, default=None,
+              help="Longest time between two checks of a DANE (default: 3600)")
+@click.option("--max-backoff", type=float, default=None,
+              help="Longest time before retrying a failed check (default: 600)")
+@click.option("--status-interval", type=float, default=60.0,
+              help="Seconds between two status lines")
+def monitor_command(manifest, concurrency, interval, min_interval,
+                    max_interval, max_backoff, status_interval):
+    """
+    Validate DANEs continuously.
+
+    MANIFEST lists a URL and a protocol per line, as for sweep. Each DANE
+    is checked again when its messages expire (validityTime,
+    MPDValidityEndTime), and failed checks are retried with a randomized
+    exponential backoff. Stops on SIGINT or SIGTERM.
+    """
+    import signal
+    from sand import monitor, session, sweep
+    from sand.results import JUnitSink
+    from sand.timing import PhaseHistograms
+    from sand.xml_message import prewarm
+
+    if any(isinstance(sink, JUnitSink) for sink in reporter.sinks):
+        # it keeps all the results until the end
+        raise click.UsageError("JUnit results cannot be used with monitor")
+    targets = list(sweep.iter_sweep_manifest(manifest))
+    concurrency = concurrency or monitor.DEFAULT_CONCURRENCY
+    hosts = set(sweep.host_of(url) for url, protocol in targets)
+    session.configure_session(max(len(hosts), session.DEFAULT_POOL_CONNECTIONS),
+                              concurrency)
+    prewarm()
+
+    dane_monitor = monitor.Monitor(
+        targets, validate_protocol, concurrency,
+        interval or monitor.DEFAULT_INTERVAL,
+        min_interval or monitor.DEFAULT_MIN_INTERVAL,
+        max_interval or monitor.DEFAULT_MAX_INTERVAL,
+        max_backoff or monitor.DEFAULT_MAX_BACKOFF)
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda number, frame: dane_monitor.stop())
+
+    passed = 0
+    failed = 0
+    phases = PhaseHistograms()
+    next_status = time.time() + status_interval
+    for result in dane_monitor.run():
+        phases.add(result.timings)
+        if result.success:
+            passed += 1
+        else:
+            failed += 1
+        reporter.record(result.target.protocol, result.success, result.error,
+                        suite=result.target.url, elapsed=result.elapsed,
+                        timings=result.timings, next_check=result.delay)
+        if time.time() >= next_status:
+            failing = sum(1 for target in dane_monitor.targets if target.failures)
+            click.echo("[STATUS] %d checks, %d passed, %d failed,"
+                       " %d of %d DANEs failing"
+                       % (passed + failed, passed, failed, failing, len(targets)))
+            reporter.flush()
+            next_status = time.time() + status_interval
+
+    echo_result("%d checks, %d passed, %d failed"
+                % (passed + failed, passed, failed))
+    for line in phases.lines():
+        click.echo("[TIMING] %s" % line)
+    exit_command(failed == 0)
+
+@run.command("proxy")
+@click.option("-l", "--listen", default="127.0.0.1:8888",
+              help="[HOST:]PORT the proxy listens on (default: 127.0.0.1:8888)")
+@click.option("--upstream", default=None,
+              help=("HOST:PORT of the DANE or CDN, for a reverse proxy"
+                    " (default: forward proxy)"))
+@click.option("--queue-size", type=int, default=None,
+              help=("Number of messages waiting to be checked above which"
+                    " messages are not checked (default: 10000)"))
+@click.option("--status-interval", type=float, default=60.0,
+              help="Seconds between two status lines")
+def proxy_command(listen, upstream, queue_size, status_interval):
+    """
+    Validate the SAND headers of live traffic.
+
+    Clients connect to the proxy, which passes the traffic to the upstream
+    server unmodified and checks the SAND headers of the requests and
+    responses on the side. Stops on SIGINT or SIGTERM.
+    """
+    import signal
+    import socket
+    from sand import proxy
+    from sand.histogram import Histogram
+    from sand.results import JUnitSink
+
+    if any(isinstance(sink, JUnitSink) for sink in reporter.sinks):
+        # it keeps all the results until the end
+        raise click.UsageError("JUnit results cannot be used with proxy")
+    listen_address = proxy.split_host(
+        listen if ":" in listen else "127.0.0.1:" + listen)
+    if listen_address is None:
+        raise click.BadParameter("expected [HOST:]PORT", param_hint="--listen")
+    upstream_address = None
+    if upstream:
+        upstream_address = proxy.split_host(upstream)
+        if upstream_address is None:
+            raise click.BadParameter("expected HOST:PORT", param_hint="--upstream")
+
+    counts = [0, 0] # messages checked, messages with invalid SAND headers
+
+    def report(direction, suite, header_report):
+        invalid = False
+        for name, errors in header_report:
+            reporter.record(name, not errors, "; ".join(errors) or None,
+                            suite=suite, errors=errors, direction=direction)
+            invalid = invalid or bool(errors)
+        counts[0] += 1
+        counts[1] += invalid
+
+    validator = proxy.Validator(report, queue_size or proxy.DEFAULT_QUEUE_SIZE)
+    try:
+        sand_proxy = proxy.Proxy(listen_address, upstream_address, validator)
+    except socket.error as error:
+        raise click.BadParameter(str(error), param_hint="--listen")
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda number, frame: sand_proxy.stop())
+    logging.info("Proxy listening on %s:%d", *sand_proxy.address())
+
+    forwarding = Histogram()
+    for stats in sand_proxy.run(status_interval):
+        forwarding.merge(stats.forwarding)
+        p99 = stats.forwarding.percentile(99.0)
+        click.echo("[STATUS] %d connections open, %d accepted, %d failed,"
+                   " %d requests, %d responses, %d messages checked,"
+                   " %d invalid, %d not checked, forwarding p99=%.3fms"
+                   % (stats.open, stats.accepted, stats.failed, stats.requests,
+                      stats.responses, counts[0], counts[1],
+                      validator.dropped + stats.lost, p99 * 1e3))
+        if p99 > proxy.LATENCY_BUDGET:
+            logging.warning("Forwarding p99 of %.3fms above the budget of %.3fms",
+                            p99 * 1e3, proxy.LATENCY_BUDGET * 1e3)
+        reporter.flush()
+    echo_result("%d messages checked, %d invalid, %d not checked"
+                % (counts[0], counts[1], validator.dropped + stats.lost))
+    for line in forwarding.lines("forwarding"):
+        click.echo("[TIMING] %s" % line)
+    exit_command(counts[1] == 0)
+
+@run.command("load")
+@click.option("-u", "--url_to_request", required=True,
+              help="DANE URL to request, e.g. http://mydane.com")
+@click.option("-p", "--protocol", required=True,
+              type=click.Choice(SAND_PER_PROTOCOLS),
+              help="Protocol of the PER messages sent by the DANE")
+@click.option("-r", "--rate", type=float, default=10.0,
+              help="Requests per second (start rate of a ramp)")
+@click.option("-d", "--duration", type=float, default=10.0,
+              callback=check_positive,
+              help="Duration of the test in seconds")
+@click.option("--ramp-to", type=float, default=None,
+              help="Rate reached at the end of the test, for a ramp")
+@click.option("--steps", default=None,
+              help=("Successive steps as rate:duration,rate:duration,..."
+                    " (replaces --rate and --duration)"))
+@click.option("-w", "--workers", type=int, default=None,
+              help="Number of requests in flight at most (default: 64)")
+@click.option("-s", "--sample-rate", type=float, default=None,
+              help=("Fraction of the responses checked for conformance"
+                    " (default: 0.01)"))
+@click.option("--timeout", type=float, default=10.0,
+              help="Timeout of a request in seconds")
+def load_command(url_to_request, protocol, rate, duration, ramp_to, steps,
+                 workers, sample_rate, timeout):
+    """
+    Measure the latency of a DANE under a given load.
+
+    Requests are sent at the scheduled times whatever the response times
+    (open loop), so latencies are measured from the scheduled times.
+    A sample of the responses is checked for conformance.
+    """
+    from sand import load, session
+
+    if steps:
+        try:
+            schedule = load.step_schedule(load.parse_steps(steps))
+        except ValueError as error:
+            raise click.BadParameter(str(error), param_hint="--steps")
+    elif ramp_to is not None:
+        schedule = load.ramp_schedule(rate, ramp_to, duration)
+    else:
+        schedule = load.constant_schedule(rate, duration)
+
+    workers = workers or load.DEFAULT_WORKERS
+    if sample_rate is None:
+        sample_rate = load.DEFAULT_SAMPLE_RATE
+    session.configure_session(session.DEFAULT_POOL_CONNECTIONS, workers)
+    http = session.get_session()
+
+    def fetch():
+        """Sends one request to the DANE."""
+        return http.get(url_to_request, timeout=timeout)
+
+    report = load.run_load(schedule, fetch,
+                           protocol_checker(protocol, url_to_request),
+                           workers, sample_rate)
 
-    return success
+    for line in report.lines():
+        echo_result(line)
+    exit_command(not report.errors and report.samples_failed == 0)
 
 if __name__ == "__main__":
     run()
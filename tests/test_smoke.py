@@ -0,0 +1,196 @@
+#!/usr/bin/python
+
+"""
+Smoke tests of the load and sweep commands, part of SAND conformance server.
+
+This module is part of implementation of a conformance server
+for ISO/IEC 23009-5 SAND.
+It runs the command line client against tools/dane_emulator.py on a local
+port, so that the open-loop load test and the concurrent sweep are checked
+end to end without network access.
+
+Usage (from the repository root):
+    python -m unittest discover -s tests
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds to wait for the emulator to accept connections
+STARTUP_TIMEOUT = 10.0
+
+def free_port():
+    """Returns a TCP port of the loopback interface not used at the moment."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def run_client(*args):
+    """Runs sand_client.py with args. Returns (exit status, output lines)."""
+    process = subprocess.Popen([sys.executable, 'sand_client.py'] + list(args),
+                               cwd=ROOT, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    return process.returncode, output.splitlines()
+
+def read_results(path):
+    """Returns the results written by a jsonl sink."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class EmulatorTestCase(unittest.TestCase):
+    """Starts a DANE emulator for the tests of the class, at self.base_url."""
+
+    @classmethod
+    def setUpClass(cls):
+        port = free_port()
+        cls.emulator = subprocess.Popen(
+            [sys.executable, os.path.join('tools', 'dane_emulator.py'),
+             '--port', str(port)], cwd=ROOT)
+        cls.base_url = 'http://127.0.0.1:%d' % port
+        deadline = time.time() + STARTUP_TIMEOUT
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), 1.0).close()
+                break
+            except socket.error:
+                if time.time() > deadline or cls.emulator.poll() is not None:
+                    cls.tearDownClass()
+                    raise RuntimeError('The DANE emulator did not start')
+                time.sleep(0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.emulator.poll() is None:
+            cls.emulator.terminate()
+        cls.emulator.wait()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+class LoadTest(EmulatorTestCase):
+
+    def test_constant_rate(self):
+        results = os.path.join(self.directory, 'results.jsonl')
+        status, lines = run_client('-o', 'jsonl:%s' % results, 'load',
+                                   '-u', self.base_url + '/enforcement',
+                                   '-p', 'enforcement', '--rate', '20',
+                                   '--duration', '1', '--sample-rate', '1')
+        output = '\n'.join(lines)
+        self.assertEqual(status, 0, output)
+        self.assertIn('[RESULT] 20 requests sent, 20 responses', output)
+        self.assertIn('[RESULT] status codes: 300=20', output)
+        for name in ('latency', 'service time'):
+            self.assertRegexpMatches(
+                output, r'\[RESULT\] %s: count=20 min=[\d.]+ms mean=[\d.]+ms' % name)
+            self.assertRegexpMatches(
+                output, r'\[RESULT\] %s: p50=[\d.]+ms p90=[\d.]+ms p99=[\d.]+ms' % name)
+        match = re.search(r'conformance samples: (\d+) checked, (\d+) failed, (\d+) dropped',
+                          output)
+        self.assertTrue(match, output)
+        checked, failed, dropped = [int(count) for count in match.groups()]
+        self.assertEqual(failed, 0)
+        self.assertEqual(checked + dropped, 20)
+        self.assertTrue(checked > 0)
+        messages = [result for result in read_results(results)
+                    if result['test'] == 'message']
+        self.assertEqual(len(messages), checked)
+        self.assertTrue(all(result['status'] == 'OK' for result in messages))
+
+    def test_errors(self):
+        status, lines = run_client('load', '-u', 'http://127.0.0.1:%d/' % free_port(),
+                                   '-p', 'enforcement', '--rate', '5',
+                                   '--duration', '1', '--timeout', '1')
+        output = '\n'.join(lines)
+        self.assertEqual(status, 1, output)
+        self.assertIn('[RESULT] 5 requests sent, 0 responses', output)
+        self.assertIn('[RESULT] errors: ConnectionError=5', output)
+        self.assertRegexpMatches(output, r'\[RESULT\] latency \(errors\): count=5 ')
+
+    def test_invalid_duration(self):
+        status, lines = run_client('load', '-u', self.base_url + '/enforcement',
+                                   '-p', 'enforcement', '--duration', '0',
+                                   '--ramp-to', '10')
+        self.assertEqual(status, 2, '\n'.join(lines))
+
+class SweepTest(EmulatorTestCase):
+
+    def write_manifest(self, entries):
+        path = os.path.join(self.directory, 'manifest.txt')
+        with open(path, 'w') as f:
+            for route, protocol in entries:
+                f.write('%s%s %s\n' % (self.base_url, route, protocol))
+        return path
+
+    def test_conformant(self):
+        manifest = self.write_manifest([('/assistance', 'assistance'),
+                                        ('/enforcement', 'enforcement'),
+                                        ('/error', 'error')] * 2)
+        results = os.path.join(self.directory, 'results.jsonl')
+        status, lines = run_client('-o', 'jsonl:%s' % results, 'sweep',
+                                   '--concurrency', '4', manifest)
+        output = '\n'.join(lines)
+        self.assertEqual(status, 0, output)
+        self.assertIn('[RESULT] 6 checks, 6 passed, 0 failed', output)
+        for name in ('ttfb', 'download', 'xml_parse+xsd', 'schematron'):
+            self.assertRegexpMatches(output, r'\[TIMING\] %s: count=\d+ ' % re.escape(name))
+        checks = [result for result in read_results(results)
+                  if result['test'] in ('assistance', 'enforcement', 'error')]
+        self.assertEqual(len(checks), 6)
+        for result in checks:
+            self.assertEqual(result['status'], 'OK')
+            self.assertTrue(result['elapsed'] > 0)
+            self.assertIn('ttfb', result['timings'])
+
+    def test_failures(self):
+        manifest = self.write_manifest([('/enforcement', 'enforcement'),
+                                        ('/malformed', 'error')])
+        status, lines = run_client('sweep', manifest)
+        output = '\n'.join(lines)
+        self.assertEqual(status, 1, output)
+        self.assertIn('[RESULT] 2 checks, 1 passed, 1 failed', output)
+
+if __name__ == '__main__':
+    unittest.main()
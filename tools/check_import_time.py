@@ -0,0 +1,111 @@
+#!/usr/bin/python
+
+"""
+Import time budget check for the SAND conformance client.
+
+The client is often launched once per test case, so its start up time
+matters. This script imports the command line module and the header
+parser in fresh interpreters, and fails if they take more than the budget
+or if they import modules that should only be loaded when needed.
+The budget is a multiple of the import time of click, measured the same
+way, so that it follows the speed of the machine (e.g. a slow CI worker).
+
+Usage (from the repository root):
+    python tools/check_import_time.py [budget in seconds]
+
+Copyright (c) 2016-, TNO, Technicolor
+All rights reserved.
+
+See AUTHORS for a full list of authors.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+* Neither the name of the copyright holder nor the
+names of its contributors may be used to endorse or promote products
+derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+# Module imported by the command line anyway, whose import time gives
+# the speed of the machine
+REFERENCE_MODULE = 'click'
+
+# Default budget for importing a module (interpreter start excluded), as a
+# multiple of the import time of REFERENCE_MODULE: sand_client takes about
+# twice as long as click, which leaves a margin for noisy machines
+DEFAULT_BUDGET_RATIO = 3.0
+
+# Number of measures, the best one is compared to the budget
+RUNS = 5
+
+# Modules to check, with the top level packages they must not import
+checked_modules = {
+    'sand_client': ('requests', 'lxml', 'multiprocessing'),
+    'sand.header': ('requests', 'lxml', 'click'),
+}
+
+# Program run in a fresh interpreter to measure one import
+measure = '''
+import json, sys, time
+start = time.time()
+import %s
+elapsed = time.time() - start
+print(json.dumps([elapsed, sorted(set(m.split('.')[0] for m in sys.modules))]))
+'''
+
+def measure_import(module, root):
+    """Imports module in a fresh interpreter.
+    Returns the import time and the top level modules loaded."""
+    output = subprocess.check_output([sys.executable, '-c', measure % module], cwd=root)
+    return json.loads(output)
+
+def best_import_time(module, root):
+    """Returns the best import time of module in RUNS fresh interpreters,
+    and the top level modules loaded."""
+    measures = [measure_import(module, root) for _ in range(RUNS)]
+    return min(elapsed for elapsed, loaded in measures), measures[0][1]
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if len(sys.argv) > 1:
+        budget = float(sys.argv[1])
+    else:
+        reference, _ = best_import_time(REFERENCE_MODULE, root)
+        budget = DEFAULT_BUDGET_RATIO * reference
+        print('import %s: %.3fs' % (REFERENCE_MODULE, reference))
+    success = True
+    for module, forbidden in sorted(checked_modules.items()):
+        best, loaded = best_import_time(module, root)
+        status = 'OK'
+        if best > budget:
+            status = 'KO'
+            success = False
+        print('%s import %s: %.3fs (budget %.3fs)' % (status, module, best, budget))
+        for name in forbidden:
+            if name in loaded:
+                print('KO import %s loads %s' % (module, name))
+                success = False
+    return 0 if success else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,439 @@
+#!/usr/bin/python
+
+"""
+Local stand-in DANE, to exercise the SAND conformance client without a real
+DANE, e.g. in continuous integration, sweeps and load tests.
+
+The server answers HTTP/1.1 GET requests (with keep-alive and pipelining)
+from a single event loop per process, so that it is not the bottleneck of
+a load test. Paths are:
+- /assistance: 200 with an mpeg-dash-sand header pointing to /message
+- /message: 200 with the SAND message
+- /enforcement: 300 with the SAND message
+- /error: 4xx (see --error-status) with the SAND message
+- /malformed: 200 with a truncated SAND message
+Messages use the application/sand+xml content type and have an ETag:
+requests with a matching If-None-Match get 304 Not Modified.
+
+Faults can be injected for all requests with the options, or per request
+with query parameters of the same names: latency and jitter (milliseconds,
+the delay before the response is latency plus or minus up to jitter),
+drip and drip_interval (the body is sent drip bytes every drip_interval
+milliseconds), malformed (fraction of messages truncated) and status
+(status code of the response).
+
+Usage (from the repository root):
+    python tools/dane_emulator.py [--port 8080] [--processes 4] [--latency 20]
+    python sand_client.py -u http://127.0.0.1:8080/assistance -p assistance
+
+Python 2 has no asyncio, the event loop is written with select.epoll
+(select.select where epoll is not available).
+"""
+
+import argparse
+import errno
+import hashlib
+import heapq
+import itertools
+import os
+import random
+import select
+import socket
+import sys
+import time
+from collections import deque
+from urlparse import parse_qs
+
+DEFAULT_PORT = 8080
+
+# Status code of the responses of /error
+DEFAULT_ERROR_STATUS = 400
+
+# Number of pending connections accepted by the kernel
+LISTEN_BACKLOG = 1024
+
+# Size of the socket reads
+READ_SIZE = 65536
+
+# Requests whose headers are larger are refused
+MAX_REQUEST_SIZE = 65536
+
+SAND_CONTENT_TYPE = 'application/sand+xml'
+
+# Message served when no file is given
+default_message = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                   '<SANDMessage xmlns="urn:mpeg:dash:schema:sandmessage:2016"'
+                   ' senderId="dane-emulator">'
+                   '<DaneResourceStatus messageId="1" status="cached">'
+                   '<resource bytes="0-1023">http://127.0.0.1/segment-1.m4s</resource>'
+                   '</DaneResourceStatus>'
+                   '</SANDMessage>\n')
+
+reasons = {200: 'OK', 300: 'Multiple Choices', 304: 'Not Modified',
+           400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 410: 'Gone', 429: 'Too Many Requests',
+           431: 'Request Header Fields Too Large', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+
+def response_head(status, headers, length):
+    """Returns the status line and headers of a response with a body of length bytes."""
+    lines = ['HTTP/1.1 %d %s' % (status, reasons.get(status, 'Unknown'))]
+    lines.extend('%s: %s' % header for header in headers)
+    lines.append('Content-Length: %d' % length)
+    lines.append('')
+    lines.append('')
+    return '\r\n'.join(lines)
+
+class Faults:
+    """Faults injected in responses, see the module documentation."""
+
+    def __init__(self, latency=0.0, jitter=0.0, drip=0, drip_interval=0.0,
+                 malformed=0.0, status=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.drip = drip
+        self.drip_interval = drip_interval
+        self.malformed = malformed
+        self.status = status
+
+    def with_query(self, query):
+        """Returns the faults modified by the parameters of a query string."""
+        parameters = parse_qs(query)
+        faults = Faults(self.latency, self.jitter, self.drip, self.drip_interval,
+                        self.malformed, self.status)
+        try:
+            for name, convert in (('latency', float), ('jitter', float),
+                                  ('drip', int), ('drip_interval', float),
+                                  ('malformed', float), ('status', int)):
+                if name in parameters:
+                    setattr(faults, name, convert(parameters[name][-1]))
+        except ValueError:
+            pass
+        return faults
+
+    def injected(self):
+        """Returns True if the responses are not the plain ones."""
+        return bool(self.latency or self.jitter or self.drip or self.malformed
+                    or self.status)
+
+    def delay(self):
+        """Returns the delay before a response, in seconds."""
+        delay = self.latency
+        if self.jitter:
+            delay += random.uniform(-self.jitter, self.jitter)
+        return max(0.0, delay) / 1000.0
+
+class Emulator:
+    """The responses of the emulated DANE."""
+
+    def __init__(self, message=default_message, error_status=DEFAULT_ERROR_STATUS,
+                 faults=None):
+        self.message = message
+        self.malformed_message = message[:len(message) // 2]
+        self.etag = '"%s"' % hashlib.sha1(message).hexdigest()[:16]
+        self.error_status = error_status
+        self.faults = faults or Faults()
+        self.plain_responses = {} # (path, host) -> response without faults
+
+    def respond(self, path, host, etag):
+        """Returns the response to a GET of path, as a list of
+        (delay from the previous chunk, data) sent one after the other."""
+        if path.startswith('http://'):
+            # absolute-form, sent through forward proxies
+            path = '/' + path[7:].partition('/')[2]
+        path, _, query = path.partition('?')
+        if not query and not self.faults.injected() and etag is None:
+            response = self.plain_responses.get((path, host))
+            if response is None:
+                response = self.build(path, host, None, self.faults)
+                if len(self.plain_responses) < 1000:
+                    self.plain_responses[(path, host)] = response
+            return [(0.0, response)]
+        faults = self.faults.with_query(query) if query else self.faults
+        response = self.build(path, host, etag, faults)
+        if faults.drip <= 0:
+            return [(faults.delay(), response)]
+        head, _, body = response.partition('\r\n\r\n')
+        chunks = [(faults.delay(), head + '\r\n\r\n')]
+        interval = faults.drip_interval / 1000.0
+        for start in range(0, len(body), faults.drip):
+            chunks.append((interval, body[start:start + faults.drip]))
+        return chunks
+
+    def build(self, path, host, etag, faults):
+        """Returns the bytes of the response to a GET of path."""
+        headers = []
+        body = self.message
+        if path in ('/', '/assistance'):
+            status = 200
+            headers.append(('Content-Type', 'text/plain'))
+            headers.append(('mpeg-dash-sand', 'http://%s/message' % host))
+            body = 'SAND assistance\n'
+        elif path in ('/message', '/enforcement', '/error', '/malformed'):
+            status = {'/enforcement': 300, '/error': self.error_status}.get(path, 200)
+            headers.append(('Content-Type', SAND_CONTENT_TYPE))
+            if path == '/malformed' or (faults.malformed
+                                        and random.random() < faults.malformed):
+                body = self.malformed_message
+            else:
+                headers.append(('ETag', self.etag))
+                if etag == self.etag and status == 200:
+                    return response_head(304, [('ETag', self.etag)], 0)
+        else:
+            status = 404
+            headers.append(('Content-Type', 'text/plain'))
+            body = 'Not found\n'
+        if faults.status:
+            status = faults.status
+        return response_head(status, headers, len(body)) + body
+
+class Connection:
+    """A client connection: requests are read from input and responses
+    are queued as chunks, each one with the time it can be sent."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.input = ''
+        self.chunks = deque() # (time, data) in sending order
+        self.output = ''
+        self.last_time = 0.0 # time of the last queued chunk
+        self.close_after = False
+
+    def parse_requests(self, emulator, now):
+        """Queues the responses to the complete requests of input.
+        Returns False if the connection must be closed."""
+        while True:
+            end = self.input.find('\r\n\r\n')
+            if end < 0:
+                return len(self.input) <= MAX_REQUEST_SIZE
+            head = self.input[:end]
+            self.input = self.input[end + 4:]
+            lines = head.split('\r\n')
+            request_line = lines[0].split()
+            if len(request_line) != 3:
+                return False
+            method, path, version = request_line
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', '0') or '0')
+            if length:
+                # request bodies are ignored
+                if len(self.input) < length:
+                    self.input = head + '\r\n\r\n' + self.input
+                    return True
+                self.input = self.input[length:]
+            if method not in ('GET', 'HEAD'):
+                chunks = [(0.0, response_head(405, [('Allow', 'GET, HEAD')], 0))]
+            else:
+                chunks = emulator.respond(path, headers.get('host', 'localhost'),
+                                          headers.get('if-none-match'))
+            start = max(now, self.last_time)
+            for delay, data in chunks:
+                start += delay
+                self.chunks.append((start, data))
+            self.last_time = start
+            connection = headers.get('connection', '').lower()
+            if connection == 'close' or (version == 'HTTP/1.0'
+                                         and connection != 'keep-alive'):
+                self.close_after = True
+                self.input = ''
+                return True
+
+    def due_output(self, now):
+        """Moves the chunks that can be sent to output.
+        Returns the time of the next chunk, or None."""
+        chunks = self.chunks
+        while chunks and chunks[0][0] <= now:
+            self.output += chunks.popleft()[1]
+        return chunks[0][0] if chunks else None
+
+class Poller:
+    """Readiness of sockets, with epoll or select."""
+
+    def __init__(self):
+        self.epoll = select.epoll() if hasattr(select, 'epoll') else None
+        self.readers = set()
+        self.writers = set()
+
+    def register(self, fd, write=False):
+        if self.epoll:
+            self.epoll.register(fd, select.EPOLLIN | (select.EPOLLOUT if write else 0))
+        self.readers.add(fd)
+        if write:
+            self.writers.add(fd)
+
+    def modify(self, fd, write):
+        if write == (fd in self.writers):
+            return
+        if write:
+            self.writers.add(fd)
+        else:
+            self.writers.discard(fd)
+        if self.epoll:
+            self.epoll.modify(fd, select.EPOLLIN | (select.EPOLLOUT if write else 0))
+
+    def unregister(self, fd):
+        self.readers.discard(fd)
+        self.writers.discard(fd)
+        if self.epoll:
+            self.epoll.unregister(fd)
+
+    def poll(self, timeout):
+        """Returns the lists of file descriptors ready for reading and writing."""
+        if self.epoll:
+            readable, writable = [], []
+            for fd, events in self.epoll.poll(-1 if timeout is None else timeout):
+                if events & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR):
+                    readable.append(fd)
+                if events & select.EPOLLOUT:
+                    writable.append(fd)
+            return readable, writable
+        readable, writable, _ = select.select(self.readers, self.writers, [], timeout)
+        return readable, writable
+
+def serve(listener, emulator):
+    """Runs the event loop of a process, answering the connections
+    accepted on listener."""
+    listener.setblocking(0)
+    poller = Poller()
+    poller.register(listener.fileno())
+    connections = {} # file descriptor -> Connection
+    timers = [] # heap of (time, order, file descriptor) of delayed chunks
+    order = itertools.count()
+
+    def close(fd):
+        connection = connections.pop(fd, None)
+        if connection is not None:
+            poller.unregister(fd)
+            connection.sock.close()
+
+    def flush(fd, now):
+        """Sends what can be sent on connection fd."""
+        connection = connections[fd]
+        next_time = connection.due_output(now)
+        if connection.output:
+            try:
+                sent = connection.sock.send(connection.output)
+                connection.output = connection.output[sent:]
+            except socket.error as error:
+                if error.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    close(fd)
+                    return
+        if not connection.output and not connection.chunks and connection.close_after:
+            close(fd)
+            return
+        poller.modify(fd, bool(connection.output))
+        if next_time is not None and not connection.output:
+            heapq.heappush(timers, (next_time, next(order), fd))
+
+    while True:
+        timeout = None
+        if timers:
+            timeout = max(0.0, timers[0][0] - time.time())
+        try:
+            readable, writable = poller.poll(timeout)
+        except (IOError, select.error) as error:
+            if error.args[0] == errno.EINTR:
+                continue
+            raise
+        now = time.time()
+        for fd in readable:
+            if fd == listener.fileno():
+                while True:
+                    try:
+                        sock, _ = listener.accept()
+                    except socket.error as error:
+                        # no more pending connection, or taken by another process
+                        break
+                    sock.setblocking(0)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    connections[sock.fileno()] = Connection(sock)
+                    poller.register(sock.fileno())
+                continue
+            connection = connections.get(fd)
+            if connection is None:
+                continue
+            try:
+                data = connection.sock.recv(READ_SIZE)
+            except socket.error as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    continue
+                data = ''
+            if not data:
+                close(fd)
+                continue
+            if connection.close_after:
+                continue
+            connection.input += data
+            if not connection.parse_requests(emulator, now):
+                close(fd)
+                continue
+            flush(fd, now)
+        for fd in writable:
+            if fd in connections:
+                flush(fd, now)
+        while timers and timers[0][0] <= now:
+            _, _, fd = heapq.heappop(timers)
+            if fd in connections and not connections[fd].output:
+                flush(fd, now)
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in DANE')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of processes serving requests')
+    parser.add_argument('--message', help='file of the SAND message to serve')
+    parser.add_argument('--error-status', type=int, default=DEFAULT_ERROR_STATUS,
+                        help='status code of /error (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='delay before each response, in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='random variation of the delay, in milliseconds')
+    parser.add_argument('--drip', type=int, default=0,
+                        help='send bodies by chunks of this number of bytes')
+    parser.add_argument('--drip-interval', type=float, default=0.0,
+                        help='delay between two chunks, in milliseconds')
+    parser.add_argument('--malformed', type=float, default=0.0,
+                        help='fraction of messages sent truncated')
+    options = parser.parse_args()
+
+    message = default_message
+    if options.message:
+        with open(options.message, 'rb') as f:
+            message = f.read()
+    emulator = Emulator(message, options.error_status,
+                        Faults(options.latency, options.jitter, options.drip,
+                               options.drip_interval, options.malformed))
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((options.host, options.port))
+    listener.listen(LISTEN_BACKLOG)
+    print 'DANE emulator on http://%s:%d/ (%d processes)' % (
+        options.host, listener.getsockname()[1], options.processes)
+    sys.stdout.flush()
+
+    children = []
+    for _ in range(options.processes - 1):
+        pid = os.fork()
+        if pid == 0:
+            children = None
+            break
+        children.append(pid)
+    try:
+        serve(listener, emulator)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children or ():
+            try:
+                os.kill(pid, 15)
+            except OSError:
+                pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())